@@ -11,9 +11,10 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+from importlib.util import find_spec
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -56,6 +57,7 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 
 MIDDLEWARE = [
+    'subscription.middleware.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -64,6 +66,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'subscription.middleware.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'assignment.urls'
@@ -96,6 +99,37 @@ DATABASES = {
     }
 }
 
+# Read replicas (subscription.routers). For local testing SQLITE_REPLICAS
+# adds SQLite files as replicas, e.g. SQLITE_REPLICAS=replica1.sqlite3,replica2.sqlite3;
+# `manage.py sync_sqlite_replicas` copies the primary into them. Other
+# engines: add the aliases to DATABASES and list them in DATABASE_REPLICAS.
+DATABASE_REPLICAS = []
+for index, name in enumerate(config('SQLITE_REPLICAS', default='', cast=Csv()), 1):
+    DATABASES[f'replica{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / name,
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+# How long a client that wrote keeps reading from the primary; keep it above
+# the replicas' worst replication lag
+REPLICA_PIN_SECONDS = 5
+
+# Databases holding the subscription table, a user's rows on one of them by a
+# stable hash of the user id (subscription.sharding). SQLITE_SHARDS adds SQLite
+# files as extra shards for local testing; run `manage.py migrate --database
+# <alias>` for each. Changing the list moves users between shards.
+SUBSCRIPTION_SHARDS = ['default']
+for index, name in enumerate(config('SQLITE_SHARDS', default='', cast=Csv()), 1):
+    DATABASES[f'shard{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / name,
+    }
+    SUBSCRIPTION_SHARDS.append(f'shard{index}')
+
+DATABASE_ROUTERS = ['subscription.sharding.ShardRouter', 'subscription.routers.ReplicaRouter']
+
 # Custom User Model
 # AUTH_USER_MODEL = 'assignment.CustomUser'
 
@@ -119,6 +153,15 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Logins verify passwords on the bounded hashing pool (subscription.hashing)
+AUTHENTICATION_BACKENDS = ['subscription.hashing.PooledModelBackend']
+
+# Threads hashing passwords (None: one per CPU), and how many logins and
+# registrations may be hashing or queued before the next gets a 503 (None:
+# twice the threads)
+PASSWORD_HASHING_WORKERS = None
+PASSWORD_HASHING_MAX_PENDING = None
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -163,11 +206,17 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'subscription.throttling.AnonRateThrottle',
+        'subscription.throttling.UserRateThrottle',
+        'subscription.throttling.ScopedRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
@@ -176,6 +225,11 @@ REST_FRAMEWORK = {
     },
 }
 
+# MessagePack (Accept / Content-Type: application/msgpack) when msgpack is installed
+if find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('subscription.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('subscription.renderers.MessagePackParser')
+
 # JWT Configuration
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -200,6 +254,72 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
 
+# Per-process Bloom filter in front of the revoked refresh tokens
+# (subscription.revocation): revocations it is sized for (twice the
+# unexpired ones if the table holds more), and the share of never-revoked
+# tokens that still cost a query
+REVOCATION_FILTER_CAPACITY = 1000000
+REVOCATION_FILTER_ERROR_RATE = 0.001
+# Seconds after which a process re-reads recent revocations even though the
+# cache version has not changed (the longest a revocation made elsewhere can
+# go unnoticed)
+REVOCATION_SYNC_INTERVAL = 30
+
+# Cache of user rows behind CachedJWTAuthentication (read endpoints). A
+# deactivated or deleted user is rejected by other processes within TTL seconds.
+JWT_USER_CACHE_SIZE = 10000
+JWT_USER_CACHE_TTL = 60
+
+# Entitlement cache (user -> active plan -> features)
+ENTITLEMENT_CACHE_TIMEOUT = 60 * 15
+
+# Batch entitlement lookups: users resolved per round of IN queries, and the
+# most users one request to /api/v1/entitlements/batch/ may ask for
+ENTITLEMENT_BATCH_CHUNK_SIZE = 1000
+ENTITLEMENT_BATCH_MAX_USERS = 10000
+
+# Rendered plan/feature listings, keyed by catalog version. The version is
+# kept in the default cache, which must be shared when running several workers
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Rendered OpenAPI schema, keyed by a fingerprint of the code (None: until evicted)
+OPENAPI_CACHE_TIMEOUT = None
+
+# Request throttling (subscription.throttling): 'local' counts per process in
+# an LRU of at most THROTTLE_CACHE_SIZE clients; 'cache' shares the counts
+# between workers through the default cache (use a cache server)
+THROTTLE_BACKEND = 'local'
+THROTTLE_CACHE_SIZE = 100000
+
+# Clients allowed to scrape /metrics (None allows everyone)
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Build subscription list pages from values() rows instead of nested
+# serializers (same JSON; False falls back to SubscriptionListSerializer)
+SUBSCRIPTION_LIST_FAST_PATH = True
+
+# Rows fetched per database round trip by the subscription export
+EXPORT_CHUNK_SIZE = 2000
+
+# Idempotency-Key on the write endpoints (subscription.idempotency): how long
+# a response is replayed, and how long a crashed request can hold its key
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+
+# Subscription change events (subscription.outbox), delivered by
+# `manage.py dispatch_outbox` as POSTs to every URL listed here
+OUTBOX_WEBHOOKS = []
+OUTBOX_WEBHOOK_SECRET = None  # signs the bodies (X-Outbox-Signature) when set
+OUTBOX_WEBHOOK_TIMEOUT = 5
+OUTBOX_BATCH_SIZE = 500
+OUTBOX_CONCURRENCY = 8
+# How long a dispatcher holds the events it claimed before another may
+# claim them again (seconds; longer than delivering a batch can take)
+OUTBOX_CLAIM_SECONDS = 300
+# Retry backoff: doubled per failed attempt, capped (seconds)
+OUTBOX_RETRY_DELAY = 5
+OUTBOX_RETRY_MAX_DELAY = 3600
+
 # CORS Configuration (for frontend integration)
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",  # React default
@@ -26,7 +26,11 @@ from rest_framework import permissions #restframework
 from drf_yasg.views import get_schema_view #swagger
 from drf_yasg import openapi  #swagger
 
-schema_view = get_schema_view(
+from subscription.schema import cached_schema_view
+from subscription.views import metrics
+
+# Spec formats are served pre-rendered, see subscription/schema.py
+schema_view = cached_schema_view(get_schema_view(
    openapi.Info(
       title="Subscription API",
       default_version='v1',
@@ -34,22 +38,28 @@ schema_view = get_schema_view(
    ),
    public=True,
    permission_classes=(permissions.AllowAny,),
-)
+))
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     # API Routes
     path('api/v1/', include('subscription.urls')),
     
+    # Async read endpoints (serve with an ASGI server, see assignment/asgi.py)
+    path('api/v1/async/', include('subscription.async_urls')),
+    
     # Authentication endpoints (JWT)
     path('api/v1/auth/', include('subscription.auth_urls')),
     
     # API Documentation
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('swagger.json', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger.yaml', schema_view.without_ui(cache_timeout=0), name='schema-yaml'),
+    path('swagger.json', schema_view.without_ui(cache_timeout=0), {'format': '.json'}, name='schema-json'),
+    path('swagger.yaml', schema_view.without_ui(cache_timeout=0), {'format': '.yaml'}, name='schema-yaml'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     
+    # Prometheus metrics (per-route request histograms)
+    path('metrics', metrics, name='metrics'),
+    
     # DRF Browsable API (for development)
     path('api-auth/', include('rest_framework.urls')),
 ]
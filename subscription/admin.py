@@ -1,4 +1,8 @@
 from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.http import QueryDict
+from . import sharding
 from .models import Feature, Plan, Subscription
 
 @admin.register(Feature)
@@ -12,9 +16,74 @@ class PlanAdmin(admin.ModelAdmin):
     search_fields = ['name']
     filter_horizontal = ['features']
 
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Which shard the changelist shows; there is no "All", rows are per shard"""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.shards()]
+
+    def choices(self, changelist):
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': (self.value() or sharding.shards()[0]) == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        # SubscriptionAdmin.get_queryset() already picked the shard
+        return queryset
+
+
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'plan', 'start_date', 'is_active']
     list_filter = ['is_active', 'start_date', 'plan']
     search_fields = ['user__email', 'user__username', 'plan__name']
-    readonly_fields = ['start_date']
\ No newline at end of file
+    readonly_fields = ['start_date']
+
+    # With several shards the changelist shows one shard at a time (?shard=)
+    # and nothing joins users or plans, which live on default.
+
+    def shard(self, request):
+        aliases = sharding.shards()
+        alias = request.GET.get('shard')
+        if alias is None:
+            # The change form carries the changelist's query string along
+            alias = QueryDict(request.GET.get('_changelist_filters', '')).get('shard')
+        return alias if alias in aliases else aliases[0]
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if sharding.is_sharded():
+            queryset = queryset.using(self.shard(request))
+        return queryset
+
+    def get_list_filter(self, request):
+        if sharding.is_sharded():
+            return [ShardListFilter, *super().get_list_filter(request)]
+        return super().get_list_filter(request)
+
+    def get_list_select_related(self, request):
+        return [] if sharding.is_sharded() else super().get_list_select_related(request)
+
+    def get_readonly_fields(self, request, obj=None):
+        fields = super().get_readonly_fields(request, obj)
+        if sharding.is_sharded() and obj is not None:
+            # A new user would belong on another shard
+            fields = [*fields, 'user']
+        return fields
+
+    def get_search_results(self, request, queryset, search_term):
+        if not sharding.is_sharded() or not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        # Resolve the joined fields on default, then filter the shard by id
+        users = get_user_model().objects.filter(
+            Q(email__icontains=search_term) | Q(username__icontains=search_term)
+        ).values_list('id', flat=True)
+        plans = Plan.objects.filter(name__icontains=search_term).values_list('id', flat=True)
+        queryset = queryset.filter(Q(user_id__in=list(users)) | Q(plan_id__in=list(plans)))
+        return queryset, False
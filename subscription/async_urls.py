@@ -0,0 +1,12 @@
+from django.urls import path
+from . import async_views
+
+app_name = 'async'
+
+# Async twins of the read endpoints in subscription/urls.py, for ASGI servers
+urlpatterns = [
+    path('features/', async_views.feature_list, name='feature-list'),
+    path('plans/', async_views.plan_list, name='plan-list'),
+    path('subscriptions/', async_views.subscription_list, name='subscription-list'),
+    path('entitlements/', async_views.entitlement_detail, name='entitlement-detail'),
+]
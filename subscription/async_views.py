@@ -0,0 +1,152 @@
+"""
+Native async versions of the hot read endpoints, for ASGI deployments.
+
+DRF views are sync only, so under ASGI each of them costs a thread hop for
+the whole request. These are plain Django ``async def`` views that do what
+their DRF counterparts do for a JSON client: JWT (or session)
+authentication, IsAuthenticated, the default throttles, page-number
+pagination and the same serializers and JSON renderer, so the body is the
+same bytes. Database and cache access goes through the async ORM
+(``aiterator``, ``afirst``, ``acount``) and the async cache API.
+
+Only JSON is served; the browsable API stays on the sync endpoints.
+"""
+from functools import wraps
+from django.db.models import Prefetch
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework.views import APIView
+from . import catalog, sharding
+from .authentication import CachedJWTAuthentication
+from .entitlements import aget_user_entitlements
+from .models import Feature, Plan, Subscription
+from .serializers import FeatureSerializer, PlanSerializer, SubscriptionListSerializer
+
+renderer = JSONRenderer()
+
+
+def _render(data, status=200, headers=None):
+    return HttpResponse(
+        renderer.render(data), status=status, content_type='application/json', headers=headers
+    )
+
+
+def _error(exc):
+    data = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers['WWW-Authenticate'] = CachedJWTAuthentication().authenticate_header(None)
+    if getattr(exc, 'wait', None):
+        headers['Retry-After'] = str(int(exc.wait))
+    return _render(data, status=exc.status_code, headers=headers)
+
+
+async def _authenticate(request):
+    """JWT, then the session; raise unless the user is authenticated and not throttled"""
+    result = await CachedJWTAuthentication().aauthenticate(request)
+    if result is not None:
+        request.user, request.auth = result
+    else:
+        request.user = await request.auser()
+    if not request.user.is_authenticated:
+        raise exceptions.NotAuthenticated()
+
+    # APIView's class attribute rather than the setting, so that whatever
+    # adjusts the throttles of the DRF views adjusts these as well
+    for throttle_class in APIView.throttle_classes:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, None):
+            raise exceptions.Throttled(throttle.wait())
+
+
+def async_api_view(view):
+    """Turn DRF exceptions raised by an async view into DRF-shaped JSON responses"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return _error(exceptions.MethodNotAllowed(request.method))
+        try:
+            await _authenticate(request)
+            return await view(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return _error(exc)
+    return wrapper
+
+
+async def _paginate(request, queryset, serializer_class):
+    """PageNumberPagination's page, read with acount() and aiterator()"""
+    page_size = api_settings.PAGE_SIZE
+    try:
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        number = 0
+    count = await queryset.acount()
+    pages = max(1, -(-count // page_size))
+    if not 1 <= number <= pages:
+        raise exceptions.NotFound('Invalid page.')
+
+    start = (number - 1) * page_size
+    rows = [row async for row in queryset[start:start + page_size].aiterator(chunk_size=page_size)]
+    url = request.build_absolute_uri()
+    previous = None
+    if number > 1:
+        previous = remove_query_param(url, 'page') if number == 2 else replace_query_param(url, 'page', number - 1)
+    return {
+        'count': count,
+        'next': replace_query_param(url, 'page', number + 1) if number < pages else None,
+        'previous': previous,
+        'results': serializer_class(rows, many=True).data,
+    }
+
+
+async def _catalog_listing(request, queryset, serializer_class):
+    """CatalogCacheMixin for async views"""
+    version = await catalog.aget_version()
+    etag = catalog.etag(version, 'json')
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    key = catalog.response_key(version, 'json', request.get_full_path())
+    cached = await catalog.aget_response(key)
+    if cached is not None:
+        content_type, content = cached
+        return HttpResponse(content, content_type=content_type, headers={'ETag': etag})
+
+    response = _render(await _paginate(request, queryset, serializer_class), headers={'ETag': etag})
+    await catalog.aset_response(key, (response['Content-Type'], response.content))
+    return response
+
+
+@async_api_view
+async def feature_list(request):
+    """List all features"""
+    return await _catalog_listing(request, Feature.objects.order_by('id'), FeatureSerializer)
+
+
+@async_api_view
+async def plan_list(request):
+    """List all available plans with features"""
+    return await _catalog_listing(
+        request, Plan.objects.prefetch_related('features').order_by('id'), PlanSerializer
+    )
+
+
+@async_api_view
+async def subscription_list(request):
+    """List the authenticated user's subscriptions, newest first (page-number pagination only)"""
+    queryset = Subscription.objects.filter(user=request.user).order_by('-start_date', '-id')
+    # Plans cannot be joined from a subscription shard
+    queryset = queryset.prefetch_related('plan') if sharding.is_sharded() else queryset.select_related('plan')
+    queryset = queryset.prefetch_related(Prefetch('plan__features', queryset=Feature.objects.order_by('id')))
+    return _render(await _paginate(request, queryset, SubscriptionListSerializer))
+
+
+@async_api_view
+async def entitlement_detail(request):
+    """Features the authenticated user is currently entitled to (served from cache)"""
+    return _render(await aget_user_entitlements(request.user.id))
@@ -3,9 +3,10 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenRefreshView
 from django.contrib.auth import authenticate
 from django.utils.decorators import method_decorator
-from .serializers import UserRegistrationSerializer, UserLoginSerializer
+from .serializers import RevocableTokenRefreshSerializer, UserRegistrationSerializer, UserLoginSerializer
 
 
 class UserRegistrationAPIView(generics.CreateAPIView):
@@ -33,6 +34,7 @@ class UserLoginAPIView(generics.GenericAPIView):
     """User login endpoint"""
     serializer_class = UserLoginSerializer
     permission_classes = [AllowAny]
+    throttle_scope = 'login'
     
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -55,4 +57,9 @@ class UserLoginAPIView(generics.GenericAPIView):
         else:
             return Response({
                 'error': 'Invalid credentials'
-            }, status=status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+            }, status=status.HTTP_401_UNAUTHORIZED)
+
+
+class TokenRefreshAPIView(TokenRefreshView):
+    """Refresh token endpoint; a rotated refresh token is revoked and cannot be used again"""
+    serializer_class = RevocableTokenRefreshSerializer
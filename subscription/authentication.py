@@ -0,0 +1,96 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .caching import LRUCache
+
+User = get_user_model()
+
+# Every column but the password hash, which stays deferred on the instances
+# built from here. Model.from_db expects the values in concrete field order.
+USER_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields if field.attname != 'password'
+)
+
+# str(user_id) -> (db alias, row values). Entries live at most
+# JWT_USER_CACHE_TTL seconds, which bounds how long a deactivated or
+# deleted user can keep using a still-valid access token on another process.
+user_rows = LRUCache(
+    maxsize=getattr(settings, 'JWT_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'JWT_USER_CACHE_TTL', 60),
+)
+
+
+def forget_user(user_id):
+    user_rows.delete(str(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication for hot read endpoints.
+
+    The user id comes from the token claims and the rest of the user from an
+    in-process cache of user rows, so a warm request does no user query. The
+    returned user is a regular model instance with the password deferred;
+    saving it only writes the cached fields back.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Needs the password hash on every request
+            return super().get_user(validated_token)
+
+        user_id = self._user_id(validated_token)
+        cached = user_rows.get(str(user_id))
+        if cached is None:
+            queryset = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+            cached = self._remember(user_id, queryset, queryset.values_list(*USER_FIELDS).first())
+        return self._build_user(cached)
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views: the token check is CPU only, a cache miss uses the async ORM"""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return await sync_to_async(super().get_user)(validated_token)
+
+        user_id = self._user_id(validated_token)
+        cached = user_rows.get(str(user_id))
+        if cached is None:
+            queryset = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id})
+            cached = self._remember(user_id, queryset, await queryset.values_list(*USER_FIELDS).afirst())
+        return self._build_user(cached)
+
+    def _user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+    def _remember(self, user_id, queryset, values):
+        if values is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        cached = (queryset.db, values)
+        # simplejwt stores the claim as a string; key on that form throughout
+        user_rows.set(str(user_id), cached)
+        return cached
+
+    def _build_user(self, cached):
+        db, values = cached
+        user = User.from_db(db, USER_FIELDS, values)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user
@@ -0,0 +1,166 @@
+"""Helpers shared by the ``bench_*`` management commands."""
+import json
+import math
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+from . import sharding
+from .models import Feature, Plan, Subscription
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction (one per subscription shard) that is always rolled back"""
+    try:
+        with sharding.atomic_all():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def bench_host():
+    """A host name that passes ALLOWED_HOSTS"""
+    hosts = [host for host in settings.ALLOWED_HOSTS if host and '*' not in host and not host.startswith('.')]
+    return hosts[0] if hosts else 'localhost'
+
+
+def bench_client(user=None):
+    """A test client that passes ALLOWED_HOSTS, authenticated as ``user`` if given"""
+    client = Client(HTTP_HOST=bench_host())
+    if user is not None:
+        client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+    return client
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(timings, queries=None, wall=None):
+    """
+    Summarize per-call durations (seconds) as a JSON-friendly dict.
+
+    Throughput is over ``wall`` seconds when the calls overlapped, else over
+    the sum of the durations.
+    """
+    total = wall if wall is not None else sum(timings)
+    summary = {
+        'requests': len(timings),
+        'throughput_rps': round(len(timings) / total, 2) if total else None,
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+    }
+    if queries is not None:
+        summary['queries_per_request'] = round(statistics.mean(queries), 2)
+    return summary
+
+
+def measure(func, iterations, warmup=1):
+    """Call ``func`` repeatedly and summarize its latency and query count"""
+    for _ in range(warmup):
+        func()
+
+    timings, queries = [], []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        queries.append(len(captured))
+    return summarize(timings, queries)
+
+
+def seed_subscriptions(username, rows, plan_count, features_per_plan):
+    """A user with ``rows`` subscriptions spread over ``plan_count`` plans with their own features"""
+    user = get_user_model().objects.create_user(username=username, email=f'{username}@example.com')
+    features = Feature.objects.bulk_create(
+        Feature(name=f'Benchmark Feature {i}') for i in range(plan_count * features_per_plan)
+    )
+    plans = Plan.objects.bulk_create(Plan(name=f'Benchmark Plan {i}') for i in range(plan_count))
+    Plan.features.through.objects.bulk_create(
+        Plan.features.through(plan_id=plan.pk, feature_id=features[i * features_per_plan + j].pk)
+        for i, plan in enumerate(plans)
+        for j in range(features_per_plan)
+    )
+    Subscription.objects.bulk_create(
+        Subscription(user=user, plan=plans[i % plan_count], is_active=False) for i in range(rows)
+    )
+    return user
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    # Concurrent senders would overflow the default backlog of 5
+    request_queue_size = 128
+
+
+class StubWebhookServer:
+    """
+    A local HTTP server standing in for a webhook receiver.
+
+    Records the body and headers of every POST and answers ``status``
+    after ``delay`` seconds. Use it as a context manager; ``url`` is where
+    it listens.
+    """
+
+    def __init__(self, status=200, delay=0):
+        self.status = status
+        self.delay = delay
+        self.requests = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                content = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if stub.delay:
+                    time.sleep(stub.delay)
+                with stub._lock:
+                    stub.requests.append((content, dict(self.headers)))
+                self.send_response(stub.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _StubHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def events(self):
+        """Every event received, in the order the requests arrived"""
+        with self._lock:
+            return [event for content, _ in self.requests for event in json.loads(content)['events']]
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
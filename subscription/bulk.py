@@ -0,0 +1,10 @@
+"""Helpers for bulk loading (generate_dataset, import_data)."""
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """Yield lists of at most ``size`` items without materializing ``iterable``"""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
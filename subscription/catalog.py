@@ -0,0 +1,72 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from . import routers
+
+VERSION_KEY = 'catalog:version'
+CHANGED_KEY = 'catalog:changed'
+
+
+def _seed():
+    # Seeding from the clock means a version lost to cache eviction is never
+    # handed out again, so bodies cached under an old version cannot resurface.
+    return time.time_ns() // 1000
+
+
+def get_version():
+    """Current version of the plan/feature catalog"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _seed(), timeout=None)
+        version = cache.get(VERSION_KEY, _seed())
+    return version
+
+
+async def aget_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, _seed(), timeout=None)
+        version = await cache.aget(VERSION_KEY, _seed())
+    return version
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, _seed(), timeout=None)
+    if routers.replicas():
+        # Replicas may not have the change yet, and a listing read from one
+        # would be cached under the new version
+        cache.set(CHANGED_KEY, 1, routers.pin_seconds())
+
+
+def recently_changed():
+    """Whether the catalog changed within the replica pin window"""
+    return cache.get(CHANGED_KEY) is not None
+
+
+def etag(version, format):
+    return f'"catalog-{version}-{format}"'
+
+
+def response_key(version, format, full_path):
+    digest = hashlib.md5(full_path.encode(), usedforsecurity=False).hexdigest()
+    return f'catalog:response:{version}:{format}:{digest}'
+
+
+def get_response(key):
+    return cache.get(key)
+
+
+def set_response(key, content):
+    cache.set(key, content, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60))
+
+
+async def aget_response(key):
+    return await cache.aget(key)
+
+
+async def aset_response(key, content):
+    await cache.aset(key, content, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60))
@@ -0,0 +1,41 @@
+"""
+Deployment checks (``manage.py check --deploy``) for the shared state the
+app keeps in the default cache. Development runs one process, where the
+in-memory default cache is fine, so these are not run by plain ``check``.
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Backends that keep entries in the process that wrote them
+LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def default_cache_is_local():
+    return settings.CACHES['default']['BACKEND'] in LOCAL_CACHE_BACKENDS
+
+
+@register(Tags.caches, deploy=True)
+def check_catalog_cache(app_configs, **kwargs):
+    if not default_cache_is_local():
+        return []
+    return [Warning(
+        'The catalog version is kept in a per-process cache.',
+        hint='With several workers, plan and feature listings (and 304s) stay stale in every worker but the '
+             'one that handled a change. Configure a shared cache server as the default cache.',
+        id='subscription.W001',
+    )]
+
+
+@register(Tags.caches, deploy=True)
+def check_revocation_cache(app_configs, **kwargs):
+    if not default_cache_is_local():
+        return []
+    return [Warning(
+        'The refresh token revocation version is kept in a per-process cache.',
+        hint='With several workers, a token revoked in one worker is still accepted by the others for up to '
+             'REVOCATION_SYNC_INTERVAL seconds. Configure a shared cache server as the default cache.',
+        id='subscription.W002',
+    )]
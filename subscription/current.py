@@ -0,0 +1,84 @@
+"""
+CurrentSubscription pointers: each user's active subscription by user id.
+
+Every path that activates or deactivates a subscription updates the
+pointer in the same transaction (on the same shard) as the Subscription
+rows, so reading a user's current plan or locking their active row is a
+primary-key lookup. reconcile() finds and repairs pointers that disagree
+with the ``is_active`` flags, which remain the source of truth.
+"""
+from django.db import transaction
+from django.db.models import F
+from . import sharding
+from .models import CurrentSubscription, Subscription
+
+
+def point(subscriptions, using=None):
+    """Point each subscription's user at it (one upsert per shard)"""
+    pointers = [
+        CurrentSubscription(user_id=subscription.user_id, subscription_id=subscription.pk,
+                            plan_id=subscription.plan_id)
+        for subscription in subscriptions
+    ]
+    queryset = CurrentSubscription.objects if using is None else CurrentSubscription.objects.using(using)
+    queryset.bulk_create(
+        pointers, update_conflicts=True, unique_fields=['user'], update_fields=['subscription', 'plan']
+    )
+
+
+def lock(user_id):
+    """``(subscription_id, plan_id)`` of the user's active subscription, locked, or None"""
+    return CurrentSubscription.objects.select_for_update()\
+        .filter(user_id=user_id)\
+        .values_list('subscription_id', 'plan_id').first()
+
+
+def lock_unpointed(user_id):
+    """
+    ``(subscription_id, plan_id)`` of an active subscription the user has no
+    pointer to, locked, or None. Such rows are drift (a QuerySet.update(),
+    a bulk edit; see reconcile()); writers that find no pointer look here
+    before giving up or inserting, so the drift cannot wedge the user.
+    """
+    return Subscription.objects.select_for_update()\
+        .filter(user_id=user_id, is_active=True)\
+        .values_list('pk', 'plan_id').first()
+
+
+def clear(user_id):
+    CurrentSubscription.objects.filter(user_id=user_id).delete()
+
+
+def reconcile(fix=True):
+    """
+    Compare the pointers with the active subscriptions on every shard.
+
+    Returns ``[(user_id, pointed_to, active)]`` subscription ids (None for
+    no pointer / no active row) for the users that disagree and, with
+    ``fix``, rewrites their pointers from the active rows.
+    """
+    drift = []
+    for alias in sharding.shards():
+        pointers = CurrentSubscription.objects.using(alias)
+        subscriptions = Subscription.objects.using(alias)
+        with transaction.atomic(using=alias):
+            # Pointers to an inactive row or with a stale plan copy, and
+            # active rows nothing points to
+            users = set(
+                pointers.exclude(subscription__is_active=True, plan_id=F('subscription__plan_id'))
+                .values_list('user_id', flat=True)
+            )
+            users.update(subscriptions.filter(is_active=True, current__isnull=True).values_list('user_id', flat=True))
+            if not users:
+                continue
+            # Writers lock the pointer before changing the rows it covers
+            pointed = dict(
+                pointers.select_for_update().filter(user_id__in=users).values_list('user_id', 'subscription_id')
+            )
+            active = list(subscriptions.filter(user_id__in=users, is_active=True))
+            actual = {subscription.user_id: subscription.pk for subscription in active}
+            drift += [(user_id, pointed.get(user_id), actual.get(user_id)) for user_id in sorted(users)]
+            if fix:
+                pointers.filter(user_id__in=users).delete()
+                point(active, using=alias)
+    return drift
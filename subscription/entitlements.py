@@ -0,0 +1,270 @@
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from . import sharding
+from .bulk import chunked
+from .models import CurrentSubscription, Plan
+
+# Cached as the user's plan id when the user has no active subscription,
+# so that unsubscribed users are answered from cache as well.
+NO_PLAN = 0
+
+
+def _timeout():
+    return getattr(settings, 'ENTITLEMENT_CACHE_TIMEOUT', 60 * 15)
+
+
+def user_cache_key(user_id):
+    return f'entitlements:user:{user_id}'
+
+
+def plan_cache_key(plan_id):
+    return f'entitlements:plan:{plan_id}'
+
+
+# Entries are stored under their key's generation, read before the rows they
+# are built from; invalidating bumps the generation. A reader that loaded
+# the rows before a change committed writes to the old generation, which
+# nobody reads any more, instead of putting the stale entry back.
+
+def _generation_key(key):
+    return f'{key}:generation'
+
+
+def _seed():
+    # A generation lost to eviction is never handed out again (see catalog)
+    return time.time_ns() // 1000
+
+
+def _generations(keys):
+    """``{key: generation}`` for cache keys"""
+    generation_keys = {_generation_key(key): key for key in keys}
+    found = cache.get_many(generation_keys)
+    missing = [generation_key for generation_key in generation_keys if generation_key not in found]
+    if missing:
+        for generation_key in missing:
+            cache.add(generation_key, _seed(), None)
+        found.update(cache.get_many(missing))
+    return {generation_keys[generation_key]: generation for generation_key, generation in found.items()}
+
+
+async def _agenerations(keys):
+    generation_keys = {_generation_key(key): key for key in keys}
+    found = await cache.aget_many(generation_keys)
+    missing = [generation_key for generation_key in generation_keys if generation_key not in found]
+    if missing:
+        for generation_key in missing:
+            await cache.aadd(generation_key, _seed(), None)
+        found.update(await cache.aget_many(missing))
+    return {generation_keys[generation_key]: generation for generation_key, generation in found.items()}
+
+
+def _entry_key(key, generation):
+    return f'{key}:{generation}'
+
+
+def _invalidate(keys):
+    for key in keys:
+        try:
+            cache.incr(_generation_key(key))
+        except ValueError:
+            # No generation, so nothing is cached under one
+            pass
+
+
+def get_plan_entitlements(plan_id):
+    """Return ``{'id', 'name', 'features'}`` for a plan, or None if it does not exist"""
+    key = plan_cache_key(plan_id)
+    key = _entry_key(key, _generations([key])[key])
+    plan = cache.get(key)
+    if plan is not None:
+        return plan
+
+    plan = _plan_from_rows(plan_id, list(_plan_rows(plan_id)))
+    if plan is not None:
+        cache.set(key, plan, _timeout())
+    return plan
+
+
+async def aget_plan_entitlements(plan_id):
+    key = plan_cache_key(plan_id)
+    key = _entry_key(key, (await _agenerations([key]))[key])
+    plan = await cache.aget(key)
+    if plan is not None:
+        return plan
+
+    plan = _plan_from_rows(plan_id, [row async for row in _plan_rows(plan_id)])
+    if plan is not None:
+        await cache.aset(key, plan, _timeout())
+    return plan
+
+
+def _plan_rows(plan_id):
+    return Plan.objects.filter(pk=plan_id)\
+        .values_list('name', 'features__id', 'features__name')\
+        .order_by('features__id')
+
+
+def _plan_from_rows(plan_id, rows):
+    if not rows:
+        return None
+    return {
+        'id': plan_id,
+        'name': rows[0][0],
+        'features': [
+            {'id': feature_id, 'name': feature_name}
+            for _, feature_id, feature_name in rows
+            if feature_id is not None
+        ],
+    }
+
+
+def _current_plan_id(user_id):
+    # A primary-key lookup on the user's pointer
+    return CurrentSubscription.objects.filter(user_id=user_id).values_list('plan_id', flat=True)
+
+
+def get_active_plan_id(user_id):
+    """Return the id of the user's active plan, or None"""
+    key = user_cache_key(user_id)
+    key = _entry_key(key, _generations([key])[key])
+    plan_id = cache.get(key)
+    if plan_id is None:
+        plan_id = _current_plan_id(user_id).first() or NO_PLAN
+        cache.set(key, plan_id, _timeout())
+    return plan_id if plan_id != NO_PLAN else None
+
+
+async def aget_active_plan_id(user_id):
+    key = user_cache_key(user_id)
+    key = _entry_key(key, (await _agenerations([key]))[key])
+    plan_id = await cache.aget(key)
+    if plan_id is None:
+        plan_id = await _current_plan_id(user_id).afirst() or NO_PLAN
+        await cache.aset(key, plan_id, _timeout())
+    return plan_id if plan_id != NO_PLAN else None
+
+
+def get_user_entitlements(user_id):
+    """
+    Resolve the plan and features a user is entitled to right now.
+
+    Both the user -> plan mapping and the plan -> features mapping are cached,
+    so a warm lookup does not touch the database.
+    """
+    plan_id = get_active_plan_id(user_id)
+    plan = get_plan_entitlements(plan_id) if plan_id else None
+    return _entitlements(user_id, plan)
+
+
+async def aget_user_entitlements(user_id):
+    """get_user_entitlements() for async views"""
+    plan_id = await aget_active_plan_id(user_id)
+    plan = await aget_plan_entitlements(plan_id) if plan_id else None
+    return _entitlements(user_id, plan)
+
+
+def _entitlements(user_id, plan):
+    if plan is None:
+        return {'user_id': user_id, 'plan': None, 'features': []}
+    return {
+        'user_id': user_id,
+        'plan': {'id': plan['id'], 'name': plan['name']},
+        'features': plan['features'],
+    }
+
+
+def batch_chunk_size():
+    return getattr(settings, 'ENTITLEMENT_BATCH_CHUNK_SIZE', 1000)
+
+
+def iter_user_entitlements(user_ids=(), emails=()):
+    """
+    Entitlements of many users, yielded lazily in input order.
+
+    Users are taken by id or by email. Each chunk of ENTITLEMENT_BATCH_CHUNK_SIZE
+    users costs a fixed number of queries, skipping whatever the cache
+    already has: one IN lookup of the users, one of their CurrentSubscription
+    pointers per shard and one of the plans and features not cached yet.
+    Unknown users yield ``{'user_id' or 'email': ..., 'error': 'unknown user'}``
+    and an email more than one user has ``'error': 'ambiguous email'``, rather
+    than the entitlements of an arbitrary one of them; results for emails
+    carry the email as well.
+    """
+    size = batch_chunk_size()
+    for chunk in chunked(user_ids, size):
+        known = set(get_user_model().objects.filter(id__in=chunk).values_list('id', flat=True))
+        yield from _batch(chunk, known, lambda user_id: {'user_id': user_id}, lambda user_id: user_id)
+    for chunk in chunked(emails, size):
+        ids, ambiguous = {}, set()
+        for email, user_id in get_user_model().objects.filter(email__in=chunk).values_list('email', 'id'):
+            if email in ids:
+                ambiguous.add(email)
+            ids[email] = user_id
+        for email in ambiguous:
+            del ids[email]
+        yield from _batch(chunk, ids, lambda email: {'email': email}, ids.get, ambiguous)
+
+
+def _batch(keys, known, describe, user_id_of, ambiguous=()):
+    user_ids = [user_id_of(key) for key in keys if key in known]
+    plan_ids = _active_plan_ids(user_ids)
+    plans = _plans(set(plan_ids.values()) - {NO_PLAN})
+    for key in keys:
+        if key in ambiguous:
+            yield {**describe(key), 'error': 'ambiguous email'}
+            continue
+        if key not in known:
+            yield {**describe(key), 'error': 'unknown user'}
+            continue
+        user_id = user_id_of(key)
+        entitlements = _entitlements(user_id, plans.get(plan_ids[user_id]))
+        yield {**describe(key), **entitlements}
+
+
+def _active_plan_ids(user_ids):
+    keys = {user_cache_key(user_id): user_id for user_id in user_ids}
+    keys = {_entry_key(key, generation): keys[key] for key, generation in _generations(keys).items()}
+    entry_keys = {user_id: key for key, user_id in keys.items()}
+    plan_ids = {keys[key]: plan_id for key, plan_id in cache.get_many(keys).items()}
+    missing = [user_id for user_id in user_ids if user_id not in plan_ids]
+    if missing:
+        found = {}
+        for alias, ids in sharding.group_by_shard(missing, user_id=lambda user_id: user_id).items():
+            found.update(
+                CurrentSubscription.objects.using(alias).filter(user_id__in=ids).values_list('user_id', 'plan_id')
+            )
+        resolved = {user_id: found.get(user_id, NO_PLAN) for user_id in missing}
+        cache.set_many({entry_keys[user_id]: plan_id for user_id, plan_id in resolved.items()}, _timeout())
+        plan_ids.update(resolved)
+    return plan_ids
+
+
+def _plans(plan_ids):
+    keys = {plan_cache_key(plan_id): plan_id for plan_id in plan_ids}
+    keys = {_entry_key(key, generation): keys[key] for key, generation in _generations(keys).items()}
+    entry_keys = {plan_id: key for key, plan_id in keys.items()}
+    plans = {keys[key]: plan for key, plan in cache.get_many(keys).items()}
+    missing = plan_ids - plans.keys()
+    if missing:
+        rows = {}
+        for row in Plan.objects.filter(pk__in=missing)\
+                .values_list('id', 'name', 'features__id', 'features__name').order_by('id', 'features__id'):
+            rows.setdefault(row[0], []).append(row[1:])
+        resolved = {plan_id: _plan_from_rows(plan_id, plan_rows) for plan_id, plan_rows in rows.items()}
+        cache.set_many({entry_keys[plan_id]: plan for plan_id, plan in resolved.items()}, _timeout())
+        plans.update(resolved)
+    return plans
+
+
+def invalidate_user(user_id):
+    _invalidate([user_cache_key(user_id)])
+
+
+def invalidate_users(user_ids):
+    _invalidate([user_cache_key(user_id) for user_id in user_ids])
+
+
+def invalidate_plans(plan_ids):
+    _invalidate([plan_cache_key(plan_id) for plan_id in plan_ids])
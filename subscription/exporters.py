@@ -0,0 +1,115 @@
+"""
+Streaming export of the subscription table (see SubscriptionExportAPIView
+and the export_subscriptions command).
+
+Rows come from a values_list() projection read with .iterator(), so only
+``chunk_size`` rows are held at a time, and are encoded into NDJSON or CSV
+one chunk per yielded string. With several subscription shards the shards
+are exported one after the other, and the emails and plan names of each
+chunk are looked up on default. Subscription ids are only unique per shard,
+so every row carries its shard's alias: (shard, id) identifies a row.
+"""
+import csv
+import json
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from . import sharding
+from .bulk import chunked
+from .models import Plan, Subscription
+
+User = get_user_model()
+
+# Output column -> lookup (None: filled in by the exporter)
+COLUMNS = {
+    'id': 'id',
+    'shard': None,
+    'user_id': 'user_id',
+    'user_email': 'user__email',
+    'plan_id': 'plan_id',
+    'plan_name': 'plan__name',
+    'start_date': 'start_date',
+    'is_active': 'is_active',
+}
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def export_rows(is_active=None, plan=None, start_date_from=None, start_date_to=None):
+    """Tuples in COLUMNS order, by id (by shard, then id), streamed from the database"""
+    queryset = Subscription.objects.order_by('id')
+    if is_active is not None:
+        queryset = queryset.filter(is_active=is_active)
+    if plan is not None:
+        queryset = queryset.filter(plan_id=plan)
+    if start_date_from is not None:
+        queryset = queryset.filter(start_date__gte=start_date_from)
+    if start_date_to is not None:
+        queryset = queryset.filter(start_date__lt=start_date_to)
+    if sharding.is_sharded():
+        return _sharded_rows(queryset)
+    alias = sharding.shards()[0]
+    rows = queryset.values_list(*[lookup for lookup in COLUMNS.values() if lookup]).iterator(chunk_size=chunk_size())
+    return ((pk, alias, *row) for pk, *row in rows)
+
+
+def _sharded_rows(queryset):
+    size = chunk_size()
+    for alias in sharding.shards():
+        rows = queryset.using(alias)\
+            .values_list('id', 'user_id', 'plan_id', 'start_date', 'is_active').iterator(chunk_size=size)
+        for chunk in chunked(rows, size):
+            emails = dict(User.objects.filter(id__in={row[1] for row in chunk}).values_list('id', 'email'))
+            plan_names = dict(Plan.objects.filter(id__in={row[2] for row in chunk}).values_list('id', 'name'))
+            for pk, user_id, plan_id, start_date, is_active in chunk:
+                yield pk, alias, user_id, emails.get(user_id), plan_id, plan_names.get(plan_id), start_date, is_active
+
+
+class _Echo:
+    """File-like object for csv.writer that hands the line back instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+_START_DATE = list(COLUMNS).index('start_date')
+
+
+def _prepare(row):
+    row = list(row)
+    row[_START_DATE] = row[_START_DATE].isoformat()
+    return row
+
+
+def _ndjson_line(row):
+    return json.dumps(dict(zip(COLUMNS, row)), separators=(',', ':')) + '\n'
+
+
+def encode(rows, output):
+    """Yield the export as strings of up to one chunk of rows each"""
+    if output == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(COLUMNS)
+        encode_row = writer.writerow
+    else:
+        encode_row = _ndjson_line
+
+    size = chunk_size()
+    lines = []
+    for row in rows:
+        lines.append(encode_row(_prepare(row)))
+        if len(lines) >= size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def export(output='ndjson', **filters):
+    return encode(export_rows(**filters), output)
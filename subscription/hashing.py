@@ -0,0 +1,190 @@
+"""
+Password hashing and verification on a bounded worker pool.
+
+PBKDF2 (and the other hashers) take tens of milliseconds of CPU per call.
+Run on the request workers, a burst of logins or registrations keeps every
+worker busy hashing and the other endpoints wait behind them. Here the
+hashing runs on PASSWORD_HASHING_WORKERS threads instead (hashlib releases
+the GIL while it hashes, so the threads run in parallel and requests
+in other threads keep the interpreter), and at most
+PASSWORD_HASHING_MAX_PENDING calls (by default twice the workers: one
+hashing and one queued per thread) may be running or queued. Once that
+many are, the next caller is refused straight away with HashingUnavailable
+(503 with Retry-After) rather than queueing behind the others.
+
+``check_password``/``make_password`` block the calling request thread until
+the result is ready, so the limit is also how many request threads a burst
+of logins can tie up. PooledModelBackend routes ``authenticate()`` through
+the pool.
+
+Each call adds ``hash_wait`` (time queued) and ``hash`` (time hashing)
+phases to the request's Server-Timing and route histograms; render()
+adds process-wide histograms, the current depth and the rejection count to
+/metrics.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import perf_counter
+from django.conf import settings
+from django.contrib.auth import get_user_model, hashers
+from django.contrib.auth.backends import ModelBackend
+from rest_framework import exceptions, status
+from . import instrumentation
+
+
+def workers():
+    return getattr(settings, 'PASSWORD_HASHING_WORKERS', None) or os.cpu_count() or 1
+
+
+def max_pending():
+    return getattr(settings, 'PASSWORD_HASHING_MAX_PENDING', None) or 2 * workers()
+
+
+class HashingUnavailable(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins and registrations in progress, try again shortly.'
+    default_code = 'hashing_unavailable'
+    # DRF's exception handler turns this into Retry-After
+    wait = 1
+
+
+class HashingPool:
+    """A thread pool that refuses work beyond ``max_pending`` calls in flight"""
+
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._lock = Lock()
+        self.pending = 0
+        self.rejected = 0
+        self.wait_seconds = instrumentation.Histogram(instrumentation.DURATION_BUCKETS)
+        self.hash_seconds = instrumentation.Histogram(instrumentation.DURATION_BUCKETS)
+
+    def submit(self, func, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingUnavailable()
+            self.pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='hashing')
+        try:
+            future = self._executor.submit(self._call, perf_counter(), func, args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future=None):
+        with self._lock:
+            self.pending -= 1
+
+    @staticmethod
+    def _call(submitted, func, args):
+        started = perf_counter()
+        result = func(*args)
+        return result, started - submitted, perf_counter() - started
+
+    def _observe(self, outcome):
+        result, waited, took = outcome
+        with self._lock:
+            self.wait_seconds.observe(waited)
+            self.hash_seconds.observe(took)
+        timings = instrumentation.current()
+        if timings is not None:
+            timings.add('hash_wait', waited)
+            timings.add('hash', took)
+        return result
+
+    def run(self, func, *args):
+        """``func(*args)`` on the pool; blocks until it returns"""
+        return self._observe(self.submit(func, *args).result())
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def render(self):
+        """Prometheus text for the pool"""
+        with self._lock:
+            lines = [
+                '# HELP password_hashing_wait_seconds Time hashing calls spent queued.',
+                '# TYPE password_hashing_wait_seconds histogram',
+                *instrumentation._histogram_lines('password_hashing_wait_seconds', 'pool="default"',
+                                                  self.wait_seconds),
+                '# HELP password_hashing_seconds Time spent hashing or verifying a password.',
+                '# TYPE password_hashing_seconds histogram',
+                *instrumentation._histogram_lines('password_hashing_seconds', 'pool="default"', self.hash_seconds),
+                '# HELP password_hashing_pending Hashing calls running or queued.',
+                '# TYPE password_hashing_pending gauge',
+                f'password_hashing_pending {self.pending}',
+                '# HELP password_hashing_rejected_total Hashing calls refused because the queue was full.',
+                '# TYPE password_hashing_rejected_total counter',
+                f'password_hashing_rejected_total {self.rejected}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def pool():
+    """The process's pool, created on first use from the settings"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HashingPool(workers(), max_pending())
+        return _pool
+
+
+def render():
+    return pool().render()
+
+
+def _verify(raw_password, encoded):
+    return hashers.verify_password(raw_password, encoded)
+
+
+def _upgrade(user, raw_password):
+    # What AbstractBaseUser.check_password does when the hasher changed
+    user.password = pool().run(hashers.make_password, raw_password)
+    user._password = None
+    user.save(update_fields=['password'])
+
+
+def check_password(user, raw_password):
+    """user.check_password() with the hashing on the pool"""
+    correct, must_update = pool().run(_verify, raw_password, user.password)
+    if correct and must_update:
+        _upgrade(user, raw_password)
+    return correct
+
+
+def make_password(raw_password):
+    return pool().run(hashers.make_password, raw_password)
+
+
+class PooledModelBackend(ModelBackend):
+    """ModelBackend verifying passwords on the hashing pool"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Hash anyway, so that unknown users take as long (Django #20760)
+            make_password(password)
+            return None
+        if check_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,118 @@
+"""
+Idempotency-Key support for write endpoints.
+
+A client that retries a write after a timeout sends the same
+``Idempotency-Key`` header with it. The first request with a key runs the
+handler and the response it returns (status and data) is kept in the cache
+for IDEMPOTENCY_KEY_TTL seconds; requests with the same key, user, method
+and path get that response again, with ``Idempotent-Replayed: true``,
+without running the handler. Server errors are not kept, so those can be
+retried, and neither are errors the handler raises (a ValidationError from
+the serializer), so the body can be fixed and sent again with the key.
+
+The first request takes a lock with ``cache.add()``; a duplicate that
+arrives while it is still running gets 409 with ``Retry-After`` at once
+rather than holding a worker, and a retry after that gets the stored
+response. Reusing a key with a different body gets 422.
+
+Keys are only shared between processes that share the cache.
+"""
+import hashlib
+import json
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+def ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+
+
+def lock_timeout():
+    return getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 30)
+
+
+def cache_key(user_id, method, path, key):
+    digest = hashlib.sha256(f'{method} {path} {key}'.encode()).hexdigest()
+    return f'idempotency:{user_id}:{digest}'
+
+
+def fingerprint(request):
+    """Hash of what the request asks for, to tell a retry from a reused key"""
+    # The parsed data rather than request.body, which a form or multipart
+    # request's stream may already have been read past
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    content = json.dumps(
+        [request.META.get('QUERY_STRING', ''), data], sort_keys=True, default=str, separators=(',', ':')
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _replay(stored, request_hash):
+    if stored['fingerprint'] != request_hash:
+        return _key_reused()
+    return Response(stored['data'], status=stored['status'], headers={REPLAYED_HEADER: 'true'})
+
+
+def _key_reused():
+    return Response(
+        {'detail': f'This {HEADER} was already used for a different request.'},
+        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+    )
+
+
+def idempotent(handler):
+    """Make a DRF handler method (``post``, ``create``, ``update``, ...) honour Idempotency-Key"""
+
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return handler(view, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'detail': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters long.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        result_key = cache_key(request.user.pk, request.method, request.path, key)
+        lock_key = f'{result_key}:lock'
+        request_hash = fingerprint(request)
+        stored = cache.get(result_key)
+        if stored is not None:
+            return _replay(stored, request_hash)
+        if not cache.add(lock_key, request_hash, lock_timeout()):
+            # The holder may have finished since the get()
+            stored = cache.get(result_key)
+            if stored is not None:
+                return _replay(stored, request_hash)
+            holder = cache.get(lock_key)
+            if holder is not None and holder != request_hash:
+                return _key_reused()
+            return Response(
+                {'detail': f'A request with this {HEADER} is still in progress.'},
+                status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'},
+            )
+        try:
+            # The holder before us may have finished since the get()
+            stored = cache.get(result_key)
+            if stored is not None:
+                return _replay(stored, request_hash)
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code < 500 and hasattr(response, 'data'):
+                cache.set(result_key, {
+                    'fingerprint': request_hash, 'status': response.status_code, 'data': response.data,
+                }, ttl())
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    return wrapper
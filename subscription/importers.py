@@ -0,0 +1,308 @@
+"""
+Streaming bulk import of users, plans and subscriptions (see import_data).
+
+Rows are read lazily from CSV or JSON Lines and processed in chunks. For
+each chunk, references are resolved with one IN query per referenced table
+and the rows are written with bulk_create inside a single transaction, so
+memory stays bounded by the chunk size however large the input is.
+"""
+import csv
+import json
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from . import catalog, current, entitlements, sharding, stats
+from .bulk import chunked
+from .models import Feature, Plan, Subscription
+
+User = get_user_model()
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', ''}
+
+
+class InvalidRow(ValueError):
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def read_rows(stream, format):
+    """Yield (line number, row dict) from a CSV or JSON Lines stream"""
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif format == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except json.JSONDecodeError as e:
+                raise InvalidRow(line, f'invalid JSON ({e})')
+            if not isinstance(row, dict):
+                raise InvalidRow(line, 'expected a JSON object')
+            yield line, row
+    else:
+        raise ValueError(f'Unknown format: {format}')
+
+
+def _text(row, field):
+    value = row.get(field)
+    return str(value).strip() if value is not None else ''
+
+
+def _bool(row, field, default):
+    value = row.get(field)
+    if value is None or isinstance(value, bool):
+        return default if value is None else value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return default if value == '' else False
+    raise ValueError(f'{field} must be a boolean, got {value!r}')
+
+
+def _email(row, field):
+    # The way registration stores emails (lowercased domain only); login
+    # matches them exactly
+    return User.objects.normalize_email(_text(row, field))
+
+
+def _list(row, field):
+    """A list in JSON Lines, a |-separated string in CSV"""
+    value = row.get(field) or []
+    if isinstance(value, str):
+        value = value.split('|')
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+class Importer:
+    """Base class: subclasses implement ``import_chunk(rows) -> created``"""
+
+    def __init__(self, batch_size=1000, skip_invalid=False):
+        self.batch_size = batch_size
+        self.skip_invalid = skip_invalid
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+
+    def invalid(self, line, message):
+        if not self.skip_invalid:
+            raise InvalidRow(line, message)
+        self.errors.append(InvalidRow(line, message))
+
+    def run(self, rows):
+        for chunk in chunked(rows, self.batch_size):
+            with transaction.atomic():
+                self.created += self.import_chunk(chunk)
+        return {'created': self.created, 'skipped': self.skipped, 'invalid': len(self.errors)}
+
+
+class UserImporter(Importer):
+    """
+    Columns: email, username (defaults to the email), first_name, last_name,
+    and either password_hash (preferred) or password. A raw password costs
+    one full password hash per row. Users whose email or username already
+    exists are skipped.
+    """
+
+    def import_chunk(self, chunk):
+        candidates = {}
+        for line, row in chunk:
+            email = _email(row, 'email')
+            if not email:
+                self.invalid(line, 'email is required')
+                continue
+            if email in candidates:
+                self.skipped += 1
+                continue
+            candidates[email] = (line, row)
+
+        existing_emails = set(User.objects.filter(email__in=candidates).values_list('email', flat=True))
+        usernames = {
+            email: User.normalize_username(_text(row, 'username') or email) for email, (_, row) in candidates.items()
+        }
+        existing_usernames = set(
+            User.objects.filter(username__in=usernames.values()).values_list('username', flat=True)
+        )
+
+        users = []
+        for email, (line, row) in candidates.items():
+            if email in existing_emails or usernames[email] in existing_usernames:
+                self.skipped += 1
+                continue
+            password_hash = _text(row, 'password_hash')
+            password = _text(row, 'password')
+            users.append(User(
+                email=email,
+                username=usernames[email],
+                first_name=_text(row, 'first_name'),
+                last_name=_text(row, 'last_name'),
+                password=password_hash or make_password(password or None),
+            ))
+        return len(User.objects.bulk_create(users))
+
+
+class PlanImporter(Importer):
+    """
+    Columns: name, features (feature names). Plans whose name already exists
+    are skipped. Unknown feature names are an error unless create_features.
+    """
+
+    def __init__(self, create_features=False, **kwargs):
+        super().__init__(**kwargs)
+        self.create_features = create_features
+
+    def import_chunk(self, chunk):
+        rows = []
+        for line, row in chunk:
+            name = _text(row, 'name')
+            if not name:
+                self.invalid(line, 'name is required')
+                continue
+            rows.append((line, name, _list(row, 'features')))
+
+        existing_plans = set(Plan.objects.filter(name__in=[name for _, name, _ in rows]).values_list('name', flat=True))
+        feature_names = {feature for _, _, features in rows for feature in features}
+        feature_ids = {}
+        # Feature names are not unique; the oldest feature wins
+        for name, pk in Feature.objects.filter(name__in=feature_names).order_by('-id').values_list('name', 'id'):
+            feature_ids[name] = pk
+
+        missing = sorted(feature_names - set(feature_ids))
+        if missing and self.create_features:
+            for feature in Feature.objects.bulk_create(Feature(name=name) for name in missing):
+                feature_ids[feature.name] = feature.pk
+            transaction.on_commit(catalog.bump_version)
+
+        plans, plan_features = [], []
+        for line, name, features in rows:
+            if name in existing_plans:
+                self.skipped += 1
+                continue
+            unknown = [feature for feature in features if feature not in feature_ids]
+            if unknown:
+                self.invalid(line, f'unknown features: {", ".join(unknown)}')
+                continue
+            existing_plans.add(name)
+            plans.append(Plan(name=name))
+            plan_features.append(features)
+
+        Plan.objects.bulk_create(plans)
+        PlanFeature = Plan.features.through
+        PlanFeature.objects.bulk_create(
+            PlanFeature(plan_id=plan.pk, feature_id=feature_ids[feature])
+            for plan, features in zip(plans, plan_features)
+            for feature in dict.fromkeys(features)
+        )
+        if plans:
+            transaction.on_commit(catalog.bump_version)
+        return len(plans)
+
+
+class SubscriptionImporter(Importer):
+    """
+    Columns: user (email), plan (name) or plan_id, start_date (ISO 8601,
+    defaults to now), is_active (defaults to true). An email that more than
+    one user has is an invalid row rather than a guess.
+
+    The one-active-subscription rule is enforced per chunk, set-based: of a
+    user's active rows the latest (by start_date, then input order) stays
+    active and the rest are imported inactive, then one UPDATE deactivates
+    whatever those users had active before and one upsert re-points their
+    CurrentSubscription pointers. The import is authoritative, so
+    an imported active row replaces the current one even if it is older.
+    """
+
+    def import_chunk(self, chunk):
+        emails, plan_names, plan_ids = set(), set(), set()
+        for _, row in chunk:
+            emails.add(_email(row, 'user'))
+            if _text(row, 'plan_id'):
+                plan_ids.add(_text(row, 'plan_id'))
+            else:
+                plan_names.add(_text(row, 'plan'))
+
+        users, ambiguous = {}, set()
+        for email, user_id in User.objects.filter(email__in=emails).values_list('email', 'id'):
+            if email in users:
+                ambiguous.add(email)
+            users[email] = user_id
+        plans_by_name = {}
+        for name, pk in Plan.objects.filter(name__in=plan_names).order_by('-id').values_list('name', 'id'):
+            plans_by_name[name] = pk
+        numeric_ids = [int(pk) for pk in plan_ids if pk.isdigit()]
+        known_plan_ids = set(Plan.objects.filter(id__in=numeric_ids).values_list('id', flat=True))
+
+        now = timezone.now()
+        subscriptions = []
+        latest_active = {}
+        for line, row in chunk:
+            email = _email(row, 'user')
+            if email in ambiguous:
+                self.invalid(line, f'ambiguous email {_text(row, "user")!r}')
+                continue
+            user_id = users.get(email)
+            if user_id is None:
+                self.invalid(line, f'unknown user {_text(row, "user")!r}')
+                continue
+            if _text(row, 'plan_id'):
+                plan_id = int(_text(row, 'plan_id')) if _text(row, 'plan_id').isdigit() else None
+                plan_id = plan_id if plan_id in known_plan_ids else None
+            else:
+                plan_id = plans_by_name.get(_text(row, 'plan'))
+            if plan_id is None:
+                self.invalid(line, f'unknown plan {_text(row, "plan_id") or _text(row, "plan")!r}')
+                continue
+            start_date = now
+            if _text(row, 'start_date'):
+                start_date = parse_datetime(_text(row, 'start_date'))
+                if start_date is None:
+                    self.invalid(line, f'invalid start_date {_text(row, "start_date")!r}')
+                    continue
+                if timezone.is_naive(start_date):
+                    start_date = timezone.make_aware(start_date)
+            try:
+                is_active = _bool(row, 'is_active', True)
+            except ValueError as e:
+                self.invalid(line, str(e))
+                continue
+
+            subscription = Subscription(user_id=user_id, plan_id=plan_id, start_date=start_date, is_active=False)
+            subscriptions.append(subscription)
+            if is_active:
+                latest = latest_active.get(user_id)
+                if latest is None or start_date >= latest.start_date:
+                    latest_active[user_id] = subscription
+
+        for subscription in latest_active.values():
+            subscription.is_active = True
+        replaced_plan_ids = []
+        # One set of statements per subscription shard (a single one unless sharded)
+        for alias, group in sharding.group_by_shard(subscriptions).items():
+            with transaction.atomic(using=alias, savepoint=False):
+                replaced = Subscription.objects.using(alias).select_for_update()\
+                    .filter(user_id__in={s.user_id for s in group if s.is_active}, is_active=True)
+                replaced_plan_ids += replaced.values_list('plan_id', flat=True)
+                replaced.update(is_active=False)
+                Subscription.objects.using(alias).bulk_create(group)
+                current.point([subscription for subscription in group if subscription.is_active], using=alias)
+        stats.record_active_changes(
+            replaced_plan_ids, [subscription.plan_id for subscription in latest_active.values()]
+        )
+
+        affected = {subscription.user_id for subscription in subscriptions}
+        transaction.on_commit(lambda: entitlements.invalidate_users(affected))
+        return len(subscriptions)
+
+
+IMPORTERS = {
+    'users': UserImporter,
+    'plans': PlanImporter,
+    'subscriptions': SubscriptionImporter,
+}
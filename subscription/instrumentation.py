@@ -0,0 +1,166 @@
+"""
+Per-request timings and per-route histograms.
+
+PerformanceMiddleware (subscription.middleware) opens a RequestTimings for
+every request and every database connection reports its queries to it;
+code that wants its time broken out wraps itself in
+``section(name)``. Finished requests are folded into ``registry``, which
+renders as Prometheus text.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+# Upper bounds in seconds; +Inf is implicit
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21, 34)
+
+PHASES = ('db', 'view', 'serializer', 'render', 'total')
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+
+    def add(self, phase, seconds):
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+
+    def record_query(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook"""
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations['db'] += perf_counter() - start
+            self.queries += 1
+
+    def server_timing(self):
+        entries = []
+        for phase, seconds in self.durations.items():
+            entry = f'{phase};dur={seconds * 1000:.3f}'
+            if phase == 'db':
+                entry += f';desc="{self.queries} queries"'
+            entries.append(entry)
+        return ', '.join(entries)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection (see subscription.signals).
+
+    It charges the query to the request in the current context, which
+    sync_to_async carries over to the thread the async ORM runs queries on.
+    """
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.record_query(execute, sql, params, many, context)
+
+
+def start_request():
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def section(phase):
+    """Attribute the time spent in the block to ``phase`` of the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, perf_counter() - start)
+
+
+class TimedSerializerMixin:
+    """Attribute the time spent building ``.data`` to the 'serializer' phase"""
+
+    @property
+    def data(self):
+        with section('serializer'):
+            return super().data
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Per-route histograms of phase durations and query counts, for this process"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.durations = {}
+        self.queries = {}
+
+    def observe(self, route, timings):
+        with self._lock:
+            for phase, seconds in timings.durations.items():
+                key = (route, phase)
+                if key not in self.durations:
+                    self.durations[key] = Histogram(DURATION_BUCKETS)
+                self.durations[key].observe(seconds)
+            if route not in self.queries:
+                self.queries[route] = Histogram(QUERY_BUCKETS)
+            self.queries[route].observe(timings.queries)
+
+    def reset(self):
+        with self._lock:
+            self.durations.clear()
+            self.queries.clear()
+
+    def render(self):
+        lines = [
+            '# HELP http_request_phase_duration_seconds Time spent per request phase, by route.',
+            '# TYPE http_request_phase_duration_seconds histogram',
+        ]
+        with self._lock:
+            for (route, phase), histogram in sorted(self.durations.items()):
+                lines.extend(_histogram_lines(
+                    'http_request_phase_duration_seconds', f'route="{route}",phase="{phase}"', histogram
+                ))
+            lines.extend([
+                '# HELP http_request_queries Database queries per request, by route.',
+                '# TYPE http_request_queries histogram',
+            ])
+            for route, histogram in sorted(self.queries.items()):
+                lines.extend(_histogram_lines('http_request_queries', f'route="{route}"', histogram))
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(name, labels, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+    yield f'{name}_sum{{{labels}}} {histogram.sum}'
+    yield f'{name}_count{{{labels}}} {histogram.count}'
+
+
+registry = Registry()
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django import get_version
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from subscription import services
+from subscription.benchmarks import bench_host, summarize
+from subscription.models import Feature, OutboxEvent, Plan
+from .benchmark import throttling_disabled
+
+User = get_user_model()
+
+# URL name in subscription/urls.py -> its twin in subscription/async_urls.py
+ENDPOINTS = {
+    'feature-list': ('subscriptions:feature-list', 'async:feature-list'),
+    'plan-list': ('subscriptions:plan-list', 'async:plan-list'),
+    'subscription-list': ('subscriptions:subscription-list', 'async:subscription-list'),
+    'entitlement-detail': ('subscriptions:entitlement-detail', 'async:entitlement-detail'),
+}
+
+
+class WSGIDriver:
+    """Calls the WSGI application from a pool of threads, like a threaded WSGI server"""
+
+    def __init__(self, headers):
+        self.application = get_wsgi_application()
+        self.environ = {
+            'REQUEST_METHOD': 'GET',
+            'QUERY_STRING': '',
+            'SERVER_NAME': bench_host(),
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            self.environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+    def request(self, path):
+        statuses = []
+        environ = dict(self.environ, PATH_INFO=path)
+        environ['wsgi.input'] = BytesIO()
+        environ['wsgi.errors'] = BytesIO()
+        start = time.perf_counter()
+        body = self.application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        try:
+            b''.join(body)
+        finally:
+            body.close()
+        elapsed = time.perf_counter() - start
+        if not statuses[0].startswith('200'):
+            raise CommandError(f'WSGI GET {path} returned {statuses[0]}')
+        return elapsed
+
+    def run(self, path, requests, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            timings = list(pool.map(lambda _: self.request(path), range(requests)))
+            return timings, time.perf_counter() - start
+
+
+class ASGIDriver:
+    """Calls the ASGI application with HTTP scopes, as an ASGI server such as uvicorn does"""
+
+    def __init__(self, headers):
+        self.application = get_asgi_application()
+        self.headers = [(b'host', bench_host().encode())] + [
+            (name.lower().encode(), value.encode()) for name, value in headers.items()
+        ]
+
+    async def request(self, path):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'root_path': '',
+            'query_string': b'',
+            'headers': self.headers,
+            'client': ('127.0.0.1', 0),
+            'server': (bench_host(), 80),
+        }
+        messages = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+        disconnected = asyncio.Event()
+
+        async def receive():
+            message = next(messages, None)
+            if message is not None:
+                return message
+            # The client stays connected until the response is complete
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        statuses = []
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        start = time.perf_counter()
+        await self.application(scope, receive, send)
+        elapsed = time.perf_counter() - start
+        disconnected.set()
+        if statuses[0] != 200:
+            raise CommandError(f'ASGI GET {path} returned {statuses[0]}')
+        return elapsed
+
+    def run(self, path, requests, concurrency):
+        async def worker(remaining, timings):
+            while remaining:
+                remaining.pop()
+                timings.append(await self.request(path))
+
+        async def main():
+            remaining, timings = list(range(requests)), []
+            start = time.perf_counter()
+            await asyncio.gather(*(worker(remaining, timings) for _ in range(concurrency)))
+            return timings, time.perf_counter() - start
+
+        return asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the sync DRF read endpoints served through WSGI (a thread per in-flight request) '
+        'and through ASGI with their async twins (subscription/async_urls.py) served through ASGI, '
+        'at increasing concurrency. '
+        'Both applications are called in-process with the same requests a server would make, so '
+        'socket and HTTP parsing costs are left out. Creates a benchmark user and removes it afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and concurrency level')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+        parser.add_argument('--endpoint', action='append', dest='endpoints', choices=sorted(ENDPOINTS))
+        parser.add_argument('--output', help='Write the report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        names = options['endpoints'] or list(ENDPOINTS)
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'django': get_version(),
+                'python': platform.python_version(),
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+            },
+            'endpoints': {},
+        }
+
+        # Committed, not rolled back: the servers' threads use their own connections
+        user, created_plan = self.create_fixtures()
+        try:
+            headers = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+            wsgi, asgi = WSGIDriver(headers), ASGIDriver(headers)
+            with throttling_disabled():
+                for name in names:
+                    sync_path, async_path = (reverse(url_name) for url_name in ENDPOINTS[name])
+                    modes = {
+                        'wsgi': (wsgi, sync_path),
+                        # What switching the server to ASGI alone buys: the
+                        # sync DRF view behind a thread hop
+                        'asgi_sync_view': (asgi, sync_path),
+                        'asgi': (asgi, async_path),
+                    }
+                    results = report['endpoints'][name] = {}
+                    for mode, (driver, path) in modes.items():
+                        driver.run(path, 1, 1)
+                        results[mode] = {}
+                        for concurrency in options['concurrency']:
+                            timings, wall = driver.run(path, options['requests'], concurrency)
+                            results[mode][str(concurrency)] = summarize(timings, wall=wall)
+        finally:
+            # The subscription's event stays in the outbox (on the user's
+            # shard) when the user goes
+            OutboxEvent.objects.filter(user_id=user.pk).delete()
+            user.delete()
+            if created_plan is not None:
+                created_plan.features.all().delete()
+                created_plan.delete()
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def create_fixtures(self):
+        plan = Plan.objects.order_by('id').first()
+        created_plan = None
+        if plan is None:
+            plan = created_plan = Plan.objects.create(name='ASGI benchmark plan')
+            plan.features.set(Feature.objects.bulk_create(Feature(name=f'ASGI benchmark feature {i}') for i in range(5)))
+        user = User.objects.create_user(username='asgi_benchmark@example.com', email='asgi_benchmark@example.com')
+        services.subscribe(user, plan)
+        return user, created_plan
@@ -0,0 +1,78 @@
+import json
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from subscription import current, entitlements
+from subscription.benchmarks import measure, rolled_back
+from subscription.models import Feature, Plan, Subscription
+
+User = get_user_model()
+
+# Two queries per user: beyond this the loop only takes longer, linearly
+PER_USER_LIMIT = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Resolve the entitlements of batches of users of increasing size with iter_user_entitlements(), '
+        'cold and warm, against one get_user_entitlements() call per user (up to 1000 users), and report users per second '
+        'and queries per batch. Seeds its own data and rolls it back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[100, 1000, 10000], help='Users per batch')
+        parser.add_argument('--plans', type=int, default=10)
+        parser.add_argument('--features-per-plan', type=int, default=5)
+        parser.add_argument('--iterations', type=int, default=5)
+
+    def handle(self, *args, **options):
+        report = {'plans': options['plans'], 'chunk_size': entitlements.batch_chunk_size(), 'batches': {}}
+        with rolled_back():
+            user_ids, plan_ids = self.seed(max(options['users']), options['plans'], options['features_per_plan'])
+
+            def cold():
+                # Only the benchmark's own keys, not the whole cache
+                entitlements.invalidate_users(user_ids)
+                entitlements.invalidate_plans(plan_ids)
+
+            try:
+                for count in options['users']:
+                    ids = user_ids[:count]
+                    cases = {
+                        'batch_cold': lambda: (cold(), list(entitlements.iter_user_entitlements(user_ids=ids))),
+                        'batch_warm': lambda: list(entitlements.iter_user_entitlements(user_ids=ids)),
+                    }
+                    if count <= PER_USER_LIMIT:
+                        cases['per_user_cold'] = lambda: (
+                            cold(), [entitlements.get_user_entitlements(pk) for pk in ids]
+                        )
+                    results = report['batches'][str(count)] = {}
+                    for name, func in cases.items():
+                        summary = measure(func, options['iterations'])
+                        summary['users_per_second'] = round(count / (summary['mean_ms'] / 1000))
+                        results[name] = summary
+            finally:
+                cold()
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def seed(self, users, plan_count, features_per_plan):
+        features = Feature.objects.bulk_create(
+            Feature(name=f'Benchmark Feature {i}') for i in range(plan_count * features_per_plan)
+        )
+        plans = Plan.objects.bulk_create(Plan(name=f'Benchmark Plan {i}') for i in range(plan_count))
+        Plan.features.through.objects.bulk_create(
+            Plan.features.through(plan_id=plan.pk, feature_id=features[i * features_per_plan + j].pk)
+            for i, plan in enumerate(plans)
+            for j in range(features_per_plan)
+        )
+        created = User.objects.bulk_create(
+            User(username=f'bench_entitlements_{i}', email=f'bench_entitlements_{i}@example.com')
+            for i in range(users)
+        )
+        # Every fifth user has no subscription
+        subscriptions = Subscription.objects.bulk_create(
+            Subscription(user_id=user.pk, plan_id=plans[i % plan_count].pk)
+            for i, user in enumerate(created) if i % 5
+        )
+        current.point(subscriptions)
+        return [user.pk for user in created], [plan.pk for plan in plans]
@@ -0,0 +1,47 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from subscription.benchmarks import StubWebhookServer, rolled_back
+from subscription.models import OutboxEvent
+from subscription.outbox import Dispatcher
+
+
+class Command(BaseCommand):
+    help = (
+        'Drain an outbox of --events events from --users users into a local stub webhook that takes '
+        '--latency-ms per request, at each --concurrency, and report events per second and webhook '
+        'requests. Seeds its own events and rolls them back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--latency-ms', type=float, default=5.0, help='Time the webhook takes to answer')
+
+    def handle(self, *args, **options):
+        report = {
+            'events': options['events'], 'users': options['users'], 'batch_size': options['batch_size'],
+            'latency_ms': options['latency_ms'], 'concurrency': {},
+        }
+        for concurrency in options['concurrency']:
+            with rolled_back(), StubWebhookServer(delay=options['latency_ms'] / 1000) as webhook:
+                OutboxEvent.objects.bulk_create(
+                    OutboxEvent(user_id=i % options['users'] + 1, event=OutboxEvent.SWITCHED, payload={'n': i})
+                    for i in range(options['events'])
+                )
+                dispatcher = Dispatcher([webhook.url], options['batch_size'], concurrency)
+                with dispatcher:
+                    start = time.perf_counter()
+                    delivered, failed = dispatcher.drain()
+                    elapsed = time.perf_counter() - start
+                report['concurrency'][str(concurrency)] = {
+                    'delivered': delivered,
+                    'failed': failed,
+                    'seconds': round(elapsed, 3),
+                    'events_per_second': round(delivered / elapsed, 1),
+                    'webhook_requests': len(webhook.requests),
+                }
+
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,72 @@
+import json
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from rest_framework.pagination import Cursor
+from subscription.benchmarks import bench_client, measure, rolled_back
+from subscription.models import Feature, Plan, Subscription
+from subscription.pagination import SubscriptionCursorPagination
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare page-number and cursor pagination of the subscription history '
+        'on the first and a deep page. Seeds its own data and rolls it back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--deep-page', type=int, default=500)
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        deep_page = options['deep_page']
+        iterations = options['iterations']
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+
+        with rolled_back():
+            user = self.seed(page_size * deep_page)
+            client = bench_client(user)
+            deep_cursor = self.cursor_for_page(user, deep_page, page_size)
+
+            cases = {
+                'page_number': {
+                    'page_1': '/api/v1/subscriptions/',
+                    f'page_{deep_page}': f'/api/v1/subscriptions/?page={deep_page}',
+                },
+                'cursor': {
+                    'page_1': '/api/v1/subscriptions/?pagination=cursor',
+                    f'page_{deep_page}': deep_cursor,
+                },
+            }
+            report = {'page_size': page_size, 'subscriptions': page_size * deep_page, 'results': {}}
+            for paginator, pages in cases.items():
+                report['results'][paginator] = {
+                    page: measure(lambda url=url: self.get(client, url), iterations)
+                    for page, url in pages.items()
+                }
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def seed(self, count):
+        user = User.objects.create_user(username='bench_pagination', email='bench_pagination@example.com')
+        plan = Plan.objects.create(name='Benchmark Plan')
+        plan.features.set(Feature.objects.bulk_create(Feature(name=f'Benchmark Feature {i}') for i in range(3)))
+        Subscription.objects.bulk_create(
+            (Subscription(user=user, plan=plan, is_active=False) for _ in range(count)),
+            batch_size=1000,
+        )
+        return user
+
+    def cursor_for_page(self, user, page, page_size):
+        # The cursor a client would hold after walking to `page`
+        paginator = SubscriptionCursorPagination()
+        paginator.base_url = '/api/v1/subscriptions/?pagination=cursor'
+        boundary = Subscription.objects.filter(user=user)\
+            .order_by(*paginator.ordering)[(page - 1) * page_size - 1]
+        return paginator.encode_cursor(Cursor(offset=0, reverse=False, position=paginator.encode_position(boundary)))
+
+    def get(self, client, url):
+        response = client.get(url)
+        assert response.status_code == 200, response.content
@@ -0,0 +1,56 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from subscription import renderers
+from subscription.benchmarks import measure, rolled_back, seed_subscriptions
+from subscription.models import Subscription
+from subscription.serializers import SubscriptionRowsSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare MessagePackRenderer with JSONRenderer on subscription list pages of increasing size: '
+        'payload bytes, encode time and the time a client takes to decode the body. '
+        'Seeds its own data and rolls it back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 5000], help='Subscriptions per page')
+        parser.add_argument('--plans', type=int, default=10)
+        parser.add_argument('--features-per-plan', type=int, default=5)
+        parser.add_argument('--iterations', type=int, default=100)
+
+    def handle(self, *args, **options):
+        if renderers.msgpack is None:
+            raise CommandError('msgpack is not installed')
+
+        encoders = {
+            'json': (JSONRenderer(), json.loads),
+            'msgpack': (renderers.MessagePackRenderer(), lambda body: renderers.msgpack.unpackb(body, raw=False)),
+        }
+        report = {'plans': options['plans'], 'features_per_plan': options['features_per_plan'], 'pages': {}}
+        with rolled_back():
+            user = seed_subscriptions('bench_renderers', max(options['rows']), options['plans'],
+                                      options['features_per_plan'])
+            rows = list(
+                Subscription.objects.filter(user=user).order_by('-start_date', '-id')
+                .values(*SubscriptionRowsSerializer.columns())
+            )
+            for count in options['rows']:
+                # A page as the list endpoint renders it
+                page = {'count': len(rows), 'next': None, 'previous': None,
+                        'results': SubscriptionRowsSerializer(rows[:count]).data}
+                decoded = json.loads(encoders['json'][0].render(page))
+                results = report['pages'][str(count)] = {}
+                for name, (renderer, decode) in encoders.items():
+                    body = renderer.render(page)
+                    if decode(body) != decoded:
+                        raise CommandError(f'{name} does not decode to the JSON document')
+                    results[name] = {
+                        'bytes': len(body),
+                        'encode': measure(lambda: renderer.render(page), options['iterations']),
+                        'decode': measure(lambda: decode(body), options['iterations']),
+                    }
+                results['msgpack']['size_ratio'] = round(results['msgpack']['bytes'] / results['json']['bytes'], 3)
+
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,66 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+from subscription.benchmarks import measure, rolled_back, seed_subscriptions
+from subscription.models import Feature, Subscription
+from subscription.serializers import SubscriptionListSerializer, SubscriptionRowsSerializer
+
+# ?fields=id,is_active,plan.id
+SLIM_FIELDSET = {'id': None, 'is_active': None, 'plan': {'id': None}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare SubscriptionListSerializer with the SubscriptionRowsSerializer fast path on one '
+        'page of subscriptions, and the fast path with ?fields=id,is_active,plan.id, and report rows '
+        'per second, with and without the page queries, and the size of the JSON. '
+        'Seeds its own data and rolls it back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100, help='Subscriptions per page')
+        parser.add_argument('--plans', type=int, default=10)
+        parser.add_argument('--features-per-plan', type=int, default=5)
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with rolled_back():
+            user = seed_subscriptions('bench_serializers', rows, options['plans'], options['features_per_plan'])
+            subscriptions = Subscription.objects.filter(user=user).order_by('-start_date', '-id')
+            nested = subscriptions.select_related('plan')\
+                .prefetch_related(Prefetch('plan__features', queryset=Feature.objects.order_by('id')))[:rows]
+            values = subscriptions.values(*SubscriptionRowsSerializer.columns())[:rows]
+            slim = subscriptions.values(*SubscriptionRowsSerializer.columns(SLIM_FIELDSET))[:rows]
+
+            instances, value_rows, slim_rows = list(nested), list(values), list(slim)
+            renderer = JSONRenderer()
+            if renderer.render(SubscriptionListSerializer(instances, many=True).data) != \
+                    renderer.render(SubscriptionRowsSerializer(value_rows).data):
+                raise CommandError('The fast path does not produce the same JSON')
+
+            cases = {
+                'nested': {
+                    'serialize': lambda: SubscriptionListSerializer(instances, many=True).data,
+                    'query_and_serialize': lambda: SubscriptionListSerializer(list(nested.all()), many=True).data,
+                },
+                'fast': {
+                    'serialize': lambda: SubscriptionRowsSerializer(value_rows).data,
+                    'query_and_serialize': lambda: SubscriptionRowsSerializer(list(values.all())).data,
+                },
+                'slim': {
+                    'serialize': lambda: SubscriptionRowsSerializer(slim_rows, SLIM_FIELDSET).data,
+                    'query_and_serialize': lambda: SubscriptionRowsSerializer(list(slim.all()), SLIM_FIELDSET).data,
+                },
+            }
+            report = {'rows': rows, 'plans': options['plans'], 'features_per_plan': options['features_per_plan'],
+                      'results': {}}
+            for mode, variants in cases.items():
+                report['results'][mode] = {'bytes': len(renderer.render(variants['serialize']()))}
+                for variant, func in variants.items():
+                    summary = measure(func, options['iterations'])
+                    summary['rows_per_second'] = round(rows / (summary['mean_ms'] / 1000))
+                    report['results'][mode][variant] = summary
+
+        self.stdout.write(json.dumps(report, indent=2))
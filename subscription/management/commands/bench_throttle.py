@@ -0,0 +1,82 @@
+import itertools
+import json
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework import throttling as drf_throttling
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from subscription import throttling
+from subscription.benchmarks import measure
+
+User = get_user_model()
+
+SCOPE = 'bench_throttle'
+
+
+def throttle_class(base, history):
+    """``base`` with a rate no client of the benchmark reaches, keyed under SCOPE"""
+    return type(base.__name__, (base,), {'scope': SCOPE, 'rate': f'{history * 1000}/hour'})
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the time the user throttle adds to a request: DRF's UserRateThrottle (a timestamp list "
+        "per client in the cache) against the sliding-window throttle with local and cache-backed counters, "
+        'for clients that already made --history requests in the window. Uses unsaved users and deletes '
+        'its cache keys afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help='Clients requests rotate through')
+        parser.add_argument('--history', type=int, nargs='+', default=[10, 100, 1000],
+                            help='Requests each client made before the measured ones')
+        parser.add_argument('--iterations', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1:
+            raise CommandError('--clients must be at least 1')
+        factory = APIRequestFactory()
+        requests = []
+        for pk in range(1, options['clients'] + 1):
+            request = Request(factory.get('/'))
+            request.user = User(pk=pk)
+            requests.append(request)
+
+        cases = {
+            'drf': (drf_throttling.UserRateThrottle, 'local'),
+            'sliding_local': (throttling.UserRateThrottle, 'local'),
+            'sliding_cache': (throttling.UserRateThrottle, 'cache'),
+        }
+        report = {'clients': options['clients'], 'history': {}}
+        for history in options['history']:
+            results = report['history'][str(history)] = {}
+            for name, (base, backend) in cases.items():
+                throttle = throttle_class(base, history)
+                with override_settings(THROTTLE_BACKEND=backend):
+                    try:
+                        for request in requests:
+                            for _ in range(history):
+                                throttle().allow_request(request, None)
+                        rotation = itertools.cycle(requests)
+                        results[name] = measure(
+                            lambda: throttle().allow_request(next(rotation), None), options['iterations']
+                        )
+                    finally:
+                        self.clean_up(requests)
+            results['speedup_local'] = round(
+                results['sliding_local']['throughput_rps'] / results['drf']['throughput_rps'], 1
+            )
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def clean_up(self, requests):
+        throttling.reset()
+        throttle = throttle_class(throttling.UserRateThrottle, 1)()
+        keys = [throttle.get_cache_key(request, None) for request in requests]
+        # Sliding-window counters of the windows the run could have touched
+        window = int(throttle.timer() // throttle.duration)
+        cache.delete_many(
+            keys + [f'{key}:{index}' for key in keys for index in range(window - 2, window + 1)]
+        )
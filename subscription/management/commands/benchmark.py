@@ -0,0 +1,214 @@
+import itertools
+import json
+import platform
+from contextlib import contextmanager, nullcontext
+from django import get_version
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.views import APIView
+from subscription import auth_urls, sharding, urls
+from subscription.benchmarks import bench_client, measure, rolled_back
+from subscription.models import Feature, Plan, Subscription
+
+User = get_user_model()
+
+PASSWORD = 'benchmark-pass-123'
+
+
+@contextmanager
+def throttling_disabled():
+    # The day-based default rates would cut a benchmark short
+    throttle_classes = APIView.throttle_classes
+    APIView.throttle_classes = []
+    try:
+        yield
+    finally:
+        APIView.throttle_classes = throttle_classes
+
+
+class Scenarios:
+    """
+    One request per URL name in subscription/urls.py and auth_urls.py.
+
+    Each method issues a single request against the current data and checks
+    the status code, so latency is never measured on an error path.
+    """
+
+    def __init__(self, user, plans, history):
+        self.user = user
+        self.plans = plans
+        self.client = bench_client(user)
+        self.anonymous = bench_client()
+        self.counter = itertools.count()
+        Subscription.objects.bulk_create(
+            Subscription(user=user, plan=plans[i % len(plans)], is_active=False) for i in range(history)
+        )
+        self.client.post(reverse('subscriptions:subscription-create'), {'plan': plans[0].pk})
+        self.refresh = self.anonymous.post(
+            reverse('login'), {'email': user.email, 'password': PASSWORD}
+        ).json()['refresh']
+
+    def call(self, method, url, data=None, expected=200, client=None):
+        client = client or self.client
+        response = getattr(client, method)(url, data, content_type='application/json') \
+            if data is not None else getattr(client, method)(url)
+        if response.status_code != expected:
+            raise CommandError(f'{method.upper()} {url} returned {response.status_code}: {response.content[:200]}')
+        return response
+
+    def plan(self):
+        return self.plans[next(self.counter) % len(self.plans)]
+
+    # subscription/urls.py
+
+    def feature_list(self):
+        self.call('get', reverse('subscriptions:feature-list'))
+
+    def feature_create(self):
+        self.call('post', reverse('subscriptions:feature-create'), {'name': 'Benchmark feature'}, 201)
+
+    def plan_list(self):
+        self.call('get', reverse('subscriptions:plan-list'))
+
+    def plan_create(self):
+        feature_ids = list(self.plans[0].features.values_list('id', flat=True))
+        self.call('post', reverse('subscriptions:plan-create'), {'name': 'Benchmark plan', 'feature_ids': feature_ids}, 201)
+
+    def plan_stats(self):
+        self.call('get', reverse('subscriptions:plan-stats'))
+
+    def subscription_list(self):
+        self.call('get', reverse('subscriptions:subscription-list'))
+
+    def subscription_create(self):
+        self.call('post', reverse('subscriptions:subscription-create'), {'plan': self.plan().pk}, 201)
+
+    def subscription_update(self):
+        self.call('put', reverse('subscriptions:subscription-update'), {'plan': self.plan().pk})
+
+    def subscription_deactivate(self):
+        # Alternates with a create so there is always something to deactivate
+        if next(self.counter) % 2:
+            self.subscription_create()
+        else:
+            self.call('post', reverse('subscriptions:subscription-deactivate'))
+
+    def subscription_export(self):
+        response = self.call('get', reverse('subscriptions:subscription-export'))
+        b''.join(response.streaming_content)
+
+    def subscription_shards(self):
+        self.call('get', reverse('subscriptions:subscription-shards'))
+
+    def entitlement_detail(self):
+        self.call('get', reverse('subscriptions:entitlement-detail'))
+
+    def user_entitlement_detail(self):
+        self.call('get', reverse('subscriptions:user-entitlement-detail', args=[self.user.pk]))
+
+    def entitlement_batch(self):
+        response = self.call('post', reverse('subscriptions:entitlement-batch'), {'user_ids': [self.user.pk]})
+        b''.join(response.streaming_content)
+
+    # subscription/auth_urls.py
+
+    def register(self):
+        email = f'benchmark_register_{next(self.counter)}@example.com'
+        self.call('post', reverse('register'), {
+            'username': email,
+            'email': email,
+            'password': PASSWORD,
+            'password_confirm': PASSWORD,
+        }, 201, client=self.anonymous)
+
+    def login(self):
+        self.call('post', reverse('login'), {'email': self.user.email, 'password': PASSWORD}, client=self.anonymous)
+
+    def token_refresh(self):
+        # Refresh tokens rotate, so chain each response into the next request
+        response = self.call('post', reverse('token_refresh'), {'refresh': self.refresh}, client=self.anonymous)
+        self.refresh = response.json().get('refresh', self.refresh)
+
+
+def endpoint_names():
+    return [pattern.name for pattern in urls.urlpatterns + auth_urls.urlpatterns]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive every endpoint in subscription/urls.py and auth_urls.py through the test '
+        'client and report throughput, p50/p95/p99 latency and queries per request as JSON. '
+        'Runs against the configured database (see generate_dataset) and rolls back its writes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--history', type=int, default=100,
+                            help='Subscriptions in the benchmark user\'s history')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', metavar='URL_NAME',
+                            help='Only benchmark this URL name (repeatable)')
+        parser.add_argument('--with-throttling', action='store_true',
+                            help='Keep the configured throttles (the default rates will cut the run short)')
+        parser.add_argument('--output', help='Write the report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        names = endpoint_names()
+        missing = [name for name in names if not hasattr(Scenarios, name.replace('-', '_'))]
+        if missing:
+            raise CommandError(f'No benchmark scenario for: {", ".join(missing)}')
+        if options['endpoints']:
+            unknown = set(options['endpoints']) - set(names)
+            if unknown:
+                raise CommandError(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+            names = [name for name in names if name in options['endpoints']]
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'django': get_version(),
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'history': options['history'],
+                'dataset': {
+                    'users': User.objects.count(),
+                    'plans': Plan.objects.count(),
+                    'features': Feature.objects.count(),
+                    'subscriptions': sum(sharding.fan_out(lambda subscriptions: subscriptions.count()).values()),
+                },
+            },
+            'endpoints': {},
+        }
+
+        throttling = nullcontext() if options['with_throttling'] else throttling_disabled()
+        with throttling, rolled_back():
+            scenarios = Scenarios(self.create_user(), self.plans(), options['history'])
+            for name in names:
+                scenario = getattr(scenarios, name.replace('-', '_'))
+                report['endpoints'][name] = measure(scenario, options['iterations'], options['warmup'])
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def create_user(self):
+        # Login authenticates with username=email, so keep the two identical
+        return User.objects.create_user(
+            username='benchmark_user@example.com', email='benchmark_user@example.com',
+            password=PASSWORD, is_staff=True,
+        )
+
+    def plans(self):
+        plans = list(Plan.objects.prefetch_related('features').order_by('id')[:5])
+        if len(plans) < 2:
+            features = Feature.objects.bulk_create(Feature(name=f'Benchmark feature {i}') for i in range(5))
+            plans = [Plan.objects.create(name=f'Benchmark plan {i}') for i in range(2)]
+            for plan in plans:
+                plan.features.set(features)
+        return plans
@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from subscription.outbox import Dispatcher, webhooks
+
+
+class Command(BaseCommand):
+    help = (
+        'Deliver subscription change events from the outbox to the OUTBOX_WEBHOOKS, in batches, '
+        'in order per user and with retries. Runs until interrupted unless --once is given. '
+        'Several dispatchers may run at the same time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once no events are due')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait when nothing is due')
+        parser.add_argument('--batch-size', type=int, help='Events claimed per shard and batch (OUTBOX_BATCH_SIZE)')
+        parser.add_argument('--concurrency', type=int, help='Users delivered at the same time (OUTBOX_CONCURRENCY)')
+        parser.add_argument('--webhook', action='append', dest='webhooks', help='Deliver here instead (repeatable)')
+
+    def handle(self, *args, **options):
+        urls = options['webhooks'] or webhooks()
+        if not urls:
+            raise CommandError('No webhooks configured; set OUTBOX_WEBHOOKS or pass --webhook')
+
+        with Dispatcher(urls, options['batch_size'], options['concurrency']) as dispatcher:
+            if options['once']:
+                delivered, failed = dispatcher.drain()
+                self.stdout.write(f'{delivered} event(s) delivered, {failed} failed and scheduled for retry')
+                return
+            while True:
+                delivered, failed = dispatcher.run_once()
+                if delivered or failed:
+                    self.stdout.write(f'{delivered} event(s) delivered, {failed} failed')
+                else:
+                    time.sleep(options['interval'])
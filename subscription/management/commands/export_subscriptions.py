@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from subscription import exporters
+from subscription.serializers import SubscriptionExportSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream every subscription with its user\'s email and plan name as NDJSON or CSV, '
+        'reading the table in chunks (EXPORT_CHUNK_SIZE) so memory stays flat.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='output', choices=['ndjson', 'csv'], default='ndjson')
+        parser.add_argument('--is-active', choices=['true', 'false'])
+        parser.add_argument('--plan', type=int, help='Plan id')
+        parser.add_argument('--start-date-from', help='ISO 8601, inclusive')
+        parser.add_argument('--start-date-to', help='ISO 8601, exclusive')
+        parser.add_argument('--output', dest='path', help='Write to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        fields = SubscriptionExportSerializer().fields
+        serializer = SubscriptionExportSerializer(data={
+            name: options[name] for name in fields if options.get(name) is not None
+        })
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+        filters = dict(serializer.validated_data)
+        output = filters.pop('output')
+
+        if options['path']:
+            with open(options['path'], 'w', newline='', encoding='utf-8') as f:
+                for chunk in exporters.export(output, **filters):
+                    f.write(chunk)
+        else:
+            for chunk in exporters.export(output, **filters):
+                self.stdout.write(chunk, ending='')
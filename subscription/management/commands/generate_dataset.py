@@ -0,0 +1,109 @@
+import random
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from subscription import current, sharding
+from subscription.models import Feature, Plan, Subscription
+from subscription.stats import record_active_changes
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic dataset for load testing with bulk inserts. '
+        'Defaults are production scale; pass smaller numbers for a quick run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000)
+        parser.add_argument('--plans', type=int, default=10_000)
+        parser.add_argument('--features', type=int, default=500)
+        parser.add_argument('--subscriptions', type=int, default=5_000_000)
+        parser.add_argument('--features-per-plan', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='load', help='Username/email prefix of generated users')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['subscriptions'] and not options['plans']:
+            raise CommandError('Generating subscriptions needs at least one plan')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        feature_ids = self.create_features(options['features'], options['prefix'])
+        plan_ids = self.create_plans(options['plans'], options['prefix'], feature_ids, options['features_per_plan'])
+        self.create_users_and_subscriptions(options['users'], options['subscriptions'], options['prefix'], plan_ids)
+
+    def log(self, message):
+        self.stdout.write(message)
+        self.stdout.flush()
+
+    def create_features(self, count, prefix):
+        features = Feature.objects.bulk_create(
+            (Feature(name=f'{prefix} feature {i}') for i in range(count)),
+            batch_size=self.batch_size,
+        )
+        self.log(f'features: {len(features)}')
+        return [feature.pk for feature in features]
+
+    def create_plans(self, count, prefix, feature_ids, features_per_plan):
+        PlanFeature = Plan.features.through
+        plan_ids = []
+        for start in range(0, count, self.batch_size):
+            with transaction.atomic():
+                plans = Plan.objects.bulk_create(
+                    Plan(name=f'{prefix} plan {i}') for i in range(start, min(start + self.batch_size, count))
+                )
+                PlanFeature.objects.bulk_create(
+                    (
+                        PlanFeature(plan_id=plan.pk, feature_id=feature_id)
+                        for plan in plans
+                        for feature_id in self.rng.sample(feature_ids, min(features_per_plan, len(feature_ids)))
+                    ),
+                    batch_size=self.batch_size,
+                )
+            plan_ids.extend(plan.pk for plan in plans)
+        self.log(f'plans: {len(plan_ids)}')
+        return plan_ids
+
+    def create_users_and_subscriptions(self, user_count, subscription_count, prefix, plan_ids):
+        # Hashing is the slow part of creating users; every generated user
+        # shares one precomputed hash of the password "loadtest".
+        password = make_password('loadtest')
+        first = User.objects.filter(username__startswith=f'{prefix}_').count()
+        now = timezone.now()
+        created_users = created_subscriptions = 0
+
+        for start in range(0, user_count, self.batch_size):
+            stop = min(start + self.batch_size, user_count)
+            # The subscriptions go to their users' shards
+            with sharding.atomic_all():
+                users = User.objects.bulk_create(
+                    User(
+                        username=f'{prefix}_{first + i}',
+                        email=f'{prefix}_{first + i}@example.com',
+                        password=password,
+                    )
+                    for i in range(start, stop)
+                )
+                subscriptions = []
+                for offset, user in enumerate(users, start=start):
+                    # Spread subscription_count as evenly as possible over the users
+                    history = subscription_count // user_count + (offset < subscription_count % user_count)
+                    for n in range(history):
+                        subscriptions.append(Subscription(
+                            user_id=user.pk,
+                            plan_id=self.rng.choice(plan_ids),
+                            start_date=now - timedelta(days=history - n, seconds=self.rng.randrange(86400)),
+                            is_active=n == history - 1,
+                        ))
+                Subscription.objects.bulk_create(subscriptions, batch_size=self.batch_size)
+                current.point([s for s in subscriptions if s.is_active])
+                record_active_changes([], [s.plan_id for s in subscriptions if s.is_active])
+            created_users += len(users)
+            created_subscriptions += len(subscriptions)
+            self.log(f'users: {created_users}/{user_count}, subscriptions: {created_subscriptions}/{subscription_count}')
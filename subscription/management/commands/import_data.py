@@ -0,0 +1,56 @@
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from subscription.importers import IMPORTERS, InvalidRow, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream users, plans or subscriptions from a CSV or JSON Lines file into the database '
+        'in batches (bulk_create, one transaction per batch). Use - to read from stdin.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help='CSV or JSON Lines file, or - for stdin')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--skip-invalid', action='store_true',
+                            help='Report invalid rows and carry on instead of stopping at the first one')
+        parser.add_argument('--create-features', action='store_true',
+                            help='plans: create features that do not exist yet')
+
+    def handle(self, *args, **options):
+        format = options['format'] or self.guess_format(options['path'])
+        kwargs = {'batch_size': options['batch_size'], 'skip_invalid': options['skip_invalid']}
+        if options['kind'] == 'plans':
+            kwargs['create_features'] = options['create_features']
+        importer = IMPORTERS[options['kind']](**kwargs)
+
+        if options['path'] == '-':
+            stream = sys.stdin
+        else:
+            stream = open(options['path'], newline='', encoding='utf-8')
+        try:
+            result = importer.run(read_rows(stream, format))
+        except InvalidRow as e:
+            raise CommandError(f'{e} (batches before this one were committed)')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in importer.errors:
+            self.stderr.write(str(error))
+        self.stdout.write(
+            f'{options["kind"]}: {result["created"]} created, {result["skipped"]} skipped, '
+            f'{result["invalid"]} invalid'
+        )
+
+    def guess_format(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            return 'csv'
+        if extension in ('.jsonl', '.ndjson'):
+            return 'jsonl'
+        raise CommandError('Cannot tell the format from the file name; pass --format')
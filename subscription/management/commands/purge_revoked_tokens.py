@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from subscription.revocation import purge
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete revoked refresh tokens that have expired since; they would be refused anyway. '
+        'Run it periodically (e.g. daily from cron) to keep the table at the tokens still valid.'
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{purge()} expired revocation(s) deleted')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from subscription.current import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        'Check every CurrentSubscription pointer against the active subscription rows on each shard, '
+        'report users whose pointer is missing, stale or dangling and rewrite those pointers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift')
+
+    def handle(self, *args, **options):
+        drift = reconcile(fix=not options['dry_run'])
+        for user_id, pointed, active in drift:
+            self.stdout.write(f'user {user_id}: points to {pointed}, active {active}')
+        verb = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(f'{len(drift)} user(s) with drift {verb}')
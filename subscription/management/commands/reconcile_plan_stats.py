@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from subscription.stats import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount active subscribers per plan from the subscription table, report where the '
+        'PlanStats counters drifted and fix them. Switch counters are event counts and are left as they are.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift')
+
+    def handle(self, *args, **options):
+        drift = reconcile(fix=not options['dry_run'])
+        for plan_id, stored, actual in drift:
+            self.stdout.write(f'plan {plan_id}: stored {stored}, actual {actual} ({actual - stored:+d})')
+        verb = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(f'{len(drift)} plan(s) with drift {verb}')
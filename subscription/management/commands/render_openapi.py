@@ -0,0 +1,34 @@
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+from subscription import schema
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the OpenAPI schema (JSON and YAML) for the given public base URLs and store it in the '
+        'cache under the current code fingerprint, so the first request after a deploy does not '
+        'generate it. Needs a cache shared with the web processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', action='append', dest='urls', required=True,
+            help='Base URL clients reach the API at, e.g. https://api.example.com (repeatable)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'fingerprint {schema.fingerprint()}')
+        for url in options['urls']:
+            parts = urlsplit(url)
+            if parts.scheme not in ('http', 'https') or not parts.netloc:
+                raise CommandError(f'{url} is not an http(s) base URL')
+            factory = RequestFactory(HTTP_HOST=parts.netloc)
+            for name in ('schema-json', 'schema-yaml'):
+                path = reverse(name)
+                match = resolve(path)
+                response = match.func(factory.get(path, secure=parts.scheme == 'https'), *match.args, **match.kwargs)
+                if response.status_code != 200:
+                    raise CommandError(f'{url}{path} returned {response.status_code}')
+                self.stdout.write(f'{url}{path}: {len(response.content)} bytes, ETag {response["ETag"]}')
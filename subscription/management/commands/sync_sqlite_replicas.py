@@ -0,0 +1,40 @@
+import sqlite3
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database into the SQLite replicas listed in DATABASE_REPLICAS, '
+        'standing in for replication when trying the replica routing locally. Run it again to '
+        '"replicate" later writes; until then the replicas lag behind.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replica', action='append', dest='replicas', help='Only this alias (repeatable)')
+
+    def handle(self, *args, **options):
+        replicas = options['replicas'] or settings.DATABASE_REPLICAS
+        if not replicas:
+            raise CommandError('No replicas configured; set SQLITE_REPLICAS or DATABASE_REPLICAS')
+
+        primary = connections['default']
+        if primary.vendor != 'sqlite':
+            raise CommandError('The primary is not an SQLite database')
+        for alias in replicas:
+            if alias not in settings.DATABASE_REPLICAS:
+                raise CommandError(f'{alias} is not in DATABASE_REPLICAS')
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f'{alias} is not an SQLite database')
+
+        primary.ensure_connection()
+        for alias in replicas:
+            replica = connections[alias]
+            replica.close()
+            target = sqlite3.connect(replica.settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f'{alias}: copied from default ({replica.settings_dict["NAME"]})')
@@ -0,0 +1,174 @@
+import base64
+import json
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from . import instrumentation, routers
+
+
+class PerformanceMiddleware:
+    """
+    Time every request and report it in a Server-Timing header.
+
+    Records the query count and DB time (through the execute wrapper every
+    connection gets, see subscription.signals), view time, serializer time
+    (see TimedSerializerMixin), rendering time and total time, then folds
+    them into per-route histograms keyed by URL name and served at
+    /metrics. Keep it first in MIDDLEWARE so "total" covers the rest of the
+    stack.
+
+    Works in both handler modes, so it does not force async views (see
+    subscription.async_views) through a sync hop under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # The handler would wrap sync hooks in sync_to_async
+            self.process_view = self._aprocess_view
+            self.process_template_response = self._aprocess_template_response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = instrumentation.start_request()
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+            self._finish(request, timings, start)
+        finally:
+            instrumentation.finish_request(token)
+        return self._observe(request, timings, response)
+
+    async def __acall__(self, request):
+        timings, token = instrumentation.start_request()
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+            self._finish(request, timings, start)
+        finally:
+            instrumentation.finish_request(token)
+        return self._observe(request, timings, response)
+
+    def _finish(self, request, timings, start):
+        now = perf_counter()
+        timings.add('total', now - start)
+        view_started = getattr(request, '_view_started_at', None)
+        if view_started is not None:
+            # Without a template response nothing marked the end of the view
+            view_finished = getattr(request, '_view_finished_at', now)
+            timings.add('view', view_finished - view_started)
+
+    def _observe(self, request, timings, response):
+        match = request.resolver_match
+        route = match.view_name if match is not None and match.url_name else 'unmatched'
+        instrumentation.registry.observe(route, timings)
+        response['Server-Timing'] = timings.server_timing()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._view_started_at = perf_counter()
+
+    def process_template_response(self, request, response):
+        # Called between the view returning and the response being rendered
+        # (DRF responses are template responses)
+        timings = instrumentation.current()
+        request._view_finished_at = perf_counter()
+        response.add_post_render_callback(
+            lambda rendered: timings.add('render', perf_counter() - request._view_finished_at)
+        )
+        return response
+
+    # Instance attributes in async mode shadow the hooks above, hence the
+    # explicit class lookups
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return PerformanceMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+
+    async def _aprocess_template_response(self, request, response):
+        return PerformanceMiddleware.process_template_response(self, request, response)
+
+
+def _token_user_id(request):
+    """
+    The user id claim of the request's bearer token, if any.
+
+    Not verified: it only picks the database the reads go to, and the
+    view authenticates the token as usual.
+    """
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    if header is None:
+        return None
+    try:
+        raw_token = authentication.get_raw_token(header)
+        payload = raw_token.split(b'.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + b'=' * (-len(payload) % 4)))
+        return claims.get(api_settings.USER_ID_CLAIM)
+    except (AuthenticationFailed, AttributeError, IndexError, ValueError):
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Send the reads of ``read_replica`` views to a replica, writers to the primary.
+
+    Safe requests to a view class with ``read_replica = True`` read from a
+    replica (see subscription.routers) unless the client wrote within the
+    last REPLICA_PIN_SECONDS. Any successful unsafe request pins the client
+    for that long. Does nothing when DATABASE_REPLICAS is empty.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.process_view = self._aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routers.reading_from(None):
+            response = self.get_response(request)
+        return self._pin(request, response)
+
+    async def __acall__(self, request):
+        with routers.reading_from(None):
+            response = await self.get_response(request)
+        return self._pin(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        if request.method not in SAFE_METHODS or not getattr(view_class, 'read_replica', False):
+            return None
+        alias = routers.choose_replica()
+        if alias is not None and not self._pinned(request):
+            routers.read_from(alias)
+
+    async def _aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return ReplicaMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+
+    def _pinned(self, request):
+        if request.COOKIES.get(routers.PIN_COOKIE):
+            return True
+        user_id = _token_user_id(request)
+        return user_id is not None and routers.is_pinned(user_id)
+
+    def _pin(self, request, response):
+        if request.method in SAFE_METHODS or response.status_code >= 400 or not routers.replicas():
+            return response
+        # DRF puts the user it authenticated on the underlying request
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            routers.pin_user(user.pk)
+        response.set_cookie(
+            routers.PIN_COOKIE, '1', max_age=routers.pin_seconds(), httponly=True, samesite='Lax'
+        )
+        return response
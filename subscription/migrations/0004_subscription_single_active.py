@@ -0,0 +1,89 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:26
+#
+# Non-atomic so that PostgreSQL can build both indexes CONCURRENTLY, without
+# holding a write lock on the subscription table for the whole build. Other
+# backends fall back to the regular operations.
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def deactivate_duplicate_active(apps, schema_editor):
+    """Keep only the newest active subscription per user so the constraint can be built"""
+    Subscription = apps.get_model('subscription', 'Subscription')
+    duplicated_users = Subscription.objects.filter(is_active=True)\
+        .values('user_id')\
+        .annotate(active=Count('id'))\
+        .filter(active__gt=1)\
+        .values('user_id')
+    newest = Subscription.objects.filter(user_id=OuterRef('user_id'), is_active=True)\
+        .order_by('-start_date', '-id')\
+        .values('id')[:1]
+    Subscription.objects.filter(is_active=True, user_id__in=duplicated_users)\
+        .exclude(id=Subquery(newest))\
+        .update(is_active=False)
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """CREATE INDEX CONCURRENTLY on PostgreSQL, a plain AddIndex elsewhere"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+
+class AddConditionalUniqueConstraintConcurrently(migrations.AddConstraint):
+    """
+    A conditional UniqueConstraint is a partial unique index, so PostgreSQL can
+    build it with CREATE UNIQUE INDEX CONCURRENTLY. Plain AddConstraint elsewhere.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            sql = str(self.constraint.create_sql(model, schema_editor))
+            schema_editor.execute(sql.replace('CREATE UNIQUE INDEX', 'CREATE UNIQUE INDEX CONCURRENTLY', 1))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.execute(
+                'DROP INDEX CONCURRENTLY IF EXISTS %s' % schema_editor.quote_name(self.constraint.name)
+            )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('subscription', '0003_subscription_user_history_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(deactivate_duplicate_active, migrations.RunPython.noop, atomic=True),
+        AddIndexConcurrently(
+            model_name='subscription',
+            index=models.Index(fields=['user', 'is_active'], name='subscription_user_active_idx'),
+        ),
+        AddConditionalUniqueConstraintConcurrently(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('user',), name='subscription_one_active_per_user'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 04:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_active_counts(apps, schema_editor):
+    """One GROUP BY over the active rows; switch counters start at zero"""
+    Plan = apps.get_model('subscription', 'Plan')
+    PlanStats = apps.get_model('subscription', 'PlanStats')
+    Subscription = apps.get_model('subscription', 'Subscription')
+    active = dict(
+        Subscription.objects.filter(is_active=True).order_by()
+        .values('plan_id').annotate(count=Count('id')).values_list('plan_id', 'count')
+    )
+    PlanStats.objects.bulk_create(
+        (PlanStats(plan_id=plan_id, active_count=active.get(plan_id, 0))
+         for plan_id in Plan.objects.values_list('id', flat=True).iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscription', '0004_subscription_single_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlanStats',
+            fields=[
+                ('plan', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='subscription.plan')),
+                ('active_count', models.IntegerField(default=0)),
+                ('switches_in', models.IntegerField(default=0)),
+                ('switches_out', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_active_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 05:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_pointers(apps, schema_editor):
+    """One pointer per active row, on each database holding subscriptions"""
+    CurrentSubscription = apps.get_model('subscription', 'CurrentSubscription')
+    Subscription = apps.get_model('subscription', 'Subscription')
+    alias = schema_editor.connection.alias
+    CurrentSubscription.objects.using(alias).bulk_create(
+        (CurrentSubscription(user_id=user_id, subscription_id=pk, plan_id=plan_id)
+         for pk, user_id, plan_id in Subscription.objects.using(alias).filter(is_active=True)
+         .values_list('id', 'user_id', 'plan_id').iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('subscription', '0006_subscription_fk_without_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentSubscription',
+            fields=[
+                ('user', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='current_subscription', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('plan', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='subscription.plan')),
+                ('subscription', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='current', to='subscription.subscription')),
+            ],
+        ),
+        # The hint lets the shard router run this on every subscription shard
+        migrations.RunPython(
+            backfill_pointers, migrations.RunPython.noop, hints={'model_name': 'currentsubscription'}
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 06:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscription', '0009_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='subscription',
+            name='start_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -1,5 +1,8 @@
+import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from . import sharding
 
 User = get_user_model()
 
@@ -17,16 +20,137 @@ class Plan(models.Model):
         return self.name
 
 class Subscription(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions')
-    plan = models.ForeignKey(Plan, on_delete=models.CASCADE, related_name='subscriptions')
-    start_date = models.DateTimeField(auto_now_add=True)
+    # No database constraints: with several shards (subscription.sharding)
+    # users and plans live in another database
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriptions', db_constraint=False)
+    plan = models.ForeignKey(Plan, on_delete=models.CASCADE, related_name='subscriptions', db_constraint=False)
+    # Not auto_now_add, which would overwrite the dates bulk loads pass in
+    start_date = models.DateTimeField(default=timezone.now, editable=False)
     is_active = models.BooleanField(default=True)
+
+    objects = sharding.ShardedManager()
+    
+    class Meta:
+        indexes = [
+            # Serves the per-user history listing and its keyset cursor
+            models.Index(fields=['user', '-start_date', '-id'], name='subscription_user_history_idx'),
+            # Serves the filter(user=..., is_active=...) lookups on every write path
+            models.Index(fields=['user', 'is_active'], name='subscription_user_active_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(is_active=True),
+                name='subscription_one_active_per_user',
+            ),
+        ]
     
     def save(self, *args, **kwargs):
-        # Ensure only one active subscription per user
-        if self.is_active:
-            Subscription.objects.filter(user=self.user, is_active=True).update(is_active=False)
-        super().save(*args, **kwargs)
+        # Ensure only one active subscription per user and keep PlanStats in
+        # step. The API goes through subscription.services instead; this
+        # covers the admin and direct ORM use.
+        from . import current
+        from .stats import record_active_changes
+        with sharding.atomic(self.user_id):
+            previous = []
+            if self.is_active or self.pk:
+                previous = list(
+                    Subscription.objects.select_for_update()
+                    .filter(user_id=self.user_id, is_active=True)
+                    .values_list('pk', 'plan_id')
+                )
+            if self.is_active:
+                Subscription.objects.filter(user_id=self.user_id, is_active=True).update(is_active=False)
+                deactivated = [plan_id for _, plan_id in previous]
+                activated = [self.plan_id]
+            else:
+                deactivated = [plan_id for pk, plan_id in previous if pk == self.pk]
+                activated = []
+            super().save(*args, **kwargs)
+            if self.is_active:
+                current.point([self])
+            elif deactivated:
+                CurrentSubscription.objects.filter(user_id=self.user_id, subscription_id=self.pk).delete()
+            record_active_changes(deactivated, activated)
     
     def __str__(self):
-        return f"{self.user.email} - {self.plan.name}"
\ No newline at end of file
+        return f"{self.user.email} - {self.plan.name}"
+
+class CurrentSubscription(models.Model):
+    """
+    Pointer to a user's active subscription, kept by subscription.current in
+    the same transaction as every activation and deactivation, so the
+    current plan is a primary-key lookup instead of a filter over the
+    history. No row means no active subscription. Lives on the user's shard.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='current_subscription', db_constraint=False
+    )
+    subscription = models.OneToOneField(Subscription, on_delete=models.CASCADE, related_name='current')
+    # Copied from the subscription so the current plan needs no join
+    plan = models.ForeignKey(Plan, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+
+    objects = sharding.ShardedManager()
+
+    def __str__(self):
+        return f"{self.user_id}: subscription {self.subscription_id}"
+
+class OutboxEvent(models.Model):
+    """
+    A subscription change waiting to be delivered to the webhooks, written
+    in the same transaction as the change and deleted once delivered (see
+    subscription.outbox). Lives on the user's shard.
+    """
+    CREATED = 'subscription.created'
+    SWITCHED = 'subscription.switched'
+    DEACTIVATED = 'subscription.deactivated'
+    EVENT_CHOICES = [(CREATED, 'Created'), (SWITCHED, 'Switched'), (DEACTIVATED, 'Deactivated')]
+
+    # Unique across shards, for receivers to drop redeliveries by
+    event_id = models.UUIDField(default=uuid.uuid4, unique=True)
+    user_id = models.BigIntegerField()
+    event = models.CharField(max_length=50, choices=EVENT_CHOICES)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # Set by the dispatcher that is delivering the event
+    claim = models.UUIDField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    objects = sharding.ShardedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at', 'id'], name='outbox_due_idx'),
+            models.Index(fields=['user_id', 'id'], name='outbox_user_idx'),
+            models.Index(fields=['claim'], name='outbox_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event} for user {self.user_id}"
+
+class PlanStats(models.Model):
+    """
+    Subscriber counters of a plan, maintained by subscription.stats in the
+    same transaction as every activation and deactivation.
+    """
+    plan = models.OneToOneField(Plan, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    active_count = models.IntegerField(default=0)
+    switches_in = models.IntegerField(default=0)
+    switches_out = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.plan_id}: {self.active_count} active"
+
+class RevokedToken(models.Model):
+    """
+    A refresh token that may no longer be used, by its ``jti`` claim.
+    Kept until the token would have expired anyway (see subscription.revocation).
+    """
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.jti
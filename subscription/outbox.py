@@ -0,0 +1,202 @@
+"""
+Transactional outbox for subscription changes.
+
+services writes an OutboxEvent in the same transaction (on the user's
+shard) as every create, switch and deactivation, so an event exists if
+and only if the change committed, and the request never waits for the
+receivers. ``manage.py dispatch_outbox`` runs Dispatcher, which delivers
+the events to every URL in OUTBOX_WEBHOOKS and deletes them:
+
+* it claims up to OUTBOX_BATCH_SIZE due events per shard with one UPDATE,
+  so several dispatchers can run side by side; a user whose earlier events
+  another dispatcher holds is left to it;
+* the batch is split by user into up to OUTBOX_CONCURRENCY POSTs per
+  webhook, sent at the same time; each user's events are all in one POST,
+  in the order they were written;
+* if a POST fails at any webhook, its users' undelivered events are retried after an
+  exponential backoff (OUTBOX_RETRY_DELAY doubled per attempt, at most
+  OUTBOX_RETRY_MAX_DELAY) and their later events wait behind them. Events
+  are retried until delivered; ``attempts`` and ``last_error`` show the
+  ones that keep failing.
+
+Delivery is at least once: a webhook that succeeded may get the events
+again when another one failed, or after a dispatcher crashed before
+deleting them (claims expire after OUTBOX_CLAIM_SECONDS). Receivers drop
+duplicates by ``event_id``.
+
+A POST body is ``{"events": [{"event_id", "event", "created_at", "data"}]}``;
+with OUTBOX_WEBHOOK_SECRET set it carries an ``X-Outbox-Signature`` header,
+``sha256=`` and the hex HMAC-SHA256 of the body.
+"""
+import hashlib
+import hmac
+import json
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.utils import timezone
+from . import sharding
+from .models import OutboxEvent
+
+
+def webhooks():
+    return list(getattr(settings, 'OUTBOX_WEBHOOKS', []))
+
+
+def retry_delay(attempts):
+    """Seconds to wait after the ``attempts``-th failed delivery"""
+    base = getattr(settings, 'OUTBOX_RETRY_DELAY', 5)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'OUTBOX_RETRY_MAX_DELAY', 3600))
+
+
+def record(event, user_id, subscription_id, plan_id, previous_plan_id=None):
+    """Queue ``event``; call inside the transaction that made the change"""
+    OutboxEvent.objects.create(user_id=user_id, event=event, payload={
+        'user_id': user_id,
+        'subscription_id': subscription_id,
+        'plan_id': plan_id,
+        'previous_plan_id': previous_plan_id,
+    })
+
+
+def body(events):
+    return json.dumps({'events': [
+        {'event_id': event.event_id, 'event': event.event, 'created_at': event.created_at, 'data': event.payload}
+        for event in events
+    ]}, cls=DjangoJSONEncoder).encode()
+
+
+def post(url, content, timeout=None):
+    """POST ``content`` to ``url``; raises unless the response is a 2xx"""
+    headers = {'Content-Type': 'application/json'}
+    secret = getattr(settings, 'OUTBOX_WEBHOOK_SECRET', None)
+    if secret:
+        signature = hmac.new(secret.encode(), content, hashlib.sha256).hexdigest()
+        headers['X-Outbox-Signature'] = f'sha256={signature}'
+    request = urllib.request.Request(url, data=content, headers=headers, method='POST')
+    timeout = timeout if timeout is not None else getattr(settings, 'OUTBOX_WEBHOOK_TIMEOUT', 5)
+    # urlopen raises HTTPError for non-2xx statuses it does not follow
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+class Dispatcher:
+    """Delivers due events in batches; one instance per dispatcher process"""
+
+    def __init__(self, urls=None, batch_size=None, concurrency=None):
+        self.urls = webhooks() if urls is None else list(urls)
+        self.batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 500)
+        self.concurrency = concurrency or getattr(settings, 'OUTBOX_CONCURRENCY', 8)
+        self.claim_seconds = getattr(settings, 'OUTBOX_CLAIM_SECONDS', 300)
+        self._pool = None
+
+    def __enter__(self):
+        self._pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix='outbox')
+        return self
+
+    def __exit__(self, *exc_info):
+        self._pool.shutdown()
+        self._pool = None
+
+    def due(self, alias, now):
+        """Ids of up to batch_size due events of users with nothing waiting on a retry or another claim"""
+        events = OutboxEvent.objects.using(alias)
+        held = events.filter(next_attempt_at__gt=now).values('user_id')
+        return list(
+            events.filter(next_attempt_at__lte=now).exclude(user_id__in=held)
+            .order_by('id').values_list('id', flat=True)[:self.batch_size]
+        )
+
+    def claim(self, alias):
+        """Claim the due events; returns them, each user's in order"""
+        events = OutboxEvent.objects.using(alias)
+        now = timezone.now()
+        due = self.due(alias, now)
+        if not due:
+            return []
+        claim = uuid.uuid4()
+        # Both conditions again: another dispatcher may have claimed some of
+        # these, or earlier events of their users, since
+        held = events.filter(next_attempt_at__gt=now).values('user_id')
+        claimed = events.filter(id__in=due, next_attempt_at__lte=now).exclude(user_id__in=held)\
+            .update(claim=claim, next_attempt_at=now + timedelta(seconds=self.claim_seconds))
+        if not claimed:
+            return []
+        claimed = list(events.filter(claim=claim).order_by('id'))
+        # A claim that commits while this one runs is invisible to it. A user
+        # whose earlier events are still waiting (they are only deleted once
+        # delivered) is handed back, to be sent after them
+        first = {}
+        for event in claimed:
+            first.setdefault(event.user_id, event.pk)
+        blocked = {
+            user_id for user_id, pk in events.filter(user_id__in=first, id__lt=max(first.values()))
+            .exclude(claim=claim).values_list('user_id', 'id')
+            if pk < first[user_id]
+        }
+        if blocked:
+            events.filter(claim=claim, user_id__in=blocked).update(claim=None, next_attempt_at=now)
+        return [event for event in claimed if event.user_id not in blocked]
+
+    def deliver(self, events):
+        """Send ``events`` in one POST to every webhook; returns the error, or None"""
+        content = body(events)
+        for url in self.urls:
+            try:
+                post(url, content)
+            except Exception as exc:
+                return f'{url}: {exc}'
+        return None
+
+    def dispatch(self, alias):
+        """Deliver one batch from ``alias``; returns (delivered, failed) event counts"""
+        events = self.claim(alias)
+        if not events:
+            return 0, 0
+        by_user = {}
+        for event in events:
+            by_user.setdefault(event.user_id, []).append(event)
+        # One POST per thread, each with all the events of its users, in order
+        chunks = [list(by_user)[i::self.concurrency] for i in range(min(self.concurrency, len(by_user)))]
+        errors = self._pool.map(
+            lambda users: self.deliver([event for user_id in users for event in by_user[user_id]]), chunks
+        )
+
+        queryset = OutboxEvent.objects.using(alias)
+        delivered, failed = [], 0
+        now = timezone.now()
+        for users, error in zip(chunks, errors):
+            if error is None:
+                delivered += [event.pk for user_id in users for event in by_user[user_id]]
+                continue
+            for user_id in users:
+                sent = [event.pk for event in by_user[user_id]]
+                failed += len(sent)
+                retry_at = now + timedelta(seconds=retry_delay(by_user[user_id][0].attempts + 1))
+                queryset.filter(pk__in=sent).update(
+                    attempts=F('attempts') + 1, claim=None, last_error=error[:2000], next_attempt_at=retry_at,
+                )
+                # Later events of the user wait behind the failed ones
+                queryset.filter(user_id=user_id, id__gt=max(sent), next_attempt_at__lt=retry_at)\
+                    .update(next_attempt_at=retry_at)
+        queryset.filter(pk__in=delivered).delete()
+        return len(delivered), failed
+
+    def run_once(self):
+        """One batch from every shard; returns (delivered, failed) totals"""
+        totals = [self.dispatch(alias) for alias in sharding.shards()]
+        return sum(delivered for delivered, _ in totals), sum(failed for _, failed in totals)
+
+    def drain(self):
+        """Dispatch until no shard has due events; returns (delivered, failed)"""
+        delivered = failed = 0
+        while True:
+            batch_delivered, batch_failed = self.run_once()
+            if not batch_delivered and not batch_failed:
+                return delivered, failed
+            delivered += batch_delivered
+            failed += batch_failed
@@ -0,0 +1,82 @@
+from datetime import datetime
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class SubscriptionCursorPagination(CursorPagination):
+    """
+    Keyset pagination over subscription history ordered by (-start_date, -id).
+
+    The cursor carries the (start_date, id) of the row at the page boundary,
+    so a page is a bounded index range scan and no COUNT(*) is issued. Deep
+    pages cost the same as the first one.
+    """
+    ordering = ('-start_date', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, position = False, None
+        else:
+            reverse, position = self.cursor.reverse, self.decode_position(self.cursor.position)
+
+        if reverse:
+            queryset = queryset.order_by('start_date', 'id')
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if position is not None:
+            start_date, pk = position
+            if reverse:
+                boundary = Q(start_date__gt=start_date) | Q(start_date=start_date, id__gt=pk)
+            else:
+                boundary = Q(start_date__lt=start_date) | Q(start_date=start_date, id__lt=pk)
+            queryset = queryset.filter(boundary)
+
+        # Fetch one extra row to find out whether there is another page
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        position = self.encode_position(self.page[-1])
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        position = self.encode_position(self.page[0])
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def encode_position(self, instance):
+        if isinstance(instance, dict):
+            start_date, pk = instance['start_date'], instance['id']
+        else:
+            start_date, pk = instance.start_date, instance.pk
+        return f'{start_date.isoformat()}|{pk}'
+
+    def decode_position(self, position):
+        try:
+            start_date, pk = position.split('|')
+            return datetime.fromisoformat(start_date), int(pk)
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
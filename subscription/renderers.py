@@ -0,0 +1,48 @@
+"""
+MessagePack renderer and parser for service-to-service clients.
+
+Selected by content negotiation: ``Accept: application/msgpack`` for
+responses and ``Content-Type: application/msgpack`` for request bodies.
+Values JSON cannot hold natively (datetimes, decimals, UUIDs, lazy
+strings) are converted the way DRF's JSONEncoder converts them, so a
+msgpack body decodes to exactly what the JSON body parses to.
+
+msgpack is optional: settings only enable these classes when it is
+installed.
+"""
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MEDIA_TYPE = 'application/msgpack'
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def __init__(self):
+        self.packer_options = {'default': JSONEncoder().default, 'use_bin_type': True}
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, **self.packer_options)
+
+
+class MessagePackParser(BaseParser):
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
@@ -0,0 +1,187 @@
+"""
+Revoked refresh tokens, by ``jti``.
+
+The RevokedToken table is the store: it survives restarts and is shared by
+every process. Rows are kept until the token's own ``exp`` (an expired
+token is rejected before anyone asks whether it was revoked), and
+``manage.py purge_revoked_tokens`` deletes them after that.
+
+Each process also keeps a Bloom filter of the revoked ``jti`` values, so
+that asking about a token that was never revoked (nearly every refresh)
+costs a few bit lookups instead of a query: the table is only read when the
+filter says "maybe". The filter must not miss revocations made by other
+processes, so every revocation bumps a version in the default cache; a
+process that sees a version it has not loaded first reads the revocations
+of the last SYNC_OVERLAP. That needs a cache shared by the processes;
+without one (or when the cache drops the bump) a process still catches up
+every REVOCATION_SYNC_INTERVAL seconds, so another process's revocation is
+honoured at most that late. ``check --deploy`` warns about a per-process
+default cache.
+"""
+import hashlib
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from threading import Lock
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import RevokedToken
+
+VERSION_KEY = 'revocation:version'
+
+# Revocations made this long before the last sync are read again on the
+# next one, covering transactions that committed out of order
+SYNC_OVERLAP = timedelta(minutes=1)
+
+
+def capacity():
+    return getattr(settings, 'REVOCATION_FILTER_CAPACITY', 1000000)
+
+
+def error_rate():
+    return getattr(settings, 'REVOCATION_FILTER_ERROR_RATE', 0.001)
+
+
+def sync_interval():
+    return timedelta(seconds=getattr(settings, 'REVOCATION_SYNC_INTERVAL', 30))
+
+
+class BloomFilter:
+    """A set of strings that may answer "maybe" for a string it does not hold, never "no" for one it does"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        # Keys that set a new bit: adding a key again does not count, so this
+        # is how full the filter is rather than how often add() was called
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        new = False
+        for position in self._positions(key):
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                new = True
+        self.count += new
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def __len__(self):
+        return self.count
+
+
+class _Filter:
+    """This process's filter and how far it has caught up with the table"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.bloom = None
+        self.version = None
+        self.synced_at = None
+
+    def load(self):
+        """Rebuild from every revocation that has not expired"""
+        self.synced_at = timezone.now()
+        revocations = RevokedToken.objects.filter(expires_at__gt=self.synced_at)
+        # More revocations than REVOCATION_FILTER_CAPACITY would fill the
+        # filter on load and rebuild it on every check; make room for twice
+        # as many instead
+        self.bloom = BloomFilter(max(capacity(), 2 * revocations.count()), error_rate())
+        for jti in revocations.values_list('jti', flat=True).iterator():
+            self.bloom.add(jti)
+
+    def catch_up(self):
+        now = timezone.now()
+        for jti in RevokedToken.objects.filter(revoked_at__gte=self.synced_at - SYNC_OVERLAP)\
+                .values_list('jti', flat=True):
+            self.bloom.add(jti)
+        self.synced_at = now
+
+    def sync(self):
+        version = cache.get(VERSION_KEY)
+        with self.lock:
+            if self.bloom is None or len(self.bloom) >= self.bloom.capacity:
+                self.load()
+            elif version is None or version != self.version \
+                    or timezone.now() - self.synced_at >= sync_interval():
+                # A revocation elsewhere, the cache lost the version, or it
+                # may have missed a bump (a per-process cache never sees one)
+                self.catch_up()
+            else:
+                return
+            if version is None:
+                cache.add(VERSION_KEY, 0, None)
+                version = cache.get(VERSION_KEY)
+            self.version = version
+
+    def add(self, jti, version):
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+                # Skip the next catch-up unless another process revoked in between
+                if version is not None and self.version == version - 1:
+                    self.version = version
+
+    def reset(self):
+        with self.lock:
+            self.bloom = self.version = self.synced_at = None
+
+
+_filter = _Filter()
+
+
+def reset():
+    """Drop this process's filter; the next check rebuilds it from the table"""
+    _filter.reset()
+
+
+def is_revoked(jti):
+    _filter.sync()
+    if jti not in _filter.bloom:
+        return False
+    return RevokedToken.objects.filter(jti=jti).exists()
+
+
+def _bump_version():
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        # No version yet (or the cache lost it): every process catches up
+        cache.add(VERSION_KEY, 0, None)
+        return None
+
+
+def revoke(jti, exp):
+    """
+    Revoke the token with claims ``jti`` and ``exp`` (a Unix timestamp).
+
+    Returns False if it already was, so that of two requests racing to
+    rotate the same token only one wins.
+    """
+    expires_at = datetime.fromtimestamp(exp, tz=dt_timezone.utc)
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+    except IntegrityError:
+        return False
+    # Other processes must not reload before the row is visible to them
+    transaction.on_commit(lambda: _filter.add(jti, _bump_version()))
+    return True
+
+
+def purge():
+    """Delete the revocations of tokens that have expired; returns how many"""
+    deleted, _ = RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
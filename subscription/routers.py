@@ -0,0 +1,93 @@
+"""
+Read-replica routing with read-your-writes stickiness.
+
+Writes always go to ``default``. Reads go to ``default`` too unless
+ReplicaMiddleware picked a replica for the request: it does so for safe
+requests to views with ``read_replica = True`` whose client has not
+written recently. A successful write pins the writer to the primary for
+REPLICA_PIN_SECONDS through a cache key on their user id (JWT clients)
+and a cookie (browsers, anonymous clients), so they read what they
+just wrote even if the replicas lag behind.
+
+Replicas are the aliases listed in DATABASE_REPLICAS; with none listed
+everything reads from ``default``.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+
+PIN_COOKIE = 'primary_pin'
+
+# Alias reads of the current request are routed to (None: default)
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def pin_seconds():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+
+
+def pin_key(user_id):
+    return f'replica:pin:{user_id}'
+
+
+def pin_user(user_id):
+    """Send ``user_id``'s reads to the primary for the next REPLICA_PIN_SECONDS"""
+    cache.set(pin_key(user_id), 1, pin_seconds())
+
+
+def is_pinned(user_id):
+    return cache.get(pin_key(user_id)) is not None
+
+
+def choose_replica():
+    aliases = replicas()
+    return random.choice(aliases) if aliases else None
+
+
+def read_from(alias):
+    """Route the rest of the request's reads to ``alias``; ReplicaMiddleware resets it"""
+    _read_alias.set(alias)
+
+
+@contextmanager
+def reading_from(alias):
+    """Route the block's reads to ``alias`` (None for the primary)"""
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def current_read_alias():
+    return _read_alias.get()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Never None: Django would fall back to the database of a hinted
+        # instance, which may be a subscription shard without this table
+        return _read_alias.get() or 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {'default', *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema from the primary through replication
+        # (or sync_sqlite_replicas locally)
+        if db in replicas():
+            return False
+        return None
@@ -0,0 +1,113 @@
+"""
+Pre-rendered OpenAPI schema (swagger.json, swagger.yaml and the spec the
+Swagger UI and ReDoc pages load).
+
+drf_yasg introspects every view and serializer on each request. Here the
+rendered bytes are kept per process and in the cache under a fingerprint of
+the code that shapes the schema: the source of the project's apps, the
+versions of Django, DRF and drf_yasg, and SWAGGER_SETTINGS. Code only
+changes with a deploy, so nothing needs invalidating; a new fingerprint
+simply misses the cache. ``manage.py render_openapi`` fills the cache
+before the first request.
+
+The schema names the host it was requested from, so the bytes are kept per
+scheme and host as well.
+"""
+import hashlib
+import sys
+from functools import lru_cache
+from pathlib import Path
+import django
+import drf_yasg
+import rest_framework
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from drf_yasg.renderers import OpenAPIRenderer, SwaggerJSONRenderer, SwaggerYAMLRenderer
+
+SPEC_RENDERERS = (OpenAPIRenderer, SwaggerJSONRenderer, SwaggerYAMLRenderer)
+
+# {(fingerprint, codec, origin): (content, etag)} of this process, for at
+# most MEMO_SIZE origins and formats
+_rendered = {}
+MEMO_SIZE = 32
+
+
+def _timeout():
+    return getattr(settings, 'OPENAPI_CACHE_TIMEOUT', None)
+
+
+def source_files():
+    """Python files of the apps that live in the project"""
+    base = Path(settings.BASE_DIR).resolve()
+    files = set()
+    for app_config in apps.get_app_configs():
+        path = Path(app_config.path).resolve()
+        if path.is_relative_to(base):
+            files.update(path.rglob('*.py'))
+    return sorted(files)
+
+
+@lru_cache(maxsize=None)
+def fingerprint():
+    """Hash of everything the schema is generated from; computed once per process"""
+    digest = hashlib.sha256()
+    for version in (django.__version__, rest_framework.VERSION, drf_yasg.__version__, sys.version):
+        digest.update(version.encode())
+    digest.update(repr(sorted(getattr(settings, 'SWAGGER_SETTINGS', {}).items())).encode())
+    base = Path(settings.BASE_DIR).resolve()
+    for path in source_files():
+        digest.update(str(path.relative_to(base)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def cache_key(codec, origin):
+    return f'openapi:{fingerprint()}:{codec}:{origin}'
+
+
+def rendered(request, renderer, generate):
+    """``(content, etag)`` of the schema as ``renderer`` renders it; ``generate()`` builds it on a miss"""
+    origin = f'{request.scheme}://{request.get_host()}'
+    codec = renderer.codec_class.__name__
+    memo_key = (fingerprint(), codec, origin)
+    if memo_key in _rendered:
+        return _rendered[memo_key]
+
+    key = cache_key(codec, origin)
+    document = cache.get(key)
+    if document is None:
+        content = renderer.render(generate())
+        document = (content, f'"openapi-{hashlib.sha256(content).hexdigest()[:32]}"')
+        cache.set(key, document, _timeout())
+    if len(_rendered) >= MEMO_SIZE:
+        _rendered.clear()
+    _rendered[memo_key] = document
+    return document
+
+
+def response(request, renderer, generate):
+    content, etag = rendered(request, renderer, generate)
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        return HttpResponseNotModified(headers={'ETag': etag})
+    return HttpResponse(
+        content, content_type=f'{renderer.media_type}; charset={renderer.charset}', headers={'ETag': etag}
+    )
+
+
+def cached_schema_view(schema_view):
+    """``schema_view`` (from drf_yasg's get_schema_view) serving its spec formats pre-rendered"""
+
+    class CachedSchemaView(schema_view):
+        def get(self, request, version='', format=None):
+            renderer = request.accepted_renderer
+            if not isinstance(renderer, SPEC_RENDERERS):
+                # The Swagger UI and ReDoc pages do not introspect the views
+                return super().get(request, version, format)
+            generate = super().get
+            return response(request, renderer, lambda: generate(request, version, format).data)
+
+    return CachedSchemaView
@@ -0,0 +1,93 @@
+"""
+Write paths for subscriptions.
+
+Every endpoint that activates or deactivates a subscription goes through
+here. A plan switch is, in a single transaction: a SELECT ... FOR UPDATE of
+the user's CurrentSubscription pointer (its plan feeds the PlanStats
+counters), the UPDATE that deactivates the row it points to by primary
+key, one UPDATE of the counters, one INSERT, the upsert re-pointing
+the pointer and the INSERT of the outbox event (subscription.outbox).
+
+* the pointer lock serializes concurrent switches for the same user; the
+  second one re-reads the pointer, finds the new row and switches away
+  from it;
+* if the user has no pointer there is nothing to lock, and the partial
+  unique constraint on (user) WHERE is_active makes the loser of a
+  concurrent race fail with IntegrityError. It is retried once, which
+  turns it into an ordinary switch away from the winner's row.
+* an active row without a pointer (drift, see current.reconcile()) is
+  looked up and locked instead whenever the pointer is missing and a row
+  is needed: by switches and deactivations, and by the retry of a
+  subscribe that hit the constraint. It is deactivated and re-pointed
+  like any other.
+
+With several subscription shards the transaction is one on the user's
+shard inside one on default, for the counters (see sharding.atomic()).
+"""
+from django.db import IntegrityError, transaction
+from . import current, entitlements, outbox, sharding, stats
+from .models import OutboxEvent, Subscription
+
+
+class NoActiveSubscription(Exception):
+    """The user has no active subscription to switch or deactivate"""
+
+
+def _invalidate(user_id):
+    transaction.on_commit(lambda: entitlements.invalidate_user(user_id))
+
+
+def _activate(user, plan, require_active):
+    for attempt in range(2):
+        try:
+            with sharding.atomic(user.pk):
+                previous = current.lock(user.pk)
+                if previous is None and (require_active or attempt):
+                    previous = current.lock_unpointed(user.pk)
+                if previous is None:
+                    if require_active:
+                        raise NoActiveSubscription
+                    previous_plan_id = None
+                else:
+                    previous_id, previous_plan_id = previous
+                    Subscription.objects.filter(user=user, pk=previous_id).update(is_active=False)
+                stats.record_activation(plan.pk, previous_plan_id)
+                # bulk_create issues the bare INSERT; Subscription.save would
+                # repeat the deactivation UPDATE we have just run
+                subscription = Subscription(user=user, plan=plan, is_active=True)
+                Subscription.objects.bulk_create([subscription])
+                current.point([subscription])
+                outbox.record(
+                    OutboxEvent.CREATED if previous is None else OutboxEvent.SWITCHED,
+                    user.pk, subscription.pk, plan.pk, previous_plan_id,
+                )
+        except IntegrityError:
+            if attempt:
+                raise
+        else:
+            _invalidate(user.pk)
+            return subscription
+
+
+def subscribe(user, plan):
+    """Make ``plan`` the user's only active subscription"""
+    return _activate(user, plan, require_active=False)
+
+
+def switch_plan(user, plan):
+    """Replace the user's active subscription with one for ``plan``"""
+    return _activate(user, plan, require_active=True)
+
+
+def deactivate(user):
+    """Deactivate the user's active subscription"""
+    with sharding.atomic(user.pk):
+        previous = current.lock(user.pk) or current.lock_unpointed(user.pk)
+        if previous is None:
+            raise NoActiveSubscription
+        subscription_id, plan_id = previous
+        Subscription.objects.filter(user=user, pk=subscription_id).update(is_active=False)
+        current.clear(user.pk)
+        stats.record_deactivation(plan_id)
+        outbox.record(OutboxEvent.DEACTIVATED, user.pk, subscription_id, plan_id)
+    _invalidate(user.pk)
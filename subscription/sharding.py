@@ -0,0 +1,185 @@
+"""
+Horizontal sharding of subscriptions by user id.
+
+SUBSCRIPTION_SHARDS lists the database aliases that hold the Subscription,
+CurrentSubscription and OutboxEvent tables; a user's rows all live on
+``shard_for_user(user_id)``, picked by a stable hash of the id. Users,
+plans, features and the PlanStats counters stay on ``default``. With a
+single shard (the default, ``['default']``) nothing here changes how
+queries are routed.
+
+ShardRouter sends a Subscription query to its user's shard when it can
+tell the user: ``filter(user=...)`` / ``filter(user_id=...)`` on
+Subscription.objects, ``user.subscriptions``, or an instance being
+saved or deleted. Any other query raises ShardKeyMissing instead of
+silently reading one shard; use ``.using(alias)`` or fan_out().
+
+Rows on different databases cannot be joined, so with several shards the
+subscription queries here do not select_related() users or plans, and
+the foreign keys carry no database constraint. Writes open a transaction
+on the shard and one on ``default`` (see atomic()); the two commit one
+after the other, not atomically, and ``reconcile_plan_stats`` repairs the
+counters if a commit in between fails. Subscription ids are only unique
+per shard. Changing SUBSCRIPTION_SHARDS moves users to other shards and
+needs their rows moved; there is no rebalancing tool.
+"""
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, models, transaction
+
+# Models whose rows are placed by user id (app_label.model_name)
+SHARDED_MODELS = {'subscription.subscription', 'subscription.currentsubscription', 'subscription.outboxevent'}
+
+
+class ShardKeyMissing(LookupError):
+    """A query on a sharded model did not say which user's rows it wants"""
+
+
+def shards():
+    return list(getattr(settings, 'SUBSCRIPTION_SHARDS', ['default']))
+
+
+def is_sharded():
+    return len(shards()) > 1
+
+
+def shard_for_user(user_id):
+    aliases = shards()
+    if len(aliases) == 1:
+        return aliases[0]
+    # crc32 is stable across processes and Python versions, unlike hash()
+    return aliases[zlib.crc32(str(user_id).encode()) % len(aliases)]
+
+
+def group_by_shard(objs, user_id=lambda obj: obj.user_id):
+    """``{alias: [obj, ...]}`` for objects keyed by user id"""
+    groups = {}
+    for obj in objs:
+        groups.setdefault(shard_for_user(user_id(obj)), []).append(obj)
+    return groups
+
+
+@contextmanager
+def atomic(user_id):
+    """transaction.atomic() on ``default`` and, if it is elsewhere, on the user's shard"""
+    alias = shard_for_user(user_id)
+    with transaction.atomic(using='default'):
+        if alias == 'default':
+            yield
+        else:
+            with transaction.atomic(using=alias):
+                yield
+
+
+@contextmanager
+def atomic_all():
+    """transaction.atomic() on ``default`` and every shard"""
+    with ExitStack() as stack:
+        for alias in dict.fromkeys(['default', *shards()]):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def _run_on(alias, query, model):
+    try:
+        return query(model._default_manager.using(alias))
+    finally:
+        connections[alias].close()
+
+
+def fan_out(query, model=None, parallel=True):
+    """
+    ``{alias: query(queryset)}`` for every shard, for cross-shard reports.
+
+    ``query`` receives ``model``'s (Subscription's) default manager bound to
+    one shard. With several shards and ``parallel`` the shards are queried
+    at the same time, each from its own thread and connection, so they do
+    not see the caller's uncommitted writes.
+    """
+    if model is None:
+        from .models import Subscription as model
+    aliases = shards()
+    if not parallel or len(aliases) == 1:
+        return {alias: query(model._default_manager.using(alias)) for alias in aliases}
+    with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+        results = pool.map(lambda alias: _run_on(alias, query, model), aliases)
+        return dict(zip(aliases, results))
+
+
+def _shard_key(kwargs):
+    for name in ('user', 'user_id', 'user__id', 'user__pk'):
+        if name in kwargs:
+            return getattr(kwargs[name], 'pk', kwargs[name])
+    return None
+
+
+class ShardedQuerySet(models.QuerySet):
+    """Remembers the user a query is filtered on, for ShardRouter"""
+
+    def _filter_or_exclude(self, negate, args, kwargs):
+        clone = super()._filter_or_exclude(negate, args, kwargs)
+        key = None if negate else _shard_key(kwargs)
+        if key is not None and 'shard_key' not in clone._hints:
+            # Clones share the hints dict; replace it rather than update it
+            clone._hints = {**clone._hints, 'shard_key': key}
+        return clone
+
+    def create(self, **kwargs):
+        # QuerySet.create() would pick the database before the instance
+        # exists; let the router see the instance instead
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        if self._db is not None or not is_sharded():
+            return super().bulk_create(objs, *args, **kwargs)
+        for alias, group in group_by_shard(objs).items():
+            super(ShardedQuerySet, self.using(alias)).bulk_create(group, *args, **kwargs)
+        return objs
+
+
+ShardedManager = models.Manager.from_queryset(ShardedQuerySet)
+
+
+class ShardRouter:
+    """Routes SHARDED_MODELS by user id; everything else is left to the next router"""
+
+    def _shard(self, model, hints):
+        if model._meta.label_lower not in SHARDED_MODELS or not is_sharded():
+            return None
+        key = hints.get('shard_key')
+        instance = hints.get('instance')
+        if key is None and instance is not None:
+            if isinstance(instance, get_user_model()):
+                key = instance.pk
+            elif instance._meta.label_lower in SHARDED_MODELS:
+                key = instance.user_id
+        if key is None:
+            raise ShardKeyMissing(
+                f'{model.__name__} query without a user to pick its shard by; '
+                f'use .using(alias) or subscription.sharding.fan_out()'
+            )
+        return shard_for_user(key)
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded() and {obj1._meta.label_lower, obj2._meta.label_lower} & SHARDED_MODELS:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards other than default only hold the sharded tables
+        if not is_sharded() or db == 'default' or db not in shards():
+            return None
+        return f'{app_label}.{model_name}' in SHARDED_MODELS
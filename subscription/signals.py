@@ -0,0 +1,105 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from . import catalog, entitlements, instrumentation, sharding, stats
+from .authentication import forget_user
+from .models import Feature, Plan, PlanStats, Subscription
+
+User = get_user_model()
+
+
+# Invalidation runs on commit so a concurrent reader cannot re-cache the
+# state we are about to replace.
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscription_entitlements(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: entitlements.invalidate_user(user_id))
+
+
+@receiver(post_save, sender=Plan)
+def create_plan_stats(sender, instance, created, raw=False, **kwargs):
+    # Saves the first activation the lookup for a missing counter row
+    if created and not raw:
+        PlanStats.objects.create(plan=instance)
+
+
+@receiver(post_delete, sender=Subscription)
+def count_deleted_subscription(sender, instance, **kwargs):
+    # Deleting a user or a plan cascades here. A deleted plan's counters go
+    # with it, so never recreate them.
+    if instance.is_active:
+        stats.record_active_changes([instance.plan_id], [], create_missing=False)
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_user_subscriptions(sender, instance, using, **kwargs):
+    # The cascade only reaches rows on the database the user is deleted
+    # from; a user's subscriptions may live on another shard
+    alias = sharding.shard_for_user(instance.pk)
+    if alias != using:
+        Subscription.objects.using(alias).filter(user_id=instance.pk).delete()
+
+
+@receiver(pre_delete, sender=Plan)
+def delete_sharded_plan_subscriptions(sender, instance, using, **kwargs):
+    for alias in sharding.shards():
+        if alias != using:
+            Subscription.objects.using(alias).filter(plan_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+def invalidate_plan_entitlements(sender, instance, **kwargs):
+    plan_id = instance.pk
+    transaction.on_commit(lambda: entitlements.invalidate_plans([plan_id]))
+
+
+@receiver(m2m_changed, sender=Plan.features.through)
+def invalidate_plan_feature_entitlements(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # feature.plans.add(...) and friends; instance is the Feature
+        plan_ids = list(pk_set) if pk_set else list(instance.plans.values_list('id', flat=True))
+    else:
+        plan_ids = [instance.pk]
+    transaction.on_commit(lambda: entitlements.invalidate_plans(plan_ids))
+
+
+@receiver(post_save, sender=Feature)
+@receiver(pre_delete, sender=Feature)
+def invalidate_feature_entitlements(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    plan_ids = list(instance.plans.values_list('id', flat=True))
+    if plan_ids:
+        transaction.on_commit(lambda: entitlements.invalidate_plans(plan_ids))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    # Same-process invalidation; other processes catch up within JWT_USER_CACHE_TTL
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+@receiver(post_save, sender=Feature)
+@receiver(post_delete, sender=Feature)
+@receiver(m2m_changed, sender=Plan.features.through)
+def bump_catalog_version(sender, action=None, **kwargs):
+    if action is not None and action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    transaction.on_commit(catalog.bump_version)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    # Fires again when a closed connection reconnects; install only once
+    if instrumentation.record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(instrumentation.record_query)
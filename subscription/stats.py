@@ -0,0 +1,103 @@
+"""
+Per-plan subscriber counters (PlanStats).
+
+Every path that activates or deactivates a subscription calls in here
+inside its own transaction, so the counters commit or roll back together
+with the change and reading them never scans the subscription history.
+
+``active_count`` can always be recomputed from Subscription (reconcile()).
+The switch counters are event counts: the history does not record why a
+subscription ended, so they cannot be rebuilt from it.
+"""
+from collections import Counter
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from . import sharding
+from .models import Plan, PlanStats
+
+COUNTERS = ('active_count', 'switches_in', 'switches_out')
+
+
+def adjust(deltas, create_missing=True):
+    """Add ``{plan_id: {counter: delta}}`` to the counters with one UPDATE"""
+    deltas = {plan_id: delta for plan_id, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+
+    updates = {}
+    for counter in COUNTERS:
+        whens = [
+            When(plan_id=plan_id, then=Value(delta[counter]))
+            for plan_id, delta in deltas.items() if delta.get(counter)
+        ]
+        if whens:
+            updates[counter] = F(counter) + Case(*whens, default=Value(0), output_field=IntegerField())
+    updated = PlanStats.objects.filter(plan_id__in=deltas).update(**updates)
+
+    if updated < len(deltas) and create_missing:
+        # First change for a plan: its counters start from zero. Rows go in
+        # empty and the deltas are applied with the same UPDATE, so a
+        # concurrent creator does not make us lose ours.
+        existing = set(PlanStats.objects.filter(plan_id__in=deltas).values_list('plan_id', flat=True))
+        missing = {plan_id: delta for plan_id, delta in deltas.items() if plan_id not in existing}
+        PlanStats.objects.bulk_create([PlanStats(plan_id=plan_id) for plan_id in missing], ignore_conflicts=True)
+        adjust(missing, create_missing=False)
+
+
+def record_activation(plan_id, previous_plan_id=None):
+    """A subscription to ``plan_id`` became active, replacing one to ``previous_plan_id``"""
+    if previous_plan_id is None:
+        adjust({plan_id: {'active_count': 1}})
+    elif previous_plan_id == plan_id:
+        adjust({plan_id: {'switches_in': 1, 'switches_out': 1}})
+    else:
+        adjust({
+            plan_id: {'active_count': 1, 'switches_in': 1},
+            previous_plan_id: {'active_count': -1, 'switches_out': 1},
+        })
+
+
+def record_deactivation(plan_id):
+    adjust({plan_id: {'active_count': -1}})
+
+
+def record_active_changes(deactivated, activated, create_missing=True):
+    """Bulk and admin paths: plan ids of rows that stopped / started being active"""
+    counts = Counter(activated)
+    counts.subtract(deactivated)
+    adjust({plan_id: {'active_count': count} for plan_id, count in counts.items()}, create_missing)
+
+
+def reconcile(fix=True):
+    """
+    Recompute every plan's active_count from Subscription.
+
+    Returns ``[(plan_id, stored, actual)]`` for the plans that drifted and,
+    with ``fix``, overwrites them. The counter rows are locked first: writers
+    update them after changing Subscription, so an in-flight change is either
+    in the recount or applied on top of the fixed value, never both.
+    """
+    with transaction.atomic():
+        stored = dict(PlanStats.objects.select_for_update().values_list('plan_id', 'active_count'))
+        # On this thread: with a single shard the count then runs inside the
+        # transaction holding the locks
+        per_shard = sharding.fan_out(lambda subscriptions: list(
+            subscriptions.filter(is_active=True).order_by()
+            .values('plan_id').annotate(count=Count('id')).values_list('plan_id', 'count')
+        ), parallel=False)
+        actual = Counter()
+        for counts in per_shard.values():
+            actual.update(dict(counts))
+        plan_ids = set(Plan.objects.values_list('id', flat=True))
+        drift = [
+            (plan_id, stored.get(plan_id, 0), actual.get(plan_id, 0))
+            for plan_id in sorted(plan_ids)
+            if stored.get(plan_id, 0) != actual.get(plan_id, 0)
+        ]
+        if fix:
+            PlanStats.objects.bulk_create(
+                [PlanStats(plan_id=plan_id) for plan_id in plan_ids - set(stored)], ignore_conflicts=True
+            )
+            for plan_id, _, count in drift:
+                PlanStats.objects.filter(plan_id=plan_id).update(active_count=count)
+    return drift
@@ -1,9 +1,40 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipIf
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.contrib.auth import get_user_model
-from rest_framework.test import APITestCase
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Feature, Plan, Subscription
+from drf_yasg.generators import OpenAPISchemaGenerator
+from . import (catalog, checks, current, entitlements, hashing, idempotency, instrumentation, outbox, renderers,
+               revocation, routers, schema, services, sharding, stats, throttling)
+from .authentication import CachedJWTAuthentication, user_rows
+from .benchmarks import StubWebhookServer
+from .caching import LRUCache
+from .entitlements import get_user_entitlements
+from .models import CurrentSubscription, Feature, OutboxEvent, Plan, PlanStats, RevokedToken, Subscription
 
 User = get_user_model()
 
@@ -33,6 +64,18 @@ class SubscriptionModelTestCase(TestCase):
         self.assertFalse(subscription1.is_active)
         self.assertTrue(subscription2.is_active)
 
+    def test_database_rejects_second_active_subscription(self):
+        """Writes that bypass Subscription.save cannot leave two active rows"""
+        Subscription.objects.create(user=self.user, plan=self.plan)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Subscription.objects.bulk_create([Subscription(user=self.user, plan=self.plan, is_active=True)])
+
+        # Any number of inactive rows is fine
+        Subscription.objects.bulk_create(
+            Subscription(user=self.user, plan=self.plan, is_active=False) for _ in range(3)
+        )
+        self.assertEqual(Subscription.objects.filter(user=self.user, is_active=True).count(), 1)
+
 
 class SubscriptionAPITestCase(APITestCase):
     def setUp(self):
@@ -123,3 +166,1991 @@ class SubscriptionAPITestCase(APITestCase):
         self.client.credentials()  # remove auth
         response = self.client.get('/api/v1/subscriptions/')
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class EntitlementTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username=f'entuser_{self._testMethodName}',
+            email=f'ent_{self._testMethodName}@example.com',
+            password='testpass123'
+        )
+        self.feature1 = Feature.objects.create(name='Call Support')
+        self.feature2 = Feature.objects.create(name='Tech Support')
+        self.plan = Plan.objects.create(name='Advanced Plan')
+        self.plan.features.add(self.feature1, self.feature2)
+
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+
+    def test_warm_lookup_does_no_queries(self):
+        Subscription.objects.create(user=self.user, plan=self.plan)
+        get_user_entitlements(self.user.id)
+
+        with self.assertNumQueries(0):
+            result = get_user_entitlements(self.user.id)
+
+        self.assertEqual(result['plan'], {'id': self.plan.id, 'name': 'Advanced Plan'})
+        self.assertEqual([f['name'] for f in result['features']], ['Call Support', 'Tech Support'])
+
+    def test_user_without_subscription_is_cached(self):
+        get_user_entitlements(self.user.id)
+        with self.assertNumQueries(0):
+            result = get_user_entitlements(self.user.id)
+        self.assertIsNone(result['plan'])
+        self.assertEqual(result['features'], [])
+
+    def test_plan_switch_invalidates_user(self):
+        subscription = Subscription.objects.create(user=self.user, plan=self.plan)
+        get_user_entitlements(self.user.id)
+
+        new_plan = Plan.objects.create(name='Simple Plan')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put('/api/v1/subscriptions/update/', {'plan': new_plan.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_user_entitlements(self.user.id)['plan']['id'], new_plan.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/subscriptions/deactivate/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(get_user_entitlements(self.user.id)['plan'])
+
+    def test_feature_change_invalidates_plan(self):
+        Subscription.objects.create(user=self.user, plan=self.plan)
+        get_user_entitlements(self.user.id)
+
+        feature3 = Feature.objects.create(name='Analytics')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plan.features.add(feature3)
+        self.assertEqual(len(get_user_entitlements(self.user.id)['features']), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plan.features.remove(self.feature1)
+        self.assertEqual(len(get_user_entitlements(self.user.id)['features']), 2)
+
+    def test_stale_read_is_not_cached_back(self):
+        services.subscribe(self.user, self.plan)
+        new_plan = Plan.objects.create(name='Simple Plan')
+        current_plan_id = entitlements._current_plan_id
+
+        def read_then_switch(user_id):
+            # The reader has the old plan in hand when the switch commits
+            old = current_plan_id(user_id).first()
+            with self.captureOnCommitCallbacks(execute=True):
+                services.switch_plan(self.user, new_plan)
+            return mock.Mock(first=mock.Mock(return_value=old))
+
+        with mock.patch('subscription.entitlements._current_plan_id', side_effect=read_then_switch):
+            self.assertEqual(entitlements.get_active_plan_id(self.user.id), self.plan.id)
+        self.assertEqual(entitlements.get_active_plan_id(self.user.id), new_plan.id)
+
+    def test_entitlement_endpoints(self):
+        Subscription.objects.create(user=self.user, plan=self.plan)
+
+        response = self.client.get('/api/v1/entitlements/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['plan']['name'], 'Advanced Plan')
+
+        response = self.client.get(f'/api/v1/entitlements/{self.user.id}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(f'/api/v1/entitlements/{self.user.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['features']), 2)
+
+
+class EntitlementBatchTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='testpass123', is_staff=True
+        )
+        self.basic = Plan.objects.create(name='Basic')
+        self.pro = Plan.objects.create(name='Pro')
+        self.feature = Feature.objects.create(name='Priority Support')
+        self.pro.features.add(self.feature)
+        self.users = [
+            User.objects.create_user(username=f'user{i}@example.com', email=f'user{i}@example.com', password='x')
+            for i in range(5)
+        ]
+        for user, plan in zip(self.users, [self.basic, self.pro, self.pro, self.basic]):
+            services.subscribe(user, plan)
+        self.url = '/api/v1/entitlements/batch/'
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.staff).access_token}')
+
+    def test_matches_single_lookups(self):
+        ids = [user.pk for user in reversed(self.users)]
+        results = list(entitlements.iter_user_entitlements(user_ids=ids + [0]))
+        self.assertEqual(results[:-1], [get_user_entitlements(pk) for pk in ids])
+        self.assertEqual(results[-1], {'user_id': 0, 'error': 'unknown user'})
+        self.assertEqual(results[2]['features'], [{'id': self.feature.pk, 'name': 'Priority Support'}])
+
+        results = list(entitlements.iter_user_entitlements(emails=['user1@example.com', 'nobody@example.com']))
+        self.assertEqual(results[0], {'email': 'user1@example.com', **get_user_entitlements(self.users[1].pk)})
+        self.assertEqual(results[1], {'email': 'nobody@example.com', 'error': 'unknown user'})
+
+    def test_ambiguous_email(self):
+        # A user model whose emails are not unique
+        rows = [('user1@example.com', self.users[1].pk), ('user1@example.com', self.users[2].pk),
+                ('user3@example.com', self.users[3].pk)]
+        with mock.patch('subscription.entitlements.get_user_model') as get_user_model:
+            get_user_model.return_value.objects.filter.return_value.values_list.return_value = rows
+            results = list(entitlements.iter_user_entitlements(emails=['user1@example.com', 'user3@example.com']))
+        self.assertEqual(results[0], {'email': 'user1@example.com', 'error': 'ambiguous email'})
+        self.assertEqual(results[1], {'email': 'user3@example.com', **get_user_entitlements(self.users[3].pk)})
+
+    @override_settings(ENTITLEMENT_BATCH_CHUNK_SIZE=2)
+    def test_queries_per_chunk(self):
+        ids = [user.pk for user in self.users]
+        # Per chunk of two: users and pointers, plus the plans not cached
+        # yet (both, in the first chunk)
+        with self.assertNumQueries(3 * 2 + 1):
+            self.assertEqual(len(list(entitlements.iter_user_entitlements(user_ids=ids))), 5)
+        # Warm: only the users
+        with self.assertNumQueries(3):
+            list(entitlements.iter_user_entitlements(user_ids=ids))
+
+    @override_settings(ENTITLEMENT_BATCH_CHUNK_SIZE=2)
+    def test_endpoint_streams_ndjson(self):
+        response = self.client.post(self.url, {'user_ids': [user.pk for user in self.users]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 3)
+        lines = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+        self.assertEqual([line['plan'] and line['plan']['name'] for line in lines],
+                         ['Basic', 'Pro', 'Pro', 'Basic', None])
+
+        response = self.client.post(self.url, {'emails': ['user2@example.com']}, format='json')
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['plan']['name'], 'Pro')
+
+    @override_settings(ENTITLEMENT_BATCH_MAX_USERS=2)
+    def test_validation_and_permissions(self):
+        for data in ({}, {'user_ids': [1], 'emails': ['a@example.com']}, {'user_ids': [1, 2, 3]}):
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.users[0]).access_token}')
+        response = self.client.post(self.url, {'user_ids': [1]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bench_command(self):
+        out = StringIO()
+        call_command('bench_entitlements', users=[5, 10], plans=2, features_per_plan=2, iterations=2, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['batches']['10']), {'batch_cold', 'batch_warm', 'per_user_cold'})
+        self.assertFalse(User.objects.filter(username__startswith='bench_entitlements_').exists())
+
+
+class SubscriptionCursorPaginationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username=f'cursoruser_{self._testMethodName}',
+            email=f'cursor_{self._testMethodName}@example.com',
+            password='testpass123'
+        )
+        self.plan = Plan.objects.create(name='Pro Plan')
+        self.plan.features.add(Feature.objects.create(name='Priority Support'))
+        # 45 rows sharing a handful of start dates, so the id tie-breaker matters
+        Subscription.objects.bulk_create(
+            Subscription(user=self.user, plan=self.plan, is_active=False) for _ in range(45)
+        )
+        Subscription.objects.filter(user=self.user, id__lte=Subscription.objects.order_by('id')[20].id)\
+            .update(start_date=timezone.now())
+
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+
+    def test_cursor_mode_skips_count_query(self):
+        with self.assertNumQueries(3):  # 1 user, 1 subscription+plan, 1 prefetch features
+            response = self.client.get('/api/v1/subscriptions/?pagination=cursor')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), 20)
+        self.assertIsNone(data['previous'])
+
+    def test_walk_forward_and_back(self):
+        expected = list(
+            Subscription.objects.filter(user=self.user).order_by('-start_date', '-id').values_list('id', flat=True)
+        )
+
+        seen, pages, url = [], [], '/api/v1/subscriptions/?pagination=cursor'
+        while url:
+            data = self.client.get(url).json()
+            pages.append([row['id'] for row in data['results']])
+            seen.extend(pages[-1])
+            url = data['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+
+        previous = data['previous']
+        self.assertEqual([row['id'] for row in self.client.get(previous).json()['results']], pages[1])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v1/subscriptions/?pagination=cursor&cursor=bogus')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+def write_statements(captured):
+    """SQL from a CaptureQueriesContext minus the savepoints TestCase wraps atomic() in"""
+    return [
+        query['sql'].split(' ', 1)[0]
+        for query in captured
+        if 'SAVEPOINT' not in query['sql']
+    ]
+
+
+class SubscriptionServiceTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username=f'svcuser_{self._testMethodName}',
+            email=f'svc_{self._testMethodName}@example.com',
+            password='testpass123'
+        )
+        self.plan = Plan.objects.create(name='Pro Plan')
+        self.new_plan = Plan.objects.create(name='Enterprise Plan')
+
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+
+    def test_switch_statements(self):
+        old = services.subscribe(self.user, self.plan)
+
+        with CaptureQueriesContext(connection) as captured:
+            new = services.switch_plan(self.user, self.new_plan)
+        # lock the pointer, deactivate its row by pk, both plans' counters,
+        # insert, re-point, outbox event
+        self.assertEqual(write_statements(captured), ['SELECT', 'UPDATE', 'UPDATE', 'INSERT', 'INSERT', 'INSERT'])
+        self.assertEqual(self.user.current_subscription.subscription, new)
+
+        old.refresh_from_db()
+        self.assertFalse(old.is_active)
+        self.assertTrue(Subscription.objects.get(pk=new.pk).is_active)
+
+    def test_subscribe_statements(self):
+        with CaptureQueriesContext(connection) as captured:
+            services.subscribe(self.user, self.plan)
+        self.assertEqual(write_statements(captured), ['SELECT', 'UPDATE', 'INSERT', 'INSERT', 'INSERT'])
+
+    def test_switch_without_active_subscription(self):
+        with self.assertRaises(services.NoActiveSubscription):
+            services.switch_plan(self.user, self.new_plan)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_deactivate_statements(self):
+        services.subscribe(self.user, self.plan)
+        with CaptureQueriesContext(connection) as captured:
+            services.deactivate(self.user)
+        self.assertEqual(write_statements(captured), ['SELECT', 'UPDATE', 'DELETE', 'UPDATE', 'INSERT'])
+        self.assertFalse(Subscription.objects.filter(is_active=True).exists())
+        self.assertFalse(CurrentSubscription.objects.exists())
+
+        with self.assertRaises(services.NoActiveSubscription):
+            services.deactivate(self.user)
+
+    def test_active_row_without_pointer(self):
+        # Drift the pointer knows nothing about, e.g. a bulk update
+        def drift():
+            row = Subscription.objects.create(user=self.user, plan=self.plan, is_active=False)
+            Subscription.objects.filter(user=self.user, pk=row.pk).update(is_active=True)
+            return row
+
+        old = drift()
+        response = self.client.post('/api/v1/subscriptions/create/', {'plan': self.new_plan.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        old.refresh_from_db()
+        self.assertFalse(old.is_active)
+        self.assertEqual(CurrentSubscription.objects.get(user=self.user).plan, self.new_plan)
+
+        CurrentSubscription.objects.all().delete()
+        response = self.client.put('/api/v1/subscriptions/update/', {'plan': self.plan.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Subscription.objects.get(user=self.user, is_active=True).plan, self.plan)
+
+        CurrentSubscription.objects.all().delete()
+        response = self.client.post('/api/v1/subscriptions/deactivate/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Subscription.objects.filter(user=self.user, is_active=True).exists())
+        self.assertEqual(current.reconcile(fix=False), [])
+
+    def test_update_endpoint_query_budget(self):
+        services.subscribe(self.user, self.plan)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.put('/api/v1/subscriptions/update/', {'plan': self.new_plan.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # user, active row, plan validation, switch, features of the returned plan
+        self.assertEqual(
+            write_statements(captured),
+            ['SELECT', 'SELECT', 'SELECT', 'SELECT', 'UPDATE', 'UPDATE', 'INSERT', 'INSERT', 'INSERT', 'SELECT']
+        )
+
+    def test_create_endpoint_query_budget(self):
+        services.subscribe(self.user, self.plan)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post('/api/v1/subscriptions/create/', {'plan': self.new_plan.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            write_statements(captured),
+            ['SELECT', 'SELECT', 'SELECT', 'UPDATE', 'UPDATE', 'INSERT', 'INSERT', 'INSERT'],
+        )
+        self.assertEqual(Subscription.objects.get(is_active=True).plan, self.new_plan)
+
+    def test_update_endpoint_without_active_subscription(self):
+        response = self.client.put('/api/v1/subscriptions/update/', {'plan': self.new_plan.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        # Checked before the body is validated
+        response = self.client.put('/api/v1/subscriptions/update/', {'plan': 999999})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CachedJWTAuthenticationTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username=f'authuser_{self._testMethodName}',
+            email=f'auth_{self._testMethodName}@example.com',
+            password='testpass123'
+        )
+        self.plan = Plan.objects.create(name='Pro Plan')
+        self.plan.features.add(Feature.objects.create(name='Priority Support'))
+        Subscription.objects.create(user=self.user, plan=self.plan)
+
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+
+    def test_warm_read_endpoints_skip_user_query(self):
+        self.client.get('/api/v1/subscriptions/')
+        with self.assertNumQueries(3):  # 1 count, 1 subscription+plan, 1 prefetch features
+            response = self.client.get('/api/v1/subscriptions/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        cache.clear()  # drop the cached catalog listings, keep the user rows
+        for url, queries in [
+            ('/api/v1/features/', 2),  # count, features
+            ('/api/v1/plans/', 3),  # count, plans, prefetch features
+        ]:
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deactivated_user_rejected_after_ttl(self):
+        self.client.get('/api/v1/features/')
+        User.objects.filter(pk=self.user.pk).update(is_active=False)  # no signal, like another process
+
+        self.assertEqual(self.client.get('/api/v1/features/').status_code, status.HTTP_200_OK)
+        later = time.monotonic() + settings.JWT_USER_CACHE_TTL + 1
+        with mock.patch('subscription.caching.monotonic', return_value=later):
+            response = self.client.get('/api/v1/features/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_saving_user_invalidates_cache(self):
+        self.client.get('/api/v1/features/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/v1/features/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cached_user_keeps_password(self):
+        self.client.get('/api/v1/features/')
+        token = RefreshToken.for_user(self.user).access_token
+        user, _ = CachedJWTAuthentication().authenticate(
+            APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        )
+        self.assertEqual(user, self.user)
+        self.assertIn('password', user.get_deferred_fields())
+
+        user.first_name = 'Changed'
+        user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Changed')
+        self.assertTrue(self.user.check_password('testpass123'))
+
+
+class ThrottlingTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        throttling.reset()
+        self.addCleanup(throttling.reset)
+        self.user = User.objects.create_user(username='throttled@example.com', email='throttled@example.com',
+                                             password='testpass123')
+
+    def throttle(self, rate='10/min', base=throttling.UserRateThrottle):
+        return type('Throttle', (base,), {'rate': rate})()
+
+    def request(self, user=None):
+        request = Request(APIRequestFactory().get('/'))
+        request.user = user or self.user
+        return request
+
+    def allowed(self, count, at, **kwargs):
+        with mock.patch('rest_framework.throttling.SimpleRateThrottle.timer', return_value=at):
+            return sum(self.throttle(**kwargs).allow_request(self.request(), None) for _ in range(count))
+
+    def test_login_is_throttled(self):
+        url = '/api/v1/auth/login/'
+        credentials = {'email': self.user.email, 'password': 'testpass123'}
+        for _ in range(5):
+            self.assertEqual(self.client.post(url, credentials).status_code, status.HTTP_200_OK)
+        response = self.client.post(url, credentials)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        # Other endpoints have no login scope
+        response = self.client.post('/api/v1/auth/register/', {
+            'username': 'other', 'email': 'other@example.com', 'password': 'testpass123',
+            'password_confirm': 'testpass123',
+        })
+        self.assertNotEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_previous_window_is_weighted(self):
+        self.assertEqual(self.allowed(15, at=600), 10)
+        # Halfway through the next window the previous one still counts for 5
+        self.assertEqual(self.allowed(10, at=690), 5)
+        # A window without requests in between resets the count
+        self.assertEqual(self.allowed(15, at=780), 10)
+
+    def test_wait(self):
+        self.allowed(10, at=600)
+        throttle = self.throttle()
+        with mock.patch('rest_framework.throttling.SimpleRateThrottle.timer', return_value=615):
+            self.assertFalse(throttle.allow_request(self.request(), None))
+        # The rest of this window
+        self.assertAlmostEqual(throttle.wait(), 45)
+
+        self.assertEqual(self.allowed(5, at=675), 3)
+        throttle = self.throttle()
+        with mock.patch('rest_framework.throttling.SimpleRateThrottle.timer', return_value=675):
+            self.assertFalse(throttle.allow_request(self.request(), None))
+        # Until 10 * (1 - f) + 3 < 10, i.e. f = 0.3 of the window
+        self.assertAlmostEqual(throttle.wait(), 3)
+
+    def test_idle_clients_are_evicted(self):
+        with mock.patch.object(throttling, '_counters', LRUCache(maxsize=2)):
+            self.allowed(10, at=600)
+            for pk in (1001, 1002):
+                self.throttle().allow_request(self.request(User(pk=pk)), None)
+            self.assertEqual(len(throttling._counters), 2)
+            self.assertEqual(self.allowed(1, at=600), 1)
+
+    @override_settings(THROTTLE_BACKEND='cache')
+    def test_cache_backend_is_shared_between_processes(self):
+        self.assertEqual(self.allowed(6, at=600), 6)
+        throttling.reset()  # another worker's memory
+        self.assertEqual(self.allowed(10, at=600), 4)
+        self.assertEqual(self.allowed(10, at=690), 5)
+
+    def test_bench_throttle_command(self):
+        out = StringIO()
+        call_command('bench_throttle', clients=3, history=[2], iterations=5, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['history']['2']), {'drf', 'sliding_local', 'sliding_cache', 'speedup_local'})
+        self.assertEqual(len(throttling._counters), 0)
+        self.assertIsNone(cache.get('throttle_bench_throttle_1'))
+
+
+class PasswordHashingTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        throttling.reset()
+        self.user = User.objects.create_user(username='hashed@example.com', email='hashed@example.com',
+                                             password='testpass123')
+        self.pool = hashing.HashingPool(workers=2, max_pending=2)
+        self.addCleanup(self.pool.shutdown)
+        patcher = mock.patch.object(hashing, '_pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, password='testpass123'):
+        return self.client.post('/api/v1/auth/login/', {'email': self.user.email, 'password': password})
+
+    def test_login_verifies_on_pool(self):
+        response = self.login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hash;dur=', response['Server-Timing'])
+        self.assertIn('hash_wait;dur=', response['Server-Timing'])
+        self.assertEqual(self.login('wrong-password').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.pool.hash_seconds.count, 2)
+        self.assertEqual(self.pool.pending, 0)
+
+    def test_unknown_user_still_hashes(self):
+        response = self.client.post('/api/v1/auth/login/', {'email': 'nobody@example.com', 'password': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.pool.hash_seconds.count, 1)
+
+    def test_registration_hashes_on_pool(self):
+        response = self.client.post('/api/v1/auth/register/', {
+            'username': 'newcomer', 'email': 'Newcomer@EXAMPLE.com', 'password': 'testpass123',
+            'password_confirm': 'testpass123',
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = User.objects.get(username='newcomer')
+        self.assertEqual(user.email, 'Newcomer@example.com')
+        self.assertTrue(user.check_password('testpass123'))
+        self.assertEqual(self.pool.hash_seconds.count, 1)
+
+    def test_full_queue_is_refused(self):
+        release = threading.Event()
+        blocked = [self.pool.submit(release.wait) for _ in range(2)]
+        try:
+            response = self.login()
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertEqual(self.pool.rejected, 1)
+        finally:
+            release.set()
+        for future in blocked:
+            future.result()
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+    def test_outdated_hash_is_upgraded(self):
+        self.user.password = make_password('testpass123', hasher='pbkdf2_sha1')
+        self.user.save()
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+
+    @override_settings(PASSWORD_HASHING_WORKERS=3, PASSWORD_HASHING_MAX_PENDING=None)
+    def test_default_limit_follows_workers(self):
+        self.assertEqual(hashing.max_pending(), 6)
+
+    def test_metrics(self):
+        self.login()
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('password_hashing_seconds_count{pool="default"} 1', body)
+        self.assertIn('password_hashing_pending 0', body)
+        self.assertIn('password_hashing_rejected_total 0', body)
+
+
+class TokenRevocationTestCase(APITestCase):
+    url = '/api/v1/auth/token/refresh/'
+
+    def setUp(self):
+        cache.clear()
+        revocation.reset()
+        self.addCleanup(revocation.reset)
+        self.user = User.objects.create_user(username='refresher', email='refresher@example.com',
+                                             password='testpass123')
+
+    def refresh(self, token):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, {'refresh': str(token)})
+
+    def test_rotated_token_is_revoked(self):
+        token = RefreshToken.for_user(self.user)
+        response = self.refresh(token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rotated = response.data['refresh']
+
+        response = self.refresh(token)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data['detail'], 'Token is revoked')
+        self.assertEqual(self.refresh(rotated).status_code, status.HTTP_200_OK)
+
+        revoked = RevokedToken.objects.get(jti=token['jti'])
+        self.assertEqual(revoked.expires_at, datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc))
+
+    def test_valid_token_is_not_looked_up(self):
+        response = self.refresh(RefreshToken.for_user(self.user))
+        with CaptureQueriesContext(connection) as captured:
+            response = self.refresh(response.data['refresh'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lookups = [query['sql'] for query in captured.captured_queries
+                   if query['sql'].startswith('SELECT') and 'subscription_revokedtoken' in query['sql']]
+        self.assertEqual(lookups, [])
+
+    def test_revocations_from_other_processes(self):
+        self.assertFalse(revocation.is_revoked('elsewhere'))
+        RevokedToken.objects.create(jti='elsewhere', expires_at=timezone.now() + timedelta(days=1))
+        cache.incr(revocation.VERSION_KEY)
+        self.assertTrue(revocation.is_revoked('elsewhere'))
+
+    def test_store_survives_restart(self):
+        token = RefreshToken.for_user(self.user)
+        self.refresh(token)
+        revocation.reset()
+        cache.clear()
+        self.assertTrue(revocation.is_revoked(token['jti']))
+        self.assertEqual(self.refresh(token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoking_twice(self):
+        exp = int(time.time()) + 60
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(revocation.revoke('twice', exp))
+            self.assertFalse(revocation.revoke('twice', exp))
+        self.assertTrue(revocation.is_revoked('twice'))
+
+    def test_bloom_filter(self):
+        bloom = revocation.BloomFilter(capacity=1000, error_rate=0.01)
+        members = [f'member-{i}' for i in range(1000)]
+        for member in members:
+            bloom.add(member)
+        self.assertTrue(all(member in bloom for member in members))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    @override_settings(REVOCATION_FILTER_CAPACITY=10)
+    def test_more_revocations_than_capacity(self):
+        expires_at = timezone.now() + timedelta(days=1)
+        RevokedToken.objects.bulk_create(RevokedToken(jti=f'old-{i}', expires_at=expires_at) for i in range(12))
+        self.assertTrue(revocation.is_revoked('old-0'))
+        # The filter made room instead of reloading the table on every check
+        with self.assertNumQueries(0):
+            for i in range(5):
+                self.assertFalse(revocation.is_revoked(f'new-{i}'))
+
+    def test_catch_ups_count_each_revocation_once(self):
+        RevokedToken.objects.create(jti='elsewhere', expires_at=timezone.now() + timedelta(days=1))
+        self.assertTrue(revocation.is_revoked('elsewhere'))
+        for _ in range(5):
+            # Another process revoked something; the overlap reads this row again
+            cache.incr(revocation.VERSION_KEY)
+            revocation.is_revoked('elsewhere')
+        self.assertEqual(len(revocation._filter.bloom), 1)
+
+    def test_catches_up_without_version_bump(self):
+        self.assertFalse(revocation.is_revoked('unannounced'))
+        # Revoked by a process whose cache this one does not share
+        RevokedToken.objects.create(jti='unannounced', expires_at=timezone.now() + timedelta(days=1))
+        self.assertFalse(revocation.is_revoked('unannounced'))
+        later = timezone.now() + revocation.sync_interval()
+        with mock.patch.object(timezone, 'now', return_value=later):
+            self.assertTrue(revocation.is_revoked('unannounced'))
+
+    def test_deploy_check_wants_shared_cache(self):
+        self.assertEqual([warning.id for warning in checks.check_revocation_cache(None)], ['subscription.W002'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(checks.check_revocation_cache(None), [])
+
+    def test_purge_revoked_tokens(self):
+        now = timezone.now()
+        RevokedToken.objects.create(jti='expired', expires_at=now - timedelta(seconds=1))
+        RevokedToken.objects.create(jti='current', expires_at=now + timedelta(days=1))
+        out = StringIO()
+        call_command('purge_revoked_tokens', stdout=out)
+        self.assertIn('1 expired revocation(s) deleted', out.getvalue())
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), ['current'])
+
+
+class OpenAPISchemaCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        schema._rendered.clear()
+        self.addCleanup(schema._rendered.clear)
+        generate = OpenAPISchemaGenerator.get_schema
+        patcher = mock.patch.object(OpenAPISchemaGenerator, 'get_schema', autospec=True, side_effect=generate)
+        self.get_schema = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rendered_once_per_format(self):
+        first = self.client.get('/swagger.json')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Content-Type'], 'application/json; charset=utf-8')
+        self.assertIn('/subscriptions/', json.loads(first.content)['paths'])
+        self.assertEqual(self.client.get('/swagger.json').content, first.content)
+        # The spec the Swagger UI loads is the same JSON
+        self.assertEqual(self.client.get('/swagger/', {'format': 'openapi'})['ETag'], first['ETag'])
+        self.assertEqual(self.get_schema.call_count, 1)
+
+        yaml = self.client.get('/swagger.yaml')
+        self.assertEqual(yaml['Content-Type'], 'application/yaml; charset=utf-8')
+        self.assertTrue(yaml.content.startswith(b'swagger:'))
+        self.assertNotEqual(yaml['ETag'], first['ETag'])
+        self.assertEqual(self.get_schema.call_count, 2)
+
+        # Another process finds it in the cache
+        schema._rendered.clear()
+        self.assertEqual(self.client.get('/swagger.json').content, first.content)
+        self.assertEqual(self.get_schema.call_count, 2)
+
+        # The UI pages themselves are not cached and do not introspect views
+        self.assertEqual(self.client.get('/redoc/').status_code, 200)
+
+    def test_etag(self):
+        etag = self.client.get('/swagger.json')['ETag']
+        response = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_new_code_renders_again(self):
+        self.client.get('/swagger.json')
+        with mock.patch('subscription.schema.fingerprint', return_value='changed'):
+            self.client.get('/swagger.json')
+        self.assertEqual(self.get_schema.call_count, 2)
+        self.assertIn('subscription/schema.py', [
+            str(path.relative_to(settings.BASE_DIR)) for path in schema.source_files()
+        ])
+
+    def test_render_command(self):
+        out = StringIO()
+        call_command('render_openapi', '--url', 'http://testserver', stdout=out)
+        self.assertIn(f'fingerprint {schema.fingerprint()}', out.getvalue())
+        self.assertEqual(self.get_schema.call_count, 2)
+
+        schema._rendered.clear()
+        self.client.get('/swagger.json')
+        self.client.get('/swagger.yaml')
+        self.assertEqual(self.get_schema.call_count, 2)
+        with self.assertRaises(CommandError):
+            call_command('render_openapi', '--url', 'testserver', stdout=StringIO())
+
+
+class CatalogCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username=f'catuser_{self._testMethodName}',
+            email=f'cat_{self._testMethodName}@example.com',
+            password='testpass123'
+        )
+        self.feature = Feature.objects.create(name='Priority Support')
+        self.plan = Plan.objects.create(name='Pro Plan')
+        self.plan.features.add(self.feature)
+
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+
+    def test_listing_served_from_cache(self):
+        for url in ['/api/v1/plans/', '/api/v1/features/']:
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(second.status_code, status.HTTP_200_OK)
+            self.assertEqual(second.content, first.content)
+            self.assertEqual(second['ETag'], first['ETag'])
+            self.assertEqual(second['Content-Type'], 'application/json')
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get('/api/v1/plans/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/plans/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get('/api/v1/plans/?fields=bogus', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_deploy_check_wants_shared_cache(self):
+        self.assertEqual([warning.id for warning in checks.check_catalog_cache(None)], ['subscription.W001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(checks.check_catalog_cache(None), [])
+
+    def test_writes_bump_version(self):
+        etag = self.client.get('/api/v1/plans/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/plans/create/', {'name': 'Basic Plan', 'feature_ids': [self.feature.id]})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get('/api/v1/plans/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['count'], 2)
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plan.features.remove(self.feature)
+        response = self.client.get('/api/v1/plans/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/features/create/', {'name': 'Analytics'})
+        self.assertEqual(self.client.get('/api/v1/features/').json()['count'], 2)
+
+
+class LoadTestingCommandsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_generate_dataset(self):
+        call_command(
+            'generate_dataset', users=7, plans=3, features=4, subscriptions=20,
+            features_per_plan=2, batch_size=3, stdout=StringIO(),
+        )
+        self.assertEqual(User.objects.filter(username__startswith='load_').count(), 7)
+        self.assertEqual(Plan.objects.count(), 3)
+        self.assertEqual(Feature.objects.count(), 4)
+        self.assertEqual(Subscription.objects.count(), 20)
+        self.assertEqual(Subscription.objects.filter(is_active=True).count(), 7)
+        self.assertTrue(all(plan.features.count() == 2 for plan in Plan.objects.all()))
+        self.assertEqual(stats.reconcile(fix=False), [])
+        self.assertEqual(current.reconcile(fix=False), [])
+
+    def test_benchmark_report(self):
+        out = StringIO()
+        call_command(
+            'benchmark', iterations=2, warmup=0, history=3,
+            endpoints=['feature-list', 'subscription-update'], stdout=out,
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['endpoints']), {'feature-list', 'subscription-update'})
+        for summary in report['endpoints'].values():
+            self.assertEqual(summary['requests'], 2)
+            self.assertIn('p99_ms', summary)
+            self.assertIn('queries_per_request', summary)
+        # Everything the benchmark wrote was rolled back
+        self.assertFalse(User.objects.exists())
+
+    def test_benchmark_covers_every_endpoint(self):
+        from subscription.management.commands.benchmark import Scenarios, endpoint_names
+        for name in endpoint_names():
+            self.assertTrue(hasattr(Scenarios, name.replace('-', '_')), name)
+
+
+class PerformanceMiddlewareTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        instrumentation.registry.reset()
+        self.user = User.objects.create_user(
+            username=f'perfuser_{self._testMethodName}',
+            email=f'perf_{self._testMethodName}@example.com',
+            password='testpass123'
+        )
+        self.plan = Plan.objects.create(name='Pro Plan')
+        self.plan.features.add(Feature.objects.create(name='Priority Support'))
+        Subscription.objects.create(user=self.user, plan=self.plan)
+
+        refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {refresh.access_token}')
+
+    def server_timing(self, response):
+        phases = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            phases[name] = dict(param.split('=', 1) for param in params)
+        return phases
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/v1/subscriptions/')
+        phases = self.server_timing(response)
+
+        self.assertEqual(set(phases), {'db', 'view', 'serializer', 'render', 'total'})
+        self.assertEqual(phases['db']['desc'], '"4 queries"')
+        for phase in ('db', 'view', 'serializer', 'render'):
+            self.assertGreater(float(phases[phase]['dur']), 0, phase)
+            self.assertLessEqual(float(phases[phase]['dur']), float(phases['total']['dur']), phase)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/v1/subscriptions/')
+        self.client.get('/api/v1/subscriptions/')
+        self.client.get('/api/v1/features/')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn(
+            'http_request_phase_duration_seconds_count{route="subscriptions:subscription-list",phase="total"} 2',
+            body,
+        )
+        self.assertIn('http_request_queries_bucket{route="subscriptions:subscription-list",le="4"} 2', body)
+        self.assertIn('route="subscriptions:feature-list"', body)
+
+        response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ImportDataTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def import_data(self, kind, content, name, **options):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_data', kind, self.write(name, content), stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_import_users_plans_and_subscriptions(self):
+        User.objects.create_user(username='old@example.com', email='old@example.com', password='x')
+        out = self.import_data('users', (
+            'email,first_name,password\n'
+            'ann@example.com,Ann,secret123\n'
+            'bob@example.com,Bob,\n'
+            'old@example.com,Old,\n'
+        ), 'users.csv', batch_size=2)
+        self.assertIn('2 created, 1 skipped', out)
+        self.assertTrue(User.objects.get(email='ann@example.com').check_password('secret123'))
+        self.assertFalse(User.objects.get(email='bob@example.com').has_usable_password())
+
+        self.import_data('plans', (
+            '{"name": "Basic", "features": ["Email"]}\n'
+            '{"name": "Pro", "features": ["Email", "Priority Support"]}\n'
+        ), 'plans.jsonl', create_features=True)
+        self.assertEqual(
+            list(Plan.objects.get(name='Pro').features.order_by('name').values_list('name', flat=True)),
+            ['Email', 'Priority Support'],
+        )
+
+        ann = User.objects.get(email='ann@example.com')
+        get_user_entitlements(ann.pk)
+        out = self.import_data('subscriptions', (
+            'user,plan,start_date,is_active\n'
+            'ann@example.com,Basic,2024-01-01T00:00:00Z,true\n'
+            'ann@example.com,Pro,2024-02-01T00:00:00Z,true\n'
+            'bob@example.com,Basic,2024-01-15T00:00:00Z,false\n'
+            'ann@example.com,Basic,2024-03-01T00:00:00Z,true\n'
+        ), 'subscriptions.csv', batch_size=2)
+        self.assertIn('4 created', out)
+        # The latest active row wins, across batches
+        active = Subscription.objects.get(user=ann, is_active=True)
+        self.assertEqual((active.plan.name, active.start_date.month), ('Basic', 3))
+        self.assertEqual(Subscription.objects.filter(user=ann).count(), 3)
+        self.assertFalse(Subscription.objects.filter(user__email='bob@example.com', is_active=True).exists())
+        self.assertEqual(get_user_entitlements(ann.pk)['plan']['name'], 'Basic')
+        self.assertEqual(stats.reconcile(fix=False), [])
+
+    def test_invalid_rows(self):
+        plan = Plan.objects.create(name='Basic')
+        User.objects.create_user(username='ann@example.com', email='ann@example.com', password='x')
+        content = (
+            f'{{"user": "ann@example.com", "plan_id": {plan.pk}}}\n'
+            '{"user": "nobody@example.com", "plan": "Basic"}\n'
+        )
+        with self.assertRaisesMessage(CommandError, "line 2: unknown user 'nobody@example.com'"):
+            self.import_data('subscriptions', content, 'subscriptions.jsonl')
+        # The failing batch was rolled back as a whole
+        self.assertFalse(Subscription.objects.exists())
+
+        out = self.import_data('subscriptions', content, 'subscriptions.jsonl', skip_invalid=True)
+        self.assertIn('1 created, 0 skipped, 1 invalid', out)
+        self.assertTrue(Subscription.objects.get(plan=plan).is_active)
+
+        with self.assertRaisesMessage(CommandError, 'line 2: unknown features: Missing'):
+            self.import_data('plans', 'name,features\nPro,Missing\n', 'plans.csv')
+
+    def test_emails_normalized_like_registration(self):
+        User.objects.create_user(username='Ann@example.com', email='Ann@example.com', password='x')
+        out = self.import_data('users', 'email\nAnn@EXAMPLE.com\nBob@Example.COM\n', 'users.csv')
+        self.assertIn('1 created, 1 skipped', out)
+        self.assertTrue(User.objects.filter(email='Bob@example.com', username='Bob@example.com').exists())
+
+        plan = Plan.objects.create(name='Basic')
+        self.import_data('subscriptions', 'user,plan\nAnn@EXAMPLE.COM,Basic\n', 'subscriptions.csv')
+        self.assertEqual(Subscription.objects.get(user__email='Ann@example.com').plan, plan)
+
+    def test_ambiguous_email(self):
+        # A user model whose emails are not unique
+        ann = User.objects.create_user(username='ann@example.com', email='ann@example.com', password='x')
+        Plan.objects.create(name='Basic')
+        rows = [('ann@example.com', ann.pk), ('ann@example.com', ann.pk + 1000)]
+        content = 'user,plan\nann@example.com,Basic\n'
+        with mock.patch.object(User.objects, 'filter') as filter:
+            filter.return_value.values_list.return_value = rows
+            with self.assertRaisesMessage(CommandError, "line 2: ambiguous email 'ann@example.com'"):
+                self.import_data('subscriptions', content, 'subscriptions.csv')
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_start_dates_kept(self):
+        plan = Plan.objects.create(name='Basic')
+        user = User.objects.create_user(username='ann@example.com', email='ann@example.com', password='x')
+        self.import_data('subscriptions', 'user,plan,start_date\nann@example.com,Basic,2024-01-01T00:00:00Z\n',
+                         'subscriptions.csv')
+        self.assertEqual(Subscription.objects.get(user=user).start_date.year, 2024)
+        # Rows created without one still start now
+        self.assertIsNotNone(Subscription.objects.create(user=user, plan=plan).start_date)
+
+
+class SubscriptionExportTestCase(APITestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='testpass123', is_staff=True
+        )
+        self.user = User.objects.create_user(username='ann@example.com', email='ann@example.com', password='x')
+        self.basic = Plan.objects.create(name='Basic')
+        self.pro = Plan.objects.create(name='Pro')
+        Subscription.objects.bulk_create([
+            Subscription(user=self.user, plan=self.basic, is_active=False,
+                         start_date=datetime(2024, 1, 1, tzinfo=dt_timezone.utc)),
+            Subscription(user=self.user, plan=self.pro, is_active=True,
+                         start_date=datetime(2024, 2, 1, tzinfo=dt_timezone.utc)),
+        ])
+        self.url = '/api/v1/subscriptions/export/'
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.staff).access_token}')
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export(self):
+        lines = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([line['plan_name'] for line in lines], ['Basic', 'Pro'])
+        self.assertEqual(lines[1], {
+            'id': lines[1]['id'],
+            'shard': 'default',
+            'user_id': self.user.pk,
+            'user_email': 'ann@example.com',
+            'plan_id': self.pro.pk,
+            'plan_name': 'Pro',
+            'start_date': '2024-02-01T00:00:00+00:00',
+            'is_active': True,
+        })
+
+    def test_filters_and_csv(self):
+        self.assertEqual(len(self.export(is_active='false').splitlines()), 1)
+        self.assertEqual(len(self.export(plan=self.pro.pk).splitlines()), 1)
+        rows = self.export(output='csv', start_date_from='2024-01-15T00:00:00Z').splitlines()
+        self.assertEqual(rows[0], 'id,shard,user_id,user_email,plan_id,plan_name,start_date,is_active')
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[1].endswith(',Pro,2024-02-01T00:00:00+00:00,True'))
+
+        response = self.client.get(self.url, {'start_date_to': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_staff_only(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+    @mock.patch('subscription.exporters.chunk_size', return_value=1)
+    def test_command_streams_in_chunks(self, chunk_size):
+        out = StringIO()
+        with CaptureQueriesContext(connection) as captured:
+            call_command('export_subscriptions', is_active='true', stdout=out)
+        self.assertEqual(len(captured), 1)
+        self.assertEqual(json.loads(out.getvalue())['plan_name'], 'Pro')
+
+
+class OutboxTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(username=f'outbox{i}', email=f'outbox{i}@example.com', password='x')
+            for i in range(3)
+        ]
+        self.basic = Plan.objects.create(name='Basic')
+        self.pro = Plan.objects.create(name='Pro')
+
+    def test_changes_write_events(self):
+        user = self.users[0]
+        self.client.force_authenticate(user)
+        self.client.post('/api/v1/subscriptions/create/', {'plan': self.basic.id})
+        self.client.put('/api/v1/subscriptions/update/', {'plan': self.pro.id})
+        self.client.post('/api/v1/subscriptions/deactivate/')
+
+        events = list(OutboxEvent.objects.filter(user_id=user.pk).order_by('id'))
+        self.assertEqual([event.event for event in events],
+                         [OutboxEvent.CREATED, OutboxEvent.SWITCHED, OutboxEvent.DEACTIVATED])
+        first, second = Subscription.objects.filter(user=user).order_by('id')
+        self.assertEqual(events[1].payload, {
+            'user_id': user.pk, 'subscription_id': second.pk, 'plan_id': self.pro.pk,
+            'previous_plan_id': self.basic.pk,
+        })
+        self.assertEqual(events[2].payload['subscription_id'], second.pk)
+
+    def test_failed_change_writes_no_event(self):
+        with self.assertRaises(services.NoActiveSubscription):
+            services.switch_plan(self.users[0], self.pro)
+        self.assertFalse(OutboxEvent.objects.filter(user_id=self.users[0].pk).exists())
+
+    def received(self, webhook):
+        return [(event['data']['user_id'], event['data']['plan_id'], event['event']) for event in webhook.events()]
+
+    @override_settings(OUTBOX_WEBHOOK_SECRET='s3cret')
+    def test_dispatcher_delivers_in_order_per_user(self):
+        for _ in range(3):
+            for user in self.users:
+                services.subscribe(user, self.basic)
+                services.switch_plan(user, self.pro)
+        with StubWebhookServer() as first, StubWebhookServer() as second, \
+                outbox.Dispatcher([first.url, second.url], batch_size=4, concurrency=2) as dispatcher:
+            self.assertEqual(dispatcher.drain(), (18, 0))
+
+        self.assertEqual(OutboxEvent.objects.using('default').count(), 0)
+        # POSTs of different users race each other; each user's events do not
+        for webhook in (first, second):
+            for user in self.users:
+                plans = [plan_id for user_id, plan_id, _ in self.received(webhook) if user_id == user.pk]
+                self.assertEqual(plans, [self.basic.pk, self.pro.pk] * 3)
+        content, headers = first.requests[0]
+        signature = hmac.new(b's3cret', content, hashlib.sha256).hexdigest()
+        self.assertEqual(headers['X-Outbox-Signature'], f'sha256={signature}')
+
+    def test_failed_delivery_is_retried_in_order(self):
+        user = self.users[0]
+        services.subscribe(user, self.basic)
+        with StubWebhookServer(status=500) as failing, outbox.Dispatcher([failing.url]) as dispatcher:
+            self.assertEqual(dispatcher.drain(), (0, 1))
+        event = OutboxEvent.objects.get(user_id=user.pk)
+        self.assertEqual(event.attempts, 1)
+        self.assertIn('500', event.last_error)
+        self.assertGreater(event.next_attempt_at, timezone.now())
+
+        # A later change of the same user waits behind the failed one
+        services.switch_plan(user, self.pro)
+        with StubWebhookServer() as webhook, outbox.Dispatcher([webhook.url]) as dispatcher:
+            self.assertEqual(dispatcher.drain(), (0, 0))
+            OutboxEvent.objects.filter(user_id=user.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(dispatcher.drain(), (2, 0))
+        self.assertEqual([event for _, _, event in self.received(webhook)],
+                         [OutboxEvent.CREATED, OutboxEvent.SWITCHED])
+
+    def test_failure_counts_only_the_sent_events(self):
+        user = self.users[0]
+        services.subscribe(user, self.basic)
+        services.switch_plan(user, self.pro)
+        first, later = OutboxEvent.objects.filter(user_id=user.pk).order_by('id')
+        with StubWebhookServer(status=500) as failing, \
+                outbox.Dispatcher([failing.url], batch_size=1) as dispatcher:
+            self.assertEqual(dispatcher.dispatch('default'), (0, 1))
+        first.refresh_from_db()
+        later.refresh_from_db()
+        self.assertEqual((first.attempts, later.attempts), (1, 0))
+        self.assertEqual(later.last_error, '')
+        self.assertIsNone(first.claim)
+        self.assertEqual(later.next_attempt_at, first.next_attempt_at)
+
+    def test_two_dispatchers_keep_user_order(self):
+        user = self.users[0]
+        services.subscribe(user, self.basic)
+        services.switch_plan(user, self.pro)
+        services.switch_plan(user, self.basic)
+        with StubWebhookServer() as webhook, \
+                outbox.Dispatcher([webhook.url], batch_size=2) as first, \
+                outbox.Dispatcher([webhook.url], batch_size=3) as second:
+            due = second.due
+
+            def first_claims_in_between(alias, now):
+                # The second dispatcher has picked all three events when the
+                # first claims the two that fit in its batch
+                ids = due(alias, now)
+                self.assertEqual(len(first.claim(alias)), 2)
+                return ids
+
+            with mock.patch.object(second, 'due', side_effect=first_claims_in_between):
+                self.assertEqual(second.claim('default'), [])
+            # The third event waits for the first dispatcher to finish
+            self.assertEqual(second.claim('default'), [])
+            OutboxEvent.objects.filter(user_id=user.pk, claim__isnull=False).delete()
+            self.assertEqual(second.drain(), (1, 0))
+        self.assertEqual([event for _, _, event in self.received(webhook)], [OutboxEvent.SWITCHED])
+
+    def test_claim_hands_back_users_with_earlier_events(self):
+        # What the UPDATE cannot see: a claim committed while it ran
+        user = self.users[0]
+        services.subscribe(user, self.basic)
+        services.switch_plan(user, self.pro)
+        services.subscribe(self.users[1], self.basic)
+        later = OutboxEvent.objects.filter(user_id=user.pk).latest('id')
+        other = OutboxEvent.objects.get(user_id=self.users[1].pk)
+        dispatcher = outbox.Dispatcher([], batch_size=10)
+        # Selected as if the user's first event had been claimed elsewhere
+        with mock.patch.object(dispatcher, 'due', return_value=[later.pk, other.pk]):
+            claimed = dispatcher.claim('default')
+        self.assertEqual([event.user_id for event in claimed], [self.users[1].pk])
+        later.refresh_from_db()
+        self.assertIsNone(later.claim)
+        self.assertLessEqual(later.next_attempt_at, timezone.now())
+
+    def test_retry_delay_backs_off(self):
+        self.assertEqual([outbox.retry_delay(attempts) for attempts in (1, 2, 3)], [5, 10, 20])
+        self.assertEqual(outbox.retry_delay(30), settings.OUTBOX_RETRY_MAX_DELAY)
+
+    def test_dispatch_outbox_command(self):
+        services.subscribe(self.users[0], self.basic)
+        out = StringIO()
+        with StubWebhookServer() as webhook:
+            call_command('dispatch_outbox', '--once', '--webhook', webhook.url, stdout=out)
+        self.assertIn('1 event(s) delivered, 0 failed', out.getvalue())
+        self.assertEqual(len(webhook.events()), 1)
+        with self.assertRaises(CommandError):
+            call_command('dispatch_outbox', '--once', stdout=StringIO())
+
+    def test_bench_outbox_command(self):
+        out = StringIO()
+        call_command('bench_outbox', events=20, users=4, concurrency=[1, 2], latency_ms=0, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['concurrency']['2']['delivered'], 20)
+        self.assertFalse(OutboxEvent.objects.using('default').exists())
+
+
+class IdempotencyKeyTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='retrier', email='retrier@example.com', password='x')
+        self.basic = Plan.objects.create(name='Basic')
+        self.pro = Plan.objects.create(name='Pro')
+        self.client.force_authenticate(self.user)
+
+    def post(self, url, data, key):
+        return self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_is_replayed(self):
+        first = self.post('/api/v1/subscriptions/create/', {'plan': self.basic.id}, 'create-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        with CaptureQueriesContext(connection) as captured:
+            retry = self.post('/api/v1/subscriptions/create/', {'plan': self.basic.id}, 'create-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertFalse([query for query in captured if 'subscription_' in query['sql']])
+        self.assertEqual(Subscription.objects.filter(user=self.user).count(), 1)
+
+        # Another key is another request
+        self.post('/api/v1/subscriptions/create/', {'plan': self.basic.id}, 'create-2')
+        self.assertEqual(Subscription.objects.filter(user=self.user).count(), 2)
+
+    def test_write_endpoints(self):
+        services.subscribe(self.user, self.basic)
+        for _ in range(2):
+            update = self.client.put('/api/v1/subscriptions/update/', {'plan': self.pro.id},
+                                     format='json', HTTP_IDEMPOTENCY_KEY='update-1')
+            self.assertEqual(update.status_code, status.HTTP_200_OK)
+            deactivate = self.post('/api/v1/subscriptions/deactivate/', {}, 'deactivate-1')
+            self.assertEqual(deactivate.status_code, status.HTTP_200_OK)
+            plan = self.post('/api/v1/plans/create/', {'name': 'Team', 'feature_ids': []}, 'plan-1')
+            self.assertEqual(plan.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Subscription.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(Plan.objects.filter(name='Team').count(), 1)
+
+    def test_keys_are_per_user(self):
+        self.post('/api/v1/plans/create/', {'name': 'Team', 'feature_ids': []}, 'same-key')
+        self.client.force_authenticate(User.objects.create_user(username='other', email='other@example.com'))
+        response = self.post('/api/v1/plans/create/', {'name': 'Team', 'feature_ids': []}, 'same-key')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Plan.objects.filter(name='Team').count(), 2)
+
+    def test_reused_key_with_another_body(self):
+        self.post('/api/v1/subscriptions/create/', {'plan': self.basic.id}, 'create-1')
+        response = self.post('/api/v1/subscriptions/create/', {'plan': self.pro.id}, 'create-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Subscription.objects.filter(user=self.user).count(), 1)
+
+    def test_invalid_key(self):
+        response = self.post('/api/v1/plans/create/', {'name': 'Team', 'feature_ids': []}, 'k' * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Plan.objects.filter(name='Team').exists())
+
+    def test_handled_errors_are_replayed_but_raised_ones_are_not(self):
+        # A 404 the handler returns is its answer to this request
+        response = self.client.put('/api/v1/subscriptions/update/', {'plan': self.pro.id},
+                                   format='json', HTTP_IDEMPOTENCY_KEY='no-active')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        services.subscribe(self.user, self.basic)
+        response = self.client.put('/api/v1/subscriptions/update/', {'plan': self.pro.id},
+                                   format='json', HTTP_IDEMPOTENCY_KEY='no-active')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+        # A ValidationError is raised, not returned: the body can be fixed
+        # and sent again with the same key
+        response = self.post('/api/v1/plans/create/', {'name': 'Team'}, 'plan-1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.post('/api/v1/plans/create/', {'name': 'Team', 'feature_ids': []}, 'plan-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+        with mock.patch('subscription.views.deactivate', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.post('/api/v1/subscriptions/deactivate/', {}, 'crash')
+        response = self.post('/api/v1/subscriptions/deactivate/', {}, 'crash')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_form_bodies(self):
+        # Fingerprinted from the parsed data; the multipart stream is read once
+        for _ in range(2):
+            response = self.client.post('/api/v1/subscriptions/create/', {'plan': self.basic.id},
+                                        HTTP_IDEMPOTENCY_KEY='form-1')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        response = self.client.post('/api/v1/subscriptions/create/', {'plan': self.pro.id},
+                                    HTTP_IDEMPOTENCY_KEY='form-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Subscription.objects.filter(user=self.user).count(), 1)
+
+    def lock(self, url, data, key):
+        request = APIRequestFactory().post(url, data, format='json')
+        request_hash = idempotency.fingerprint(Request(request, parsers=[JSONParser()]))
+        result_key = idempotency.cache_key(self.user.pk, 'POST', url, key)
+        cache.add(f'{result_key}:lock', request_hash)
+        return result_key
+
+    def test_concurrent_duplicate(self):
+        result_key = self.lock('/api/v1/subscriptions/create/', {'plan': self.basic.id}, 'busy')
+        response = self.post('/api/v1/subscriptions/create/', {'plan': self.basic.id}, 'busy')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Retry-After'], '1')
+        response = self.post('/api/v1/subscriptions/create/', {'plan': self.pro.id}, 'busy')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertFalse(Subscription.objects.filter(user=self.user).exists())
+
+        # Once the first one is done, the retry gets its response
+        request_hash = cache.get(f'{result_key}:lock')
+        cache.set(result_key, {'fingerprint': request_hash, 'status': 201, 'data': {'id': 42}})
+        cache.delete(f'{result_key}:lock')
+        response = self.post('/api/v1/subscriptions/create/', {'plan': self.basic.id}, 'busy')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json(), {'id': 42})
+        self.assertFalse(Subscription.objects.filter(user=self.user).exists())
+
+
+class PlanStatsTestCase(APITestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='testpass123', is_staff=True
+        )
+        self.users = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='x')
+            for i in range(3)
+        ]
+        self.basic = Plan.objects.create(name='Basic')
+        self.pro = Plan.objects.create(name='Pro')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.staff).access_token}')
+
+    def counters(self, plan):
+        stats = PlanStats.objects.get(plan=plan)
+        return stats.active_count, stats.switches_in, stats.switches_out
+
+    def test_counters_follow_every_write_path(self):
+        for user in self.users:
+            services.subscribe(user, self.basic)
+        services.switch_plan(self.users[0], self.pro)
+        services.deactivate(self.users[1])
+        self.assertEqual(self.counters(self.basic), (1, 0, 1))
+        self.assertEqual(self.counters(self.pro), (1, 1, 0))
+
+        # Direct ORM use and deletes
+        Subscription.objects.create(user=self.users[1], plan=self.pro)
+        self.users[2].delete()
+        self.assertEqual(self.counters(self.basic), (0, 0, 1))
+        self.assertEqual(self.counters(self.pro), (2, 1, 0))
+
+        # A failed switch rolls its counters back with it
+        with self.assertRaises(services.NoActiveSubscription):
+            services.switch_plan(self.staff, self.pro)
+        self.assertEqual(self.counters(self.pro), (2, 1, 0))
+        self.assertEqual(stats.reconcile(), [])
+
+    def test_missing_counter_row_is_created(self):
+        PlanStats.objects.all().delete()
+        services.subscribe(self.users[0], self.basic)
+        services.switch_plan(self.users[0], self.pro)
+        self.assertEqual(self.counters(self.basic), (0, 0, 1))
+        self.assertEqual(self.counters(self.pro), (1, 1, 0))
+
+    def test_stats_endpoint(self):
+        services.subscribe(self.users[0], self.pro)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/v1/plans/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'plan_id': self.basic.pk, 'plan_name': 'Basic', 'active_count': 0, 'switches_in': 0, 'switches_out': 0},
+            {'plan_id': self.pro.pk, 'plan_name': 'Pro', 'active_count': 1, 'switches_in': 0, 'switches_out': 0},
+        ])
+        # user, count, page
+        self.assertEqual(len(captured), 3)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.users[0]).access_token}')
+        self.assertEqual(self.client.get('/api/v1/plans/stats/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_reconcile_command(self):
+        services.subscribe(self.users[0], self.basic)
+        services.subscribe(self.users[1], self.basic)
+        PlanStats.objects.filter(plan=self.basic).update(active_count=5)
+        PlanStats.objects.filter(plan=self.pro).delete()
+
+        out = StringIO()
+        call_command('reconcile_plan_stats', dry_run=True, stdout=out)
+        self.assertIn(f'plan {self.basic.pk}: stored 5, actual 2 (-3)', out.getvalue())
+        self.assertEqual(self.counters(self.basic)[0], 5)
+
+        out = StringIO()
+        call_command('reconcile_plan_stats', stdout=out)
+        self.assertIn('1 plan(s) with drift fixed', out.getvalue())
+        self.assertEqual(self.counters(self.basic)[0], 2)
+        self.assertEqual(self.counters(self.pro)[0], 0)
+
+
+class CurrentSubscriptionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='x')
+            for i in range(3)
+        ]
+        self.basic = Plan.objects.create(name='Basic')
+        self.pro = Plan.objects.create(name='Pro')
+
+    def pointers(self):
+        return dict(CurrentSubscription.objects.values_list('user_id', 'subscription_id'))
+
+    def active(self):
+        return dict(Subscription.objects.filter(is_active=True).values_list('user_id', 'id'))
+
+    def test_pointer_follows_every_write_path(self):
+        for user in self.users:
+            services.subscribe(user, self.basic)
+        services.switch_plan(self.users[0], self.pro)
+        services.deactivate(self.users[1])
+        self.assertEqual(self.pointers(), self.active())
+        self.assertEqual(CurrentSubscription.objects.get(user=self.users[0]).plan, self.pro)
+
+        # Direct ORM use (the admin) and deletes
+        Subscription.objects.create(user=self.users[1], plan=self.pro)
+        old = Subscription.objects.create(user=self.users[2], plan=self.pro)
+        old.is_active = False
+        old.save()
+        self.assertEqual(self.pointers(), self.active())
+        Subscription.objects.get(user=self.users[1], is_active=True).delete()
+        self.users[0].delete()
+        self.assertEqual(self.pointers(), {})
+        self.assertEqual(current.reconcile(fix=False), [])
+
+    def test_current_plan_is_a_primary_key_lookup(self):
+        services.subscribe(self.users[0], self.pro)
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(get_user_entitlements(self.users[0].pk)['plan']['name'], 'Pro')
+        self.assertNotIn('"subscription_subscription"', captured[0]['sql'])
+        self.assertIn('"subscription_currentsubscription"."user_id" = ', captured[0]['sql'])
+
+    def test_reconcile_command(self):
+        for user in self.users:
+            services.subscribe(user, self.basic)
+        first, second, _ = (CurrentSubscription.objects.get(user=user).subscription_id for user in self.users)
+        CurrentSubscription.objects.filter(user=self.users[0]).delete()
+        Subscription.objects.filter(user=self.users[1]).update(is_active=False)
+        CurrentSubscription.objects.filter(user=self.users[2]).update(plan=self.pro)
+
+        out = StringIO()
+        call_command('reconcile_current_subscriptions', dry_run=True, stdout=out)
+        self.assertIn(f'user {self.users[0].pk}: points to None, active {first}', out.getvalue())
+        self.assertIn(f'user {self.users[1].pk}: points to {second}, active None', out.getvalue())
+        self.assertIn('3 user(s) with drift found', out.getvalue())
+
+        call_command('reconcile_current_subscriptions', stdout=StringIO())
+        self.assertEqual(self.pointers(), self.active())
+        self.assertEqual(CurrentSubscription.objects.get(user=self.users[2]).plan, self.basic)
+        self.assertEqual(current.reconcile(), [])
+
+    def test_backfill(self):
+        backfill = import_module('subscription.migrations.0007_currentsubscription').backfill_pointers
+        Subscription.objects.bulk_create([
+            Subscription(user=self.users[0], plan=self.basic, is_active=False),
+            Subscription(user=self.users[0], plan=self.pro, is_active=True),
+            Subscription(user=self.users[1], plan=self.basic, is_active=True),
+        ])
+        self.assertEqual(self.pointers(), {})
+        # The backfill only needs the schema editor's connection
+        backfill(django_apps, SimpleNamespace(connection=connection))
+        self.assertEqual(self.pointers(), self.active())
+
+
+class AsyncViewsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='async@example.com', email='async@example.com', password='testpass123'
+        )
+        self.plan = Plan.objects.create(name='Pro Plan')
+        self.plan.features.add(
+            Feature.objects.create(name='Priority Support'), Feature.objects.create(name='API Access')
+        )
+        for plan in [Plan.objects.create(name='Basic Plan'), self.plan]:
+            services.subscribe(self.user, plan)
+        self.token = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.client.credentials(HTTP_AUTHORIZATION=self.token)
+
+    def async_get(self, path, headers=None, **kwargs):
+        headers = {'Authorization': self.token, **(headers or {})}
+        return async_to_sync(AsyncClient().get)(path, headers=headers, **kwargs)
+
+    def test_same_body_as_sync_views(self):
+        for name in ('features', 'plans', 'subscriptions', 'entitlements'):
+            expected = self.client.get(f'/api/v1/{name}/', HTTP_ACCEPT='application/json')
+            response = self.async_get(f'/api/v1/async/{name}/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK, name)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(response.content, expected.content, name)
+
+    def test_pagination(self):
+        Subscription.objects.bulk_create(
+            Subscription(user=self.user, plan=self.plan, is_active=False) for _ in range(25)
+        )
+        first = json.loads(self.async_get('/api/v1/async/subscriptions/').content)
+        self.assertEqual(first['count'], 27)
+        self.assertEqual(len(first['results']), 20)
+        self.assertTrue(first['next'].endswith('/api/v1/async/subscriptions/?page=2'))
+
+        second = json.loads(self.async_get('/api/v1/async/subscriptions/', query_params={'page': 2}).content)
+        self.assertEqual(len(second['results']), 7)
+        self.assertTrue(second['previous'].endswith('/api/v1/async/subscriptions/'))
+        response = self.async_get('/api/v1/async/subscriptions/', query_params={'page': 3})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_authentication_and_etag(self):
+        response = async_to_sync(AsyncClient().get)('/api/v1/async/features/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+        response = self.async_get('/api/v1/async/plans/', headers={'Authorization': 'Bearer nope'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(json.loads(response.content)['code'], 'token_not_valid')
+
+        etag = self.async_get('/api/v1/async/plans/')['ETag']
+        with CaptureQueriesContext(connection) as captured:
+            response = self.async_get('/api/v1/async/plans/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(captured), 0)
+
+    def test_warm_entitlements_do_no_queries(self):
+        self.async_get('/api/v1/async/entitlements/')
+        with CaptureQueriesContext(connection) as captured:
+            response = self.async_get('/api/v1/async/entitlements/')
+        self.assertEqual(json.loads(response.content)['plan']['name'], 'Pro Plan')
+        self.assertEqual(len(captured), 0)
+        self.assertIn('db;dur=0.000;desc="0 queries"', response['Server-Timing'])
+
+
+class BenchASGICommandTestCase(TransactionTestCase):
+    # The benchmark drives the WSGI and ASGI applications from other
+    # threads, which only see committed rows
+
+    def test_report(self):
+        out = StringIO()
+        call_command(
+            'bench_asgi', requests=3, concurrency=[1, 2], endpoints=['entitlement-detail'], stdout=out,
+        )
+        report = json.loads(out.getvalue())
+        results = report['endpoints']['entitlement-detail']
+        self.assertEqual(set(results), {'wsgi', 'asgi_sync_view', 'asgi'})
+        for levels in results.values():
+            self.assertEqual(set(levels), {'1', '2'})
+            self.assertEqual(levels['2']['requests'], 3)
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(OutboxEvent.objects.using('default').exists())
+
+
+class SubscriptionRowsSerializerTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rows@example.com', email='rows@example.com', password='x')
+        features = [Feature.objects.create(name=f'Feature {i}') for i in range(4)]
+        self.plans = [Plan.objects.create(name=name) for name in ('Basic', 'Pro', 'Empty')]
+        # Added out of id order: both paths list features by id
+        self.plans[0].features.add(features[2], features[0])
+        self.plans[1].features.add(*features)
+        Subscription.objects.bulk_create(
+            Subscription(user=self.user, plan=self.plans[i % 3], is_active=False) for i in range(25)
+        )
+        services.subscribe(self.user, self.plans[1])
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def test_same_bytes_as_nested_serializers(self):
+        for url in ('/api/v1/subscriptions/', '/api/v1/subscriptions/?page=2',
+                    '/api/v1/subscriptions/?pagination=cursor'):
+            fast = self.client.get(url)
+            with override_settings(SUBSCRIPTION_LIST_FAST_PATH=False):
+                nested = self.client.get(url)
+            self.assertEqual(fast.status_code, status.HTTP_200_OK)
+            self.assertEqual(fast.content, nested.content, url)
+
+    def test_one_feature_query_per_page(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/v1/subscriptions/')
+        # user, count, page, features of the page's plans
+        self.assertEqual(len(captured), 4)
+        plans = {row['plan']['name']: row['plan'] for row in response.json()['results']}
+        self.assertEqual([feature['name'] for feature in plans['Basic']['features']], ['Feature 0', 'Feature 2'])
+        self.assertEqual(plans['Empty']['features'], [])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('bench_serializers', rows=10, plans=2, features_per_plan=2, iterations=2, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['results']), {'nested', 'fast', 'slim'})
+        self.assertLess(report['results']['slim']['bytes'], report['results']['fast']['bytes'])
+        self.assertGreater(report['results']['fast']['serialize']['rows_per_second'], 0)
+
+
+class SparseFieldsetTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='sparse@example.com', email='sparse@example.com', password='x')
+        features = [Feature.objects.create(name=f'Feature {i}') for i in range(3)]
+        self.basic = Plan.objects.create(name='Basic')
+        self.pro = Plan.objects.create(name='Pro')
+        self.pro.features.add(*features)
+        services.subscribe(self.user, self.basic)
+        services.switch_plan(self.user, self.pro)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def get_both_paths(self, url):
+        fast = self.client.get(url)
+        with override_settings(SUBSCRIPTION_LIST_FAST_PATH=False):
+            nested = self.client.get(url)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.content, nested.content, url)
+        return fast.json()['results']
+
+    def test_subscription_fields(self):
+        rows = self.get_both_paths('/api/v1/subscriptions/?fields=id,is_active,plan.id')
+        self.assertEqual(rows[0], {'id': rows[0]['id'], 'is_active': True, 'plan': {'id': self.pro.id}})
+
+        rows = self.get_both_paths('/api/v1/subscriptions/?fields=is_active,plan')
+        self.assertEqual(rows[0], {'is_active': True, 'plan': {'id': self.pro.id, 'name': 'Pro'}})
+
+        rows = self.get_both_paths('/api/v1/subscriptions/?fields=plan.name&expand=features')
+        self.assertEqual([row['plan'] for row in rows], [
+            {'name': 'Pro', 'features': [{'id': f.id, 'name': f.name} for f in self.pro.features.order_by('id')]},
+            {'name': 'Basic', 'features': []},
+        ])
+
+        rows = self.get_both_paths('/api/v1/subscriptions/?fields=id&expand=features')
+        self.assertEqual(set(rows[0]), {'id'})
+        self.get_both_paths('/api/v1/subscriptions/?fields=id,plan.id&pagination=cursor')
+
+    def test_default_shape_unchanged(self):
+        full = self.client.get('/api/v1/subscriptions/').content
+        self.assertEqual(self.client.get('/api/v1/subscriptions/?expand=features').content, full)
+
+    def test_slim_subscriptions_skip_features(self):
+        for fast_path in (True, False):
+            with override_settings(SUBSCRIPTION_LIST_FAST_PATH=fast_path), \
+                    CaptureQueriesContext(connection) as captured:
+                self.client.get('/api/v1/subscriptions/?fields=id,is_active,plan.id')
+            # The user row may come from the authentication cache
+            queries = [query['sql'] for query in captured if 'auth_user' not in query['sql']]
+            self.assertEqual(len(queries), 2)  # count, page
+            self.assertFalse(any('subscription_plan_features' in sql for sql in queries))
+            if fast_path:
+                self.assertNotIn('subscription_plan', queries[-1])
+
+    def test_plan_fields(self):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/v1/plans/?fields=id,name')
+        self.assertEqual(response.json()['results'], [
+            {'id': self.basic.id, 'name': 'Basic'}, {'id': self.pro.id, 'name': 'Pro'},
+        ])
+        self.assertFalse(any('subscription_plan_features' in query['sql'] for query in captured))
+
+        response = self.client.get('/api/v1/plans/?fields=name&expand=features')
+        self.assertEqual(response.json()['results'][1], {
+            'name': 'Pro', 'features': [{'id': f.id, 'name': f.name} for f in self.pro.features.order_by('id')],
+        })
+
+    def test_unknown_fields_rejected(self):
+        for url in ['/api/v1/subscriptions/?fields=id,user', '/api/v1/subscriptions/?fields=plan.price',
+                    '/api/v1/subscriptions/?expand=user', '/api/v1/plans/?fields=features']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, url)
+
+
+@skipIf(renderers.msgpack is None, 'msgpack is not installed')
+class MessagePackTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='msgpack@example.com', email='msgpack@example.com', password='x')
+        self.plan = Plan.objects.create(name='Pro')
+        self.plan.features.add(Feature.objects.create(name='Analytics'))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def test_responses_negotiated(self):
+        services.subscribe(self.user, self.plan)
+        for url in ['/api/v1/subscriptions/', '/api/v1/plans/', '/api/v1/features/', '/api/v1/entitlements/']:
+            response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            self.assertEqual(
+                renderers.msgpack.unpackb(response.content, raw=False), self.client.get(url).json(), url
+            )
+
+    def test_catalog_cache_per_format(self):
+        self.client.get('/api/v1/plans/')
+        first = self.client.get('/api/v1/plans/', HTTP_ACCEPT='application/msgpack')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/v1/plans/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(second['Content-Type'], 'application/msgpack')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.client.get('/api/v1/plans/')['Content-Type'], 'application/json')
+
+    def test_request_bodies_parsed(self):
+        response = self.client.post(
+            '/api/v1/subscriptions/create/', renderers.msgpack.packb({'plan': self.plan.id}),
+            content_type='application/msgpack', HTTP_ACCEPT='application/msgpack',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(renderers.msgpack.unpackb(response.content), {'plan': self.plan.id})
+
+        response = self.client.post(
+            '/api/v1/subscriptions/create/', b'\xc1', content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('MessagePack parse error', renderers.msgpack.unpackb(response.content)['detail'])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('bench_renderers', rows=[5, 10], iterations=2, stdout=out)
+        pages = json.loads(out.getvalue())['pages']
+        self.assertEqual(set(pages), {'5', '10'})
+        self.assertLess(pages['10']['msgpack']['bytes'], pages['10']['json']['bytes'])
+
+
+class ReplicaRoutingTestCase(TransactionTestCase):
+    # A real second SQLite file, filled by sync_sqlite_replicas, so that
+    # what a request read shows which database it read from
+    alias = 'replica_test'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings[cls.alias] = dict(
+            connections.settings['default'], NAME=os.path.join(cls.directory.name, 'replica.sqlite3')
+        )
+        # Declared here rather than on the class: the runner checks the
+        # databases of every test before this alias exists
+        cls.databases = cls.databases | {cls.alias}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.alias].close()
+        del connections[cls.alias]
+        del connections.settings[cls.alias]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        user_rows.clear()
+        replicas = override_settings(DATABASE_REPLICAS=[self.alias])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+
+        self.user = User.objects.create_user(username='replica@example.com', email='replica@example.com', password='x')
+        self.basic = Plan.objects.create(name='Basic')
+        self.pro = Plan.objects.create(name='Pro')
+        services.subscribe(self.user, self.basic)
+        call_command('sync_sqlite_replicas', stdout=StringIO())
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def plan_names(self):
+        return [row['plan']['name'] for row in self.client.get('/api/v1/subscriptions/').json()['results']]
+
+    def test_reads_go_to_replica(self):
+        # Written behind the API's back: nobody is pinned, the replica lags
+        services.switch_plan(self.user, self.pro)
+        self.assertEqual(self.plan_names(), ['Basic'])
+        self.assertEqual(self.client.get('/api/v1/plans/').json()['count'], 2)
+        # Views not marked read_replica read the primary
+        self.assertEqual(self.client.get('/api/v1/entitlements/').json()['plan']['name'], 'Pro')
+
+        call_command('sync_sqlite_replicas', stdout=StringIO())
+        self.assertEqual(self.plan_names(), ['Pro', 'Basic'])
+
+    def test_writer_reads_own_writes(self):
+        response = self.client.put('/api/v1/subscriptions/update/', {'plan': self.pro.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], routers.pin_seconds())
+        self.assertTrue(routers.is_pinned(self.user.id))
+
+        # By token alone, without the cookie
+        self.client.cookies.clear()
+        self.assertEqual(self.plan_names(), ['Pro', 'Basic'])
+
+        cache.delete(routers.pin_key(self.user.id))
+        self.assertEqual(self.plan_names(), ['Basic'])
+
+        # By cookie alone, for clients whose user the middleware cannot tell
+        self.client.cookies[routers.PIN_COOKIE] = '1'
+        self.assertEqual(self.plan_names(), ['Pro', 'Basic'])
+
+    def test_failed_writes_do_not_pin(self):
+        response = self.client.post('/api/v1/subscriptions/deactivate/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post('/api/v1/subscriptions/deactivate/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_catalog_read_from_primary_after_change(self):
+        self.assertEqual(self.client.get('/api/v1/plans/').json()['count'], 2)
+        Plan.objects.create(name='Enterprise')
+        catalog.bump_version()
+        self.assertEqual(self.client.get('/api/v1/plans/').json()['count'], 3)
+
+    def test_router(self):
+        router = routers.ReplicaRouter()
+        self.assertEqual(router.db_for_read(Plan), 'default')
+        with routers.reading_from(self.alias):
+            self.assertEqual(router.db_for_read(Plan), self.alias)
+            self.assertEqual(router.db_for_write(Plan), 'default')
+            self.assertEqual(Plan.objects.get(pk=self.basic.pk)._state.db, self.alias)
+        self.assertFalse(router.allow_migrate(self.alias, 'subscription'))
+        self.assertIsNone(router.allow_migrate('default', 'subscription'))
+
+
+@override_settings(SUBSCRIPTION_SHARDS=['default', 'shard_a', 'shard_b'])
+class ShardingTestCase(TransactionTestCase):
+    # Two SQLite files next to default, so every query shows which
+    # database it went to
+    aliases = ['shard_a', 'shard_b']
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        for alias in cls.aliases:
+            connections.settings[alias] = dict(
+                connections.settings['default'], NAME=os.path.join(cls.directory.name, f'{alias}.sqlite3')
+            )
+        cls.databases = cls.databases | set(cls.aliases)
+        super().setUpClass()
+        for alias in cls.aliases:
+            call_command('migrate', database=alias, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in cls.aliases:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        user_rows.clear()
+        self.staff = User.objects.create_user(
+            username='staff@example.com', email='staff@example.com', password='x', is_staff=True, is_superuser=True
+        )
+        self.basic = Plan.objects.create(name='Basic')
+        self.pro = Plan.objects.create(name='Pro')
+        self.pro.features.add(Feature.objects.create(name='Priority Support'))
+        self.users = {}
+        for i in itertools.count():
+            if len(self.users) == 2:
+                break
+            user = User.objects.create_user(username=f'user{i}@example.com', email=f'user{i}@example.com', password='x')
+            alias = sharding.shard_for_user(user.pk)
+            if alias in self.aliases:
+                self.users.setdefault(alias, user)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        return client
+
+    def rows_on(self, alias):
+        return list(Subscription.objects.using(alias).order_by('id').values_list('user_id', 'plan_id', 'is_active'))
+
+    def subscribe_everyone(self):
+        for user in self.users.values():
+            client = self.client_for(user)
+            self.assertEqual(client.post('/api/v1/subscriptions/create/', {'plan': self.basic.pk}).status_code, 201)
+            self.assertEqual(client.put('/api/v1/subscriptions/update/', {'plan': self.pro.pk}).status_code, 200)
+
+    def test_rows_live_on_their_users_shard(self):
+        self.subscribe_everyone()
+        for alias, user in self.users.items():
+            self.assertEqual(self.rows_on(alias), [(user.pk, self.basic.pk, False), (user.pk, self.pro.pk, True)])
+            self.assertEqual(list(CurrentSubscription.objects.using(alias).values_list('user_id', 'plan_id')),
+                             [(user.pk, self.pro.pk)])
+        self.assertEqual(self.rows_on('default'), [])
+        self.assertEqual(self.counters(), {self.basic.pk: 0, self.pro.pk: 2})
+
+        client = self.client_for(self.users['shard_b'])
+        for params in ({}, {'fields': 'id,plan', 'expand': 'features'}):
+            results = client.get('/api/v1/subscriptions/', params).json()['results']
+            self.assertEqual([row['plan']['name'] for row in results], ['Pro', 'Basic'])
+        with override_settings(SUBSCRIPTION_LIST_FAST_PATH=False):
+            results = client.get('/api/v1/subscriptions/').json()['results']
+        self.assertEqual(results[0]['plan']['features'], [{'id': self.pro.features.get().pk, 'name': 'Priority Support'}])
+        self.assertEqual(client.get('/api/v1/entitlements/').json()['plan']['name'], 'Pro')
+
+    def counters(self):
+        return dict(PlanStats.objects.values_list('plan_id', 'active_count'))
+
+    def test_single_active_subscription_per_shard(self):
+        user = self.users['shard_a']
+        first = Subscription.objects.create(user=user, plan=self.basic)
+        second = Subscription.objects.create(user=user, plan=self.pro)
+        self.assertEqual(first._state.db, 'shard_a')
+        self.assertFalse(Subscription.objects.get(pk=first.pk, user=user).is_active)
+        self.assertEqual(list(user.subscriptions.filter(is_active=True)), [second])
+
+    def test_unrouted_query_raises(self):
+        with self.assertRaises(sharding.ShardKeyMissing):
+            Subscription.objects.filter(is_active=True).count()
+        # Excluding a user says nothing about where the rest live
+        with self.assertRaises(sharding.ShardKeyMissing):
+            list(Subscription.objects.exclude(user=self.staff))
+        self.assertEqual(Subscription.objects.using('shard_a').count(), 0)
+
+    def test_report_and_reconcile(self):
+        self.subscribe_everyone()
+        self.assertEqual(sharding.fan_out(lambda subscriptions: subscriptions.count()),
+                         {'default': 0, 'shard_a': 2, 'shard_b': 2})
+
+        client = self.client_for(self.staff)
+        response = client.get('/api/v1/subscriptions/shards/')
+        self.assertEqual(response.json(), [
+            {'shard': 'default', 'subscriptions': 0, 'active': 0, 'users': 0},
+            {'shard': 'shard_a', 'subscriptions': 2, 'active': 1, 'users': 1},
+            {'shard': 'shard_b', 'subscriptions': 2, 'active': 1, 'users': 1},
+        ])
+        self.assertEqual(self.client_for(self.users['shard_a']).get('/api/v1/subscriptions/shards/').status_code, 403)
+
+        self.assertEqual(stats.reconcile(fix=False), [])
+        self.assertEqual(current.reconcile(fix=False), [])
+        PlanStats.objects.filter(plan=self.pro).update(active_count=7)
+        self.assertEqual(len(stats.reconcile()), 1)
+        self.assertEqual(self.counters()[self.pro.pk], 2)
+
+    def test_export_reads_every_shard(self):
+        self.subscribe_everyone()
+        out = StringIO()
+        call_command('export_subscriptions', is_active='true', stdout=out)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            sorted((line['shard'], line['user_email'], line['plan_name']) for line in lines),
+            sorted((alias, user.email, 'Pro') for alias, user in self.users.items()),
+        )
+
+    def test_deleting_users_and_plans_reaches_their_shards(self):
+        self.subscribe_everyone()
+        self.users['shard_a'].delete()
+        self.assertEqual(self.rows_on('shard_a'), [])
+        self.assertEqual(len(self.rows_on('shard_b')), 2)
+        self.assertEqual(self.counters()[self.pro.pk], 1)
+
+        self.basic.delete()
+        self.assertEqual(self.rows_on('shard_b'), [(self.users['shard_b'].pk, self.pro.pk, True)])
+
+    def test_import_writes_to_each_shard(self):
+        path = os.path.join(self.directory.name, 'subscriptions.csv')
+        with open(path, 'w') as f:
+            f.write('user,plan,is_active\n')
+            for user in self.users.values():
+                f.write(f'{user.email},Basic,false\n{user.email},Pro,true\n')
+        call_command('import_data', 'subscriptions', path, stdout=StringIO(), stderr=StringIO())
+        for alias, user in self.users.items():
+            self.assertEqual(self.rows_on(alias), [(user.pk, self.basic.pk, False), (user.pk, self.pro.pk, True)])
+        self.assertEqual(stats.reconcile(fix=False), [])
+
+    def test_admin_shows_one_shard(self):
+        self.subscribe_everyone()
+        self.client.force_login(self.staff)
+        url = '/admin/subscription/subscription/'
+        response = self.client.get(url, {'shard': 'shard_b'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 2)
+        self.assertContains(response, self.users['shard_b'].email)
+        self.assertNotContains(response, self.users['shard_a'].email)
+
+        response = self.client.get(url, {'shard': 'shard_a', 'q': 'Pro'})
+        self.assertEqual([s.user_id for s in response.context['cl'].result_list], [self.users['shard_a'].pk])
+
+        subscription = Subscription.objects.get(user=self.users['shard_a'], is_active=True)
+        response = self.client.get(f'{url}{subscription.pk}/change/', {'_changelist_filters': 'shard=shard_a'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['original'], subscription)
@@ -0,0 +1,120 @@
+"""
+Sliding-window rate throttles with a fixed amount of state per client.
+
+DRF's throttles keep the timestamp of every request in the window and
+read, trim and write the whole list back to the cache on each request.
+These keep two counters per client instead: requests in the current fixed
+window and in the previous one. The previous window's count is weighted by
+how much of it still overlaps the sliding window, so a client at the limit
+is let through at roughly the configured rate without bursting to twice
+it at window boundaries.
+
+With THROTTLE_BACKEND = 'local' (the default) the counters live in a
+bounded in-process LRU cache of THROTTLE_CACHE_SIZE clients; the least
+recently seen clients are evicted first, and an evicted client starts over.
+Each process counts on its own, so with N workers a client can get up to N
+times the rate. 'cache' keeps the counters in the default cache (one key
+per client and window, updated with incr()) so that all workers share
+them; use it with a cache server.
+"""
+from threading import Lock
+from django.conf import settings
+from rest_framework import throttling
+from .caching import LRUCache
+
+# {cache key: (window index, previous count, current count)}
+_counters = LRUCache(maxsize=getattr(settings, 'THROTTLE_CACHE_SIZE', 100000))
+_counters_lock = Lock()
+
+
+def backend():
+    return getattr(settings, 'THROTTLE_BACKEND', 'local')
+
+
+def reset():
+    """Forget every client's counters in this process"""
+    _counters.clear()
+
+
+def estimate(previous, current, elapsed):
+    """Requests in the sliding window; ``elapsed`` is the fraction of the current window gone"""
+    return previous * (1 - elapsed) + current
+
+
+class SlidingWindowRateThrottle(throttling.SimpleRateThrottle):
+    """SimpleRateThrottle counting requests in two fixed windows instead of a timestamp list"""
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = self.timer()
+        window, offset = divmod(now, self.duration)
+        self.window = int(window)
+        self.elapsed = offset / self.duration
+        if backend() == 'cache':
+            allowed = self._count_in_cache()
+        else:
+            allowed = self._count_locally()
+        return allowed if allowed else self.throttle_failure()
+
+    def _count_locally(self):
+        with _counters_lock:
+            window, previous, current = _counters.get(self.key, (self.window, 0, 0))
+            if window != self.window:
+                previous = current if window == self.window - 1 else 0
+                current = 0
+            self.previous, self.current = previous, current
+            if estimate(previous, current, self.elapsed) >= self.num_requests:
+                _counters.set(self.key, (self.window, previous, current))
+                return False
+            _counters.set(self.key, (self.window, previous, current + 1))
+            return True
+
+    def _window_key(self, window):
+        return f'{self.key}:{window}'
+
+    def _count_in_cache(self):
+        current_key = self._window_key(self.window)
+        counts = self.cache.get_many([self._window_key(self.window - 1), current_key])
+        self.previous = counts.get(self._window_key(self.window - 1), 0)
+        self.current = counts.get(current_key, 0)
+        if estimate(self.previous, self.current, self.elapsed) >= self.num_requests:
+            return False
+        # The counter outlives its window so that the next one can weigh it
+        if not self.cache.add(current_key, 1, self.duration * 2):
+            try:
+                self.cache.incr(current_key)
+            except ValueError:
+                # Expired between add() and incr()
+                self.cache.set(current_key, 1, self.duration * 2)
+        return True
+
+    def wait(self):
+        """Seconds until the sliding window has room for one more request"""
+        remaining = (1 - self.elapsed) * self.duration
+        if self.current >= self.num_requests:
+            # Not before the next window, once this one's weight has dropped enough
+            return remaining + max(0.0, self.duration * (1 - self.num_requests / self.current))
+        if not self.previous:
+            return 0.0
+        # Later in this window, when the previous window weighs little enough
+        needed = 1 - (self.num_requests - self.current) / self.previous
+        return max(0.0, (needed - self.elapsed) * self.duration)
+
+
+# DRF's classes first: they pick the key and rate, then defer to the
+# sliding window for the counting
+class AnonRateThrottle(throttling.AnonRateThrottle, SlidingWindowRateThrottle):
+    pass
+
+
+class UserRateThrottle(throttling.UserRateThrottle, SlidingWindowRateThrottle):
+    pass
+
+
+class ScopedRateThrottle(throttling.ScopedRateThrottle, SlidingWindowRateThrottle):
+    """The rate named by the view's ``throttle_scope``; views without one are not throttled"""
@@ -4,10 +4,16 @@ from .views import (
     FeatureListAPIView,
     PlanCreateAPIView,
     PlanListAPIView,
+    PlanStatsAPIView,
     SubscriptionCreateAPIView,
     SubscriptionListAPIView,
     SubscriptionUpdateAPIView,
     SubscriptionDeactivateAPIView,
+    SubscriptionExportAPIView,
+    ShardReportAPIView,
+    EntitlementAPIView,
+    UserEntitlementAPIView,
+    EntitlementBatchAPIView,
 )
 
 app_name = 'subscriptions'
@@ -20,10 +26,18 @@ urlpatterns = [
     # Plan endpoints
     path('plans/', PlanListAPIView.as_view(), name='plan-list'),
     path('plans/create/', PlanCreateAPIView.as_view(), name='plan-create'),
+    path('plans/stats/', PlanStatsAPIView.as_view(), name='plan-stats'),
     
     # Subscription endpoints
     path('subscriptions/', SubscriptionListAPIView.as_view(), name='subscription-list'),
     path('subscriptions/create/', SubscriptionCreateAPIView.as_view(), name='subscription-create'),
     path('subscriptions/update/', SubscriptionUpdateAPIView.as_view(), name='subscription-update'),
     path('subscriptions/deactivate/', SubscriptionDeactivateAPIView.as_view(), name='subscription-deactivate'),
+    path('subscriptions/export/', SubscriptionExportAPIView.as_view(), name='subscription-export'),
+    path('subscriptions/shards/', ShardReportAPIView.as_view(), name='subscription-shards'),
+
+    # Entitlement endpoints
+    path('entitlements/', EntitlementAPIView.as_view(), name='entitlement-detail'),
+    path('entitlements/<int:user_id>/', UserEntitlementAPIView.as_view(), name='user-entitlement-detail'),
+    path('entitlements/batch/', EntitlementBatchAPIView.as_view(), name='entitlement-batch'),
 ]
\ No newline at end of file
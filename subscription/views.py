@@ -1,28 +1,169 @@
-from rest_framework import generics, status
+import json
+from rest_framework import generics, serializers, status
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotModified, StreamingHttpResponse
 from django.utils.decorators import method_decorator
-from django.db.models import Prefetch
+from django.utils.functional import cached_property
+from django.utils.http import parse_etags
+from django.db.models import Count, Prefetch, Q
+from django.db.models.functions import Coalesce
+from . import catalog, exporters, hashing, instrumentation, routers, sharding
+from .authentication import CachedJWTAuthentication
+from .bulk import chunked
+from .entitlements import batch_chunk_size, get_user_entitlements, iter_user_entitlements
+from .idempotency import idempotent
 from .models import Subscription, Plan, Feature
+from .pagination import SubscriptionCursorPagination
+from .services import NoActiveSubscription, deactivate
 from .serializers import (
     PlanCreateSerializer,
     SubscriptionListSerializer, 
+    SubscriptionRowsSerializer,
     SubscriptionCreateSerializer,
     SubscriptionUpdateSerializer,
     PlanSerializer,
-    FeatureSerializer
+    FeatureSerializer,
+    EntitlementSerializer,
+    EntitlementBatchSerializer,
+    SubscriptionExportSerializer,
+    SubscriptionDeactivateSerializer,
+    PlanStatsSerializer,
+    ShardReportSerializer,
 )
 
+# Hot read endpoints take the user from the token and a cache of user rows
+# instead of running a SELECT per request
+CACHED_AUTHENTICATION_CLASSES = [CachedJWTAuthentication, SessionAuthentication]
+
+class CatalogCacheMixin:
+    """
+    Serve a catalog listing from rendered bytes cached under the catalog version.
+
+    The version changes whenever a plan, a feature or a plan's features change
+    (see subscription.signals), so cached bytes never need invalidating and a
+    matching If-None-Match is answered with 304 without touching the database.
+    The browsable API is rendered per user and is never cached. The version
+    lives in the default cache, so workers only see each other's changes
+    through a shared cache server (``manage.py check --deploy`` warns
+    about a per-process one).
+    """
+
+    def validate_query_params(self):
+        """Raise ValidationError for query parameters the listing rejects"""
+
+    def list(self, request, *args, **kwargs):
+        format = request.accepted_renderer.format
+        if format == 'api':
+            return super().list(request, *args, **kwargs)
+
+        # An invalid query is a 400 even when the ETag matches
+        self.validate_query_params()
+        version = catalog.get_version()
+        etag = catalog.etag(version, format)
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            return HttpResponseNotModified(headers={'ETag': etag})
+
+        key = catalog.response_key(version, format, request.get_full_path())
+        cached = catalog.get_response(key)
+        if cached is not None:
+            content_type, content = cached
+            return HttpResponse(content, content_type=content_type, headers={'ETag': etag})
+
+        # Right after a change a lagging replica would have these bytes cached
+        # under the new version
+        if routers.current_read_alias() is not None and catalog.recently_changed():
+            with routers.reading_from(None):
+                response = super().list(request, *args, **kwargs)
+        else:
+            response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        response.add_post_render_callback(
+            lambda rendered: catalog.set_response(key, (rendered['Content-Type'], rendered.content))
+        )
+        return response
+
+class SparseFieldsetMixin:
+    """
+    ``?fields=`` and ``?expand=`` for list endpoints.
+
+    Without ``fields`` the full representation is rendered. With it, only
+    the named fields are: ``plan.id`` picks a field of a nested object, a
+    bare ``plan`` picks all of its fields but the expandable ones, and those
+    (``expand=features``) are added only on request. ``fieldset`` is what
+    SparseFieldsMixin serializers and get_queryset() work from.
+    """
+    # {field: None, or the fields of the nested object}
+    sparse_fields = {}
+    # {expandable field: path of the object it belongs to}
+    expandable = {}
+
+    @cached_property
+    def fieldset(self):
+        params = self.request.query_params
+        expand = {name for name in params.get('expand', '').split(',') if name}
+        unknown = sorted(expand - set(self.expandable))
+        if unknown:
+            raise serializers.ValidationError({'expand': [f'Unknown expansion "{name}".' for name in unknown]})
+        if not params.get('fields'):
+            return None
+
+        fieldset = {}
+        for name in params['fields'].split(','):
+            head, _, nested = name.strip().partition('.')
+            if head not in self.sparse_fields or (nested and nested not in (self.sparse_fields[head] or ())):
+                raise serializers.ValidationError({'fields': [f'Unknown field "{name}".']})
+            if self.sparse_fields[head] is None:
+                fieldset[head] = None
+            elif nested:
+                fieldset.setdefault(head, {})[nested] = None
+            else:
+                fieldset.setdefault(head, {}).update(dict.fromkeys(self.sparse_fields[head]))
+
+        for name in expand:
+            target = fieldset
+            for step in self.expandable[name]:
+                target = target.get(step) if target is not None else None
+            # Expanding inside an object that was not selected adds nothing
+            if target is not None:
+                target[name] = None
+        return fieldset
+
+    def validate_fieldset(self):
+        """The parsed fieldset; raises ValidationError for an unknown field or expansion"""
+        return self.fieldset
+
+    def wants(self, *path):
+        """Whether the field at ``path`` is rendered"""
+        fieldset = self.fieldset
+        for step in path:
+            if fieldset is None:
+                return True
+            if step not in fieldset:
+                return False
+            fieldset = fieldset[step]
+        return True
+
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many'):
+            kwargs['fieldset'] = self.fieldset
+        return super().get_serializer(*args, **kwargs)
+
 class FeatureCreateAPIView(generics.CreateAPIView):
     """Create a new feature"""
     serializer_class = FeatureSerializer
     permission_classes = [IsAuthenticated]
 
-class FeatureListAPIView(generics.ListAPIView):
+class FeatureListAPIView(CatalogCacheMixin, generics.ListAPIView):
     """List all features"""
+    authentication_classes = CACHED_AUTHENTICATION_CLASSES
     serializer_class = FeatureSerializer
     permission_classes = [IsAuthenticated]
+    read_replica = True
     queryset = Feature.objects.all()
 
 class PlanCreateAPIView(generics.CreateAPIView):
@@ -30,6 +171,7 @@ class PlanCreateAPIView(generics.CreateAPIView):
     serializer_class = PlanCreateSerializer
     permission_classes = [IsAuthenticated]
     
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -43,23 +185,60 @@ class SubscriptionCreateAPIView(generics.CreateAPIView):
     serializer_class = SubscriptionCreateSerializer
     permission_classes = [IsAuthenticated]
     
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        # Deactivate any existing active subscriptions
-        Subscription.objects.filter(user=self.request.user, is_active=True).update(is_active=False)
-        serializer.save(user=self.request.user)
+        # SubscriptionCreateSerializer.create deactivates the previous subscription
+        serializer.save()
+
 
+class SubscriptionListAPIView(SparseFieldsetMixin, generics.ListAPIView):
+    """
+    List all subscriptions of the authenticated user with optimized queries.
 
-class SubscriptionListAPIView(generics.ListAPIView):
-    """List all subscriptions of the authenticated user with optimized queries"""
+    ?fields=id,start_date,is_active,plan,plan.id,plan.name narrows the rows
+    and ?expand=features adds the plan's features to a narrowed row; the plan
+    is joined and its features fetched only when they are rendered.
+    """
+    authentication_classes = CACHED_AUTHENTICATION_CLASSES
     serializer_class = SubscriptionListSerializer
     permission_classes = [IsAuthenticated]
+    read_replica = True
+    sparse_fields = {'id': None, 'start_date': None, 'is_active': None, 'plan': ('id', 'name')}
+    expandable = {'features': ('plan',)}
+    
+    @property
+    def paginator(self):
+        # ?pagination=cursor switches to keyset pagination: no COUNT(*) and
+        # constant cost per page however deep the history goes
+        request = getattr(self, 'request', None)
+        if request is not None and request.query_params.get('pagination') == 'cursor':
+            self.pagination_class = SubscriptionCursorPagination
+        return super().paginator
     
     def get_queryset(self):
-        return Subscription.objects.filter(user=self.request.user)\
-            .select_related('plan')\
-            .prefetch_related(
-                Prefetch('plan__features', queryset=Feature.objects.all())
-            ).order_by('-start_date')
+        queryset = Subscription.objects.filter(user=self.request.user).order_by('-start_date', '-id')
+        if self.fast_path:
+            return queryset.values(*SubscriptionRowsSerializer.columns(self.fieldset))
+        if self.wants('plan'):
+            # Plans cannot be joined from a subscription shard
+            queryset = queryset.prefetch_related('plan') if sharding.is_sharded() else queryset.select_related('plan')
+        if self.wants('plan', 'features'):
+            queryset = queryset.prefetch_related(
+                Prefetch('plan__features', queryset=Feature.objects.order_by('id'))
+            )
+        return queryset
+
+    @property
+    def fast_path(self):
+        return getattr(settings, 'SUBSCRIPTION_LIST_FAST_PATH', True)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.fast_path and kwargs.get('many'):
+            return SubscriptionRowsSerializer(*args, self.fieldset)
+        return super().get_serializer(*args, **kwargs)
 
 
 class SubscriptionUpdateAPIView(generics.UpdateAPIView):
@@ -68,14 +247,13 @@ class SubscriptionUpdateAPIView(generics.UpdateAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Subscription.objects.filter(user=self.request.user, is_active=True)
+        # Through the related manager the row comes back with its user set
+        return self.request.user.subscriptions.filter(is_active=True)
     
     def get_object(self):
-        try:
-            return self.get_queryset().get()
-        except Subscription.DoesNotExist:
-            return None
+        return self.get_queryset().first()
     
+    @idempotent
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
         if not instance:
@@ -86,7 +264,14 @@ class SubscriptionUpdateAPIView(generics.UpdateAPIView):
         
         serializer = self.get_serializer(instance, data=request.data)
         serializer.is_valid(raise_exception=True)
-        new_subscription = serializer.save()
+        try:
+            new_subscription = serializer.save()
+        except NoActiveSubscription:
+            # Deactivated by a concurrent request since get_object()
+            return Response(
+                {"detail": "No active subscription found"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
         
         # Return the new subscription data
         return Response(
@@ -96,32 +281,143 @@ class SubscriptionUpdateAPIView(generics.UpdateAPIView):
 
 class SubscriptionDeactivateAPIView(generics.GenericAPIView):
     """Deactivate user's current subscription"""
+    serializer_class = SubscriptionDeactivateSerializer
     permission_classes = [IsAuthenticated]
     
-    def get_queryset(self):
-        return Subscription.objects.filter(user=self.request.user, is_active=True)
-    
+    @idempotent
     def post(self, request, *args, **kwargs):
-        active_subscription = self.get_queryset().first()
-        if not active_subscription:
+        try:
+            deactivate(request.user)
+        except NoActiveSubscription:
             return Response(
                 {"detail": "No active subscription found"}, 
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        active_subscription.is_active = False
-        active_subscription.save()
-        
         return Response(
             {"detail": "Subscription deactivated successfully"},
             status=status.HTTP_200_OK
         )
 
 # Additional view for listing available plans
-class PlanListAPIView(generics.ListAPIView):
-    """List all available plans with features"""
+class PlanListAPIView(CatalogCacheMixin, SparseFieldsetMixin, generics.ListAPIView):
+    """
+    List all available plans with features.
+
+    ?fields=id,name narrows the plans and ?expand=features adds the features
+    back; they are only prefetched when rendered.
+    """
+    authentication_classes = CACHED_AUTHENTICATION_CLASSES
     serializer_class = PlanSerializer
     permission_classes = [IsAuthenticated]
+    read_replica = True
+    sparse_fields = {'id': None, 'name': None}
+    expandable = {'features': ()}
     
+    def validate_query_params(self):
+        self.validate_fieldset()
+
     def get_queryset(self):
-        return Plan.objects.prefetch_related('features').all()
\ No newline at end of file
+        if self.wants('features'):
+            return Plan.objects.prefetch_related('features').all()
+        return Plan.objects.all()
+
+class PlanStatsAPIView(generics.ListAPIView):
+    """Active subscribers and switches per plan, read from the PlanStats counters (staff only)"""
+    serializer_class = PlanStatsSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        # One row per plan; plans nobody has subscribed to yet have no counters
+        return Plan.objects.annotate(
+            active_count=Coalesce('stats__active_count', 0),
+            switches_in=Coalesce('stats__switches_in', 0),
+            switches_out=Coalesce('stats__switches_out', 0),
+        ).order_by('id')
+
+class EntitlementAPIView(generics.GenericAPIView):
+    """Features the authenticated user is currently entitled to (served from cache)"""
+    authentication_classes = CACHED_AUTHENTICATION_CLASSES
+    serializer_class = EntitlementSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_user_entitlements(request.user.id))
+
+
+class UserEntitlementAPIView(generics.GenericAPIView):
+    """Features any user is currently entitled to, for internal services (staff only)"""
+    serializer_class = EntitlementSerializer
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, user_id, *args, **kwargs):
+        return Response(get_user_entitlements(user_id))
+
+
+class EntitlementBatchAPIView(generics.GenericAPIView):
+    """
+    Entitlements of many users at once, for backend jobs (staff only).
+
+    POST {"user_ids": [...]} or {"emails": [...]}; the response streams one
+    JSON object per user, in request order, as NDJSON.
+    """
+    serializer_class = EntitlementBatchSerializer
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = iter_user_entitlements(**serializer.validated_data)
+        lines = (
+            ''.join(json.dumps(result, separators=(',', ':')) + '\n' for result in chunk)
+            for chunk in chunked(results, batch_chunk_size())
+        )
+        return StreamingHttpResponse(lines, content_type=exporters.CONTENT_TYPES['ndjson'])
+
+class SubscriptionExportAPIView(generics.GenericAPIView):
+    """
+    Stream every subscription with its user's email and plan name (staff only).
+
+    ?output=ndjson (default) or csv; filter with is_active, plan and
+    start_date_from/start_date_to (ISO 8601, end exclusive).
+    """
+    serializer_class = SubscriptionExportSerializer
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        # A plain dict so that absent booleans stay absent instead of False
+        serializer = self.get_serializer(data=request.query_params.dict())
+        serializer.is_valid(raise_exception=True)
+        options = dict(serializer.validated_data)
+        output = options.pop('output')
+
+        response = StreamingHttpResponse(
+            exporters.export(output, **options), content_type=exporters.CONTENT_TYPES[output]
+        )
+        response['Content-Disposition'] = f'attachment; filename="subscriptions.{output}"'
+        return response
+
+
+class ShardReportAPIView(generics.GenericAPIView):
+    """Subscription, active subscription and user counts of every shard, queried in parallel (staff only)"""
+    serializer_class = ShardReportSerializer
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        counts = sharding.fan_out(lambda subscriptions: subscriptions.aggregate(
+            subscriptions=Count('id'),
+            active=Count('id', filter=Q(is_active=True)),
+            users=Count('user_id', distinct=True),
+        ))
+        rows = [{'shard': alias, **aggregates} for alias, aggregates in counts.items()]
+        return Response(self.get_serializer(rows, many=True).data)
+
+
+def metrics(request):
+    """Per-route request histograms and the hashing pool of this process, in Prometheus text format"""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', None)
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        instrumentation.registry.render() + hashing.render(), content_type='text/plain; version=0.0.4'
+    )